@@ -3,14 +3,21 @@
 import sys
 import traceback
 from datetime import datetime
+from typing import List
 
 from botbuilder.core import (
     BotFrameworkAdapter,
     BotFrameworkAdapterSettings,
     ConversationState,
+    MessageFactory,
     TurnContext,
 )
-from botbuilder.schema import ActivityTypes, Activity
+from botbuilder.schema import ActivityTypes, Activity, ResourceResponse
+from botframework.connector.auth import ClaimsIdentity
+
+from cached_authentication import TokenValidationCache
+from helpers.timing import TIMINGS
+from outbound_batching_middleware import merge_activities
 
 
 class AdapterWithErrorHandler(BotFrameworkAdapter):
@@ -18,9 +25,12 @@ class AdapterWithErrorHandler(BotFrameworkAdapter):
         self,
         settings: BotFrameworkAdapterSettings,
         conversation_state: ConversationState,
+        token_cache: TokenValidationCache = None,
     ):
         super().__init__(settings)
         self._conversation_state = conversation_state
+        # Identities of the tokens validated already, None to validate every request
+        self.token_cache = token_cache
 
         # Catch-all for errors.
         async def on_error(context: TurnContext, error: Exception):
@@ -30,11 +40,11 @@ class AdapterWithErrorHandler(BotFrameworkAdapter):
             print(f"\n [on_turn_error] unhandled error: {error}", file=sys.stderr)
             traceback.print_exc()
 
-            # Send a message to the user
-            await context.send_activity("The bot encountered an error or bug.")
-            await context.send_activity(
-                "To continue to run this bot, please fix the bot source code."
-            )
+            # Send a message to the user, in a single call with the trace below
+            activities = [
+                MessageFactory.text("The bot encountered an error or bug."),
+                MessageFactory.text("To continue to run this bot, please fix the bot source code."),
+            ]
             # Send a trace activity if we're talking to the Bot Framework Emulator
             if context.activity.channel_id == "emulator":
                 # Create a trace activity that contains the error object
@@ -47,10 +57,32 @@ class AdapterWithErrorHandler(BotFrameworkAdapter):
                     value_type="https://www.botframework.com/schemas/error",
                 )
                 # Send a trace activity, which will be displayed in Bot Framework Emulator
-                await context.send_activity(trace_activity)
+                activities.append(trace_activity)
+            await context.send_activities(merge_activities(activities))
 
             # Clear out state
             nonlocal self
             await self._conversation_state.delete(context)
 
         self.on_turn_error = on_error
+
+    async def _authenticate_request(
+        self, request: Activity, auth_header: str
+    ) -> ClaimsIdentity:
+        with TIMINGS.span("auth"):
+            if not auth_header or self.token_cache is None:
+                return await super()._authenticate_request(request, auth_header)
+            key = self.token_cache.key(auth_header, request.channel_id, request.service_url)
+            identity = self.token_cache.get(key)
+            if identity is None:
+                identity = await super()._authenticate_request(request, auth_header)
+                self.token_cache.put(key, identity)
+            return identity
+
+    async def send_activities(
+        self, context: TurnContext, activities: List[Activity]
+    ) -> List[ResourceResponse]:
+        if not activities:
+            return []  # ie all of them buffered by the OutboundBatchingMiddleware
+        with TIMINGS.span("send"):
+            return await super().send_activities(context, activities)
@@ -0,0 +1,121 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Admission control of the requests to the bot: a bound on the turns in flight and on those waiting for one."""
+
+import asyncio
+import math
+import time
+from collections import deque
+from http import HTTPStatus
+from typing import Deque, Iterable, Optional
+
+from aiohttp import web
+
+from helpers.timing import TIMINGS
+
+
+class AdmissionController:
+    """
+    Lets at most max_in_flight requests be handled at once, and at most max_queue more wait for one of
+    them to end, for queue_timeout seconds at most, in arrival order. The others are rejected at once:
+    with 429 when the queue is full, with 503 when they waited too long, and a Retry-After of the time
+    the queue would take to drain at the recent pace of the turns.
+    The waiters are created in the loop of the request, so the controller can be created before the
+    workers are forked. A max_in_flight of 0 admits every request.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 64,
+        max_queue: int = 128,
+        queue_timeout: float = 2.0,
+        paths: Iterable[str] = ("/api/messages",),
+        max_retry_after: int = 30,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.paths = frozenset(paths)
+        self.max_retry_after = max_retry_after
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        # Moving average of the durations of the admitted requests, in seconds
+        self._duration = 0.1
+        self.stats = {"admitted": 0, "queued": 0, "rejected_queue_full": 0, "rejected_timeout": 0, "max_queue_depth": 0}
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> Optional[HTTPStatus]:
+        """Waits for a slot: None once the request holds one, or the status rejecting it."""
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            self.stats["admitted"] += 1
+            return None
+        if len(self._waiters) >= self.max_queue:
+            self.stats["rejected_queue_full"] += 1
+            return HTTPStatus.TOO_MANY_REQUESTS
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.stats["queued"] += 1
+        self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], len(self._waiters))
+        start = time.perf_counter()
+        try:
+            # Unlike wait_for, wait leaves the waiter alone, so that a slot handed over is never lost
+            await asyncio.wait((waiter,), timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            self._leave(waiter)
+            raise
+        finally:
+            TIMINGS.histogram("admission.wait").observe(time.perf_counter() - start)
+        if not waiter.done():
+            self._leave(waiter)
+            self.stats["rejected_timeout"] += 1
+            return HTTPStatus.SERVICE_UNAVAILABLE
+        self.stats["admitted"] += 1
+        return None
+
+    def release(self, duration: float = None) -> None:
+        """Ends a request admitted by acquire, and hands its slot to the first waiter, if any."""
+        if duration is not None:
+            self._duration += (duration - self._duration) / 16
+        if self._waiters:
+            self._waiters.popleft().set_result(None)
+        else:
+            self.in_flight -= 1
+
+    def _leave(self, waiter: asyncio.Future) -> None:
+        if waiter.done():
+            # Handed a slot while it was cancelled
+            self.release()
+        else:
+            waiter.cancel()
+            self._waiters.remove(waiter)
+
+    def retry_after(self) -> int:
+        """Seconds for the queue to drain, at least 1."""
+        drain = (len(self._waiters) + 1) * self._duration / max(self.max_in_flight, 1)
+        return min(self.max_retry_after, max(1, math.ceil(drain)))
+
+    def middleware(self):
+        """
+        The aiohttp middleware admitting the requests to the paths. Put it before the other middlewares,
+        ie bot_telemetry_middleware which reads the body, so that a rejected request costs no parsing.
+        """
+
+        @web.middleware
+        async def admission_middleware(request: web.Request, handler):
+            if self.max_in_flight <= 0 or request.path not in self.paths:
+                return await handler(request)
+            status = await self.acquire()
+            if status is not None:
+                return web.Response(status=status, headers={"Retry-After": str(self.retry_after())})
+            start = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                self.release(time.perf_counter() - start)
+
+        return admission_middleware
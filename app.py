@@ -8,93 +8,412 @@ This sample shows how to create a bot that demonstrates the following:
 - Handle user interruptions for such things as `Help` or `Cancel`.
 - Prompt for and validate requests for information from the user.
 """
+import time
+
+_IMPORT_START = time.perf_counter()
+
+# pylint: disable=wrong-import-position
+import json
+import os
 from http import HTTPStatus
 
 from aiohttp import web
 from aiohttp.web import Request, Response, json_response
-from botbuilder.core import (
-    BotFrameworkAdapterSettings,
-    ConversationState,
-    MemoryStorage,
-    UserState,
-    TelemetryLoggerMiddleware,
-)
-from botbuilder.core.integration import aiohttp_error_middleware
 from botbuilder.schema import Activity
-from botbuilder.applicationinsights import ApplicationInsightsTelemetryClient
-from botbuilder.integration.applicationinsights.aiohttp import (
-    AiohttpTelemetryProcessor,
-    bot_telemetry_middleware,
-)
 
 from config import DefaultConfig,printConfig
-from dialogs import MainDialog, BookingDialog
-from bots import DialogAndWelcomeBot
+from admission_control import AdmissionController
+from helpers.metrics import ACTIVITY_TYPES, CONTENT_TYPE, METRICS, EventLoopLagMonitor, bounded_label, channel_label
+from helpers.request_context import REQUEST_BODY
+from helpers.timing import TIMINGS
 
-from adapter_with_error_handler import AdapterWithErrorHandler
-from flight_booking_recognizer import FlightBookingRecognizer
+# Seconds spent importing the modules of the bot, building it, and answering its first request.
+# The modules of the components are only imported when create_app builds them, and those of
+# Application Insights only when it is the telemetry sink.
+STARTUP = {"import": time.perf_counter() - _IMPORT_START}
 
 CONFIG = DefaultConfig()
 
-# Create adapter.
-# See https://aka.ms/about-bot-adapter to learn more about how bots work.
-SETTINGS = BotFrameworkAdapterSettings(CONFIG.APP_ID, CONFIG.APP_PASSWORD)
-
-# Create MemoryStorage, UserState and ConversationState
-MEMORY = MemoryStorage()
-USER_STATE = UserState(MEMORY)
-CONVERSATION_STATE = ConversationState(MEMORY)
-
-# Create adapter.
-# See https://aka.ms/about-bot-adapter to learn more about how bots work.
-ADAPTER = AdapterWithErrorHandler(SETTINGS, CONVERSATION_STATE)
-
-# Create telemetry client.
-# Note the small 'client_queue_size'.  This is for demonstration purposes.  Larger queue sizes
-# result in fewer calls to ApplicationInsights, improving bot performance at the expense of
-# less frequent updates.
-INSTRUMENTATION_KEY = CONFIG.APPINSIGHTS_INSTRUMENTATION_KEY
-TELEMETRY_CLIENT = ApplicationInsightsTelemetryClient(
-    INSTRUMENTATION_KEY, telemetry_processor=AiohttpTelemetryProcessor(), client_queue_size=10
+# The components of the bot, built by create_app
+SETTINGS = None
+MEMORY = None
+USER_STATE = None
+CONVERSATION_STATE = None
+TOKEN_CACHE = None
+ADAPTER = None
+OPENID_METADATA = None
+TELEMETRY_SINK = None
+TELEMETRY_CLIENT = None
+TRANSCRIPT_RECORDER = None
+LOCAL_RECOGNIZER = None
+RECOGNIZER = None
+BOOKING_DIALOG = None
+DIALOG = None
+BOT = None
+WARM_UP = None
+
+
+def build_bot():
+    """Builds the storage, the adapter, the clients and the dialogs of the bot, once."""
+    # pylint: disable=global-statement,import-outside-toplevel,too-many-locals,too-many-statements
+    global SETTINGS, MEMORY, USER_STATE, CONVERSATION_STATE, TOKEN_CACHE, ADAPTER, OPENID_METADATA
+    global TELEMETRY_SINK, TELEMETRY_CLIENT, TRANSCRIPT_RECORDER, LOCAL_RECOGNIZER, RECOGNIZER
+    global BOOKING_DIALOG, DIALOG, BOT, WARM_UP
+    if BOT is not None:
+        return
+
+    start = time.perf_counter()
+    from botbuilder.core import BotFrameworkAdapterSettings, ConversationState, UserState
+    from botframework.connector.auth import AuthenticationConstants, ChannelValidation
+
+    from adapter_with_error_handler import AdapterWithErrorHandler
+    from bots import DialogAndWelcomeBot
+    from buffered_telemetry_client import BufferedTelemetryClient, ForwardingSink, JsonLinesSink, attach_aiohttp_request_body
+    from cached_authentication import OpenIdMetadataRefresher, TokenValidationCache
+    from command_router_middleware import CommandRouterMiddleware
+    from conversation_lock_middleware import ConversationLockMiddleware
+    from dialogs import MainDialog, BookingDialog
+    from flight_booking_recognizer import FlightBookingRecognizer
+    from local_flight_booking_recognizer import LocalFlightBookingRecognizer
+    from outbound_batching_middleware import OutboundBatchingMiddleware
+    from warm_up import WarmUp, run_synthetic_turns
+    from helpers.command_matcher import COMMANDS, DEFAULT_PHRASES
+    imported = time.perf_counter()
+
+    # Create adapter.
+    # See https://aka.ms/about-bot-adapter to learn more about how bots work.
+    SETTINGS = BotFrameworkAdapterSettings(CONFIG.APP_ID, CONFIG.APP_PASSWORD)
+
+    # Create the storage, UserState and ConversationState.
+    # The memory storage is bounded so that abandoned conversations do not leak memory,
+    # the SQLite storage keeps the conversations across restarts and is shared by the worker processes.
+    # The SQLite rows are compact by default, rows pickled before are still read.
+    if CONFIG.STATE_STORE == "sqlite" or CONFIG.WORKERS > 1:
+        import pickle
+        import dialog_state_codec
+        from sqlite_storage import SqliteStorage
+
+        MEMORY = SqliteStorage(
+            CONFIG.STATE_DB_PATH,
+            dumps=dialog_state_codec.dumps if CONFIG.STATE_CODEC == "compact" else pickle.dumps,
+            loads=dialog_state_codec.loads,
+        )
+    else:
+        from bounded_memory_storage import BoundedMemoryStorage
+
+        MEMORY = BoundedMemoryStorage(
+            max_entries=CONFIG.STATE_MAX_ENTRIES,
+            max_bytes=CONFIG.STATE_MAX_BYTES,
+            idle_ttl=CONFIG.STATE_IDLE_TTL,
+            sweep_interval=CONFIG.STATE_SWEEP_INTERVAL,
+        )
+    USER_STATE = UserState(MEMORY)
+    CONVERSATION_STATE = ConversationState(MEMORY)
+
+    # Create adapter.
+    # See https://aka.ms/about-bot-adapter to learn more about how bots work.
+    # The tokens of the channel are validated once, and cached until they expire.
+    TOKEN_CACHE = TokenValidationCache(CONFIG.AUTH_TOKEN_CACHE_SIZE) if CONFIG.AUTH_TOKEN_CACHE_SIZE > 0 else None
+    ADAPTER = AdapterWithErrorHandler(SETTINGS, CONVERSATION_STATE, TOKEN_CACHE)
+
+    # The signing keys of the channel and of the emulator are fetched at startup and refreshed in the background.
+    OPENID_METADATA = OpenIdMetadataRefresher(
+        [
+            ChannelValidation.open_id_metadata_endpoint or AuthenticationConstants.TO_BOT_FROM_CHANNEL_OPENID_METADATA_URL,
+            AuthenticationConstants.TO_BOT_FROM_EMULATOR_OPENID_METADATA_URL,
+        ],
+        refresh_interval=CONFIG.OPENID_REFRESH_INTERVAL,
+    )
+
+    # Create telemetry client.
+    # The turns only append their telemetry to a bounded buffer; a background flusher sends it by batches.
+    # The Application Insights queue holds a whole batch, so that it sends once per batch, off the event loop.
+    # Its processor reads the activity of each item, which messages attaches to the items of its turn.
+    if CONFIG.TELEMETRY_SINK == "appinsights":
+        from botbuilder.applicationinsights import ApplicationInsightsTelemetryClient
+        from botbuilder.integration.applicationinsights.aiohttp import AiohttpTelemetryProcessor
+
+        TELEMETRY_SINK = ForwardingSink(
+            ApplicationInsightsTelemetryClient(
+                CONFIG.APPINSIGHTS_INSTRUMENTATION_KEY,
+                telemetry_processor=AiohttpTelemetryProcessor(),
+                client_queue_size=CONFIG.TELEMETRY_BATCH_SIZE + 1,
+            ),
+            attach_aiohttp_request_body,
+        )
+    else:
+        TELEMETRY_SINK = JsonLinesSink(CONFIG.TELEMETRY_SINK)
+    TELEMETRY_CLIENT = BufferedTelemetryClient(
+        TELEMETRY_SINK,
+        capacity=CONFIG.TELEMETRY_BUFFER_SIZE,
+        batch_size=CONFIG.TELEMETRY_BATCH_SIZE,
+        flush_interval=CONFIG.TELEMETRY_FLUSH_INTERVAL,
+        overflow=CONFIG.TELEMETRY_OVERFLOW,
+    )
+
+    # Code for enabling activity and personal information logging.
+    # Comment the two following lines to stop connecting with Insights
+    # TELEMETRY_LOGGER_MIDDLEWARE = TelemetryLoggerMiddleware(telemetry_client=TELEMETRY_CLIENT, log_personal_information=True)
+    # ADAPTER.use(TELEMETRY_LOGGER_MIDDLEWARE)
+
+    # Record the activities received and sent, before anything else so that the merged replies are recorded.
+    if CONFIG.TRANSCRIPT_PATH:
+        from transcript_recorder import TranscriptRecorder, TranscriptRecorderMiddleware
+
+        if CONFIG.WORKERS > 1 and "{pid}" not in CONFIG.TRANSCRIPT_PATH:
+            raise ValueError('TranscriptPath must contain "{pid}" when there are several workers')
+        TRANSCRIPT_RECORDER = TranscriptRecorder(CONFIG.TRANSCRIPT_PATH)
+        ADAPTER.use(TranscriptRecorderMiddleware(TRANSCRIPT_RECORDER))
+
+    # Run the turns of a conversation one after the other, so that each one sees the state saved by the previous one.
+    ADAPTER.use(ConversationLockMiddleware())
+
+    # Send the activities of a turn together when it ends (before the other middlewares, so that they see them merged).
+    ADAPTER.use(OutboundBatchingMiddleware())
+
+    # Answer help and cancel before the dialogs, without loading the dialog state.
+    # The dialogs understand the same phrases, when the router is not in the pipeline.
+    COMMANDS.compile(
+        json.loads(CONFIG.INTERRUPT_PHRASES) if CONFIG.INTERRUPT_PHRASES else DEFAULT_PHRASES,
+        CONFIG.INTERRUPT_LOCALE,
+    )
+    ADAPTER.use(CommandRouterMiddleware(CONVERSATION_STATE, COMMANDS))
+
+    # Create dialogs and Bot.
+    # The local recognizer (and its date and number models) is only built if it is used: as the fast
+    # path in front of LUIS, or as the recognizer when LUIS is not configured.
+    luis_is_configured = CONFIG.LUIS_APP_ID and CONFIG.LUIS_API_KEY and CONFIG.LUIS_API_HOST_NAME
+    if not luis_is_configured or CONFIG.LOCAL_RECOGNIZER_THRESHOLD <= 1:
+        LOCAL_RECOGNIZER = LocalFlightBookingRecognizer()
+    RECOGNIZER = FlightBookingRecognizer(CONFIG, local_recognizer=LOCAL_RECOGNIZER)
+    BOOKING_DIALOG = BookingDialog()
+    DIALOG = MainDialog(RECOGNIZER, BOOKING_DIALOG, telemetry_client=TELEMETRY_CLIENT)
+    BOT = DialogAndWelcomeBot(CONVERSATION_STATE, USER_STATE, DIALOG, TELEMETRY_CLIENT)
+
+    # Time the stages of the turns, and record a sample of them as traces.
+    TIMINGS.sample_rate = CONFIG.TIMING_SAMPLE_RATE
+
+    # Pay the one-time costs before reporting ready, in each worker: the connections to LUIS, the
+    # signing keys (without an app id, the requests are not authenticated), and a synthetic booking,
+    # which loads the date models of the prompts and renders the cards.
+    # The refresher of the signing keys is started by start_authentication, out of reach of the
+    # timeout of the warm-up, which only waits for its first fetch.
+    def synthetic_turns():
+        # Through a bot of its own, built like BOT but with the local recognizer and without telemetry,
+        # so that the synthetic booking neither calls LUIS nor is reported as a booking
+        local_config = DefaultConfig()
+        local_config.LUIS_APP_ID = ""
+        recognizer = FlightBookingRecognizer(
+            local_config, local_recognizer=LOCAL_RECOGNIZER or LocalFlightBookingRecognizer()
+        )
+        bot = DialogAndWelcomeBot(CONVERSATION_STATE, USER_STATE, MainDialog(recognizer, BookingDialog()), None)
+        return run_synthetic_turns(bot.on_turn, CONVERSATION_STATE, USER_STATE)
+
+    warm_up_steps = {"luis": RECOGNIZER.warm_up}
+    if CONFIG.APP_ID:
+        warm_up_steps["openid"] = OPENID_METADATA.wait_refreshed
+    if CONFIG.WARM_UP_TURNS:
+        warm_up_steps["turns"] = synthetic_turns
+    WARM_UP = WarmUp(warm_up_steps, CONFIG.WARM_UP_TIMEOUT)
+
+    # The gauges of /metrics, read from the components when it is scraped
+    METRICS.gauge("requests_in_flight", "Requests to /api/messages being handled.", lambda: ADMISSION.in_flight)
+    METRICS.gauge("requests_queued", "Requests to /api/messages waiting to be handled.", lambda: ADMISSION.queue_depth)
+    METRICS.gauge(
+        "requests_rejected_total",
+        "Requests to /api/messages shed by the admission control.",
+        lambda: {
+            ("queue_full",): ADMISSION.stats["rejected_queue_full"],
+            ("timeout",): ADMISSION.stats["rejected_timeout"],
+        },
+        ("reason",),
+        metric_type="counter",
+    )
+    if hasattr(MEMORY, "entry_count"):
+        METRICS.gauge("state_entries", "Items in the state store.", lambda: MEMORY.entry_count)
+    if hasattr(MEMORY, "size_bytes"):
+        METRICS.gauge("state_bytes", "Size of the state store, in bytes.", lambda: MEMORY.size_bytes)
+    METRICS.gauge("event_loop_lag_seconds", "Lag of the event loop at its last measure.", lambda: LOOP_LAG.lag)
+
+    STARTUP["import"] += imported - start
+    STARTUP["construction"] = time.perf_counter() - imported
+
+
+def report_startup():
+    """Sends the startup times as the startup event, and prints them in the DEV environment."""
+    measurements = dict(STARTUP)
+    if WARM_UP.ready:
+        measurements["warm_up"] = WARM_UP.durations["total"]
+    TELEMETRY_CLIENT.track_event("startup", measurements=measurements)
+    if CONFIG.ENVIRONMENT == 'DEV':
+        print("Startup:", ", ".join(f"{phase} {seconds:.3f}s" for phase, seconds in measurements.items()))
+
+
+# Bound the turns in flight, and shed the requests beyond the wait queue before their body is read.
+ADMISSION = AdmissionController(
+    max_in_flight=CONFIG.ADMISSION_MAX_IN_FLIGHT,
+    max_queue=CONFIG.ADMISSION_MAX_QUEUE,
+    queue_timeout=CONFIG.ADMISSION_QUEUE_TIMEOUT,
 )
 
-# Code for enabling activity and personal information logging.
-# Comment the two following lines to stop connecting with Insights
-# TELEMETRY_LOGGER_MIDDLEWARE = TelemetryLoggerMiddleware(telemetry_client=TELEMETRY_CLIENT, log_personal_information=True)
-# ADAPTER.use(TELEMETRY_LOGGER_MIDDLEWARE)
 
-# Create dialogs and Bot
-RECOGNIZER = FlightBookingRecognizer(CONFIG)
-BOOKING_DIALOG = BookingDialog()
-DIALOG = MainDialog(RECOGNIZER, BOOKING_DIALOG, telemetry_client=TELEMETRY_CLIENT)
-BOT = DialogAndWelcomeBot(CONVERSATION_STATE, USER_STATE, DIALOG, TELEMETRY_CLIENT)
+# Count the turns, and measure the event loop lag for /metrics.
+TURNS = METRICS.counter("turns_total", "Activities processed on /api/messages.", ("channel", "type"))
+LOOP_LAG = EventLoopLagMonitor(CONFIG.METRICS_LOOP_LAG_INTERVAL)
 
 
 # Listen for incoming requests on /api/messages.
 async def messages(req: Request) -> Response:
     # Main bot message handler.
-    if "application/json" in req.headers["Content-Type"]:
-        body = await req.json()
-    else:
-        return Response(status=HTTPStatus.UNSUPPORTED_MEDIA_TYPE)
+    start = time.perf_counter()
+    with TIMINGS.turn() as trace:
+        if "application/json" in req.headers["Content-Type"]:
+            with TIMINGS.span("parse"):
+                body = await req.json()
+                activity = Activity().deserialize(body)
+        else:
+            return Response(status=HTTPStatus.UNSUPPORTED_MEDIA_TYPE)
+        if CONFIG.TELEMETRY_SINK == "appinsights":
+            REQUEST_BODY.set(body)
+
+        if trace is not None:
+            trace.properties.update(
+                activity_type=activity.type,
+                channel_id=activity.channel_id,
+                conversation_id=activity.conversation.id if activity.conversation else None,
+            )
+        auth_header = req.headers["Authorization"] if "Authorization" in req.headers else ""
 
-    activity = Activity().deserialize(body)
-    auth_header = req.headers["Authorization"] if "Authorization" in req.headers else ""
+        response = await ADAPTER.process_activity(activity, auth_header, BOT.on_turn)
+        # Once authenticated, and with labels bounded to the known channels and activity types
+        TURNS.inc(channel_label(activity.channel_id), bounded_label(activity.type, ACTIVITY_TYPES))
 
-    response = await ADAPTER.process_activity(activity, auth_header, BOT.on_turn)
+    if "first_request" not in STARTUP:
+        STARTUP["first_request"] = time.perf_counter() - start
+        report_startup()
     if response:
         return json_response(data=response.body, status=response.status)
     return Response(status=HTTPStatus.OK)
- 
+
+
+async def start_storage(app: web.Application):
+    # The bounded memory storage sweeps the idle conversations, the SQLite storage has a connection to close
+    if hasattr(MEMORY, "start_sweeper"):
+        MEMORY.start_sweeper()
+
+
+async def close_storage(app: web.Application):
+    if hasattr(MEMORY, "stop_sweeper"):
+        await MEMORY.stop_sweeper()
+    elif hasattr(MEMORY, "close"):
+        await MEMORY.close()
+
+async def start_telemetry(app: web.Application):
+    TELEMETRY_CLIENT.start_flusher()
+
+
+async def stop_telemetry(app: web.Application):
+    await TELEMETRY_CLIENT.stop_flusher()
+
+
+async def start_timings(app: web.Application):
+    TIMINGS.start_exporter(TELEMETRY_CLIENT, CONFIG.TIMING_EXPORT_INTERVAL)
+
+
+async def stop_timings(app: web.Application):
+    await TIMINGS.stop_exporter(TELEMETRY_CLIENT)
+
+
+async def start_metrics(app: web.Application):
+    # In each worker: the loop lag is that of its own loop, and its samples are labelled with its pid
+    if CONFIG.WORKERS > 1:
+        METRICS.const_labels["pid"] = str(os.getpid())
+    LOOP_LAG.start()
+
+
+async def stop_metrics(app: web.Application):
+    await LOOP_LAG.stop()
+
+
+async def metrics(req: Request) -> Response:
+    return Response(body=METRICS.render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def start_authentication(app: web.Application):
+    # Without an app id, the requests are not authenticated
+    if CONFIG.APP_ID:
+        OPENID_METADATA.start()
+
+
+async def stop_authentication(app: web.Application):
+    await OPENID_METADATA.stop()
+
+
+async def close_recognizer(app: web.Application):
+    await RECOGNIZER.close()
+
+async def close_transcript(app: web.Application):
+    if TRANSCRIPT_RECORDER is not None:
+        TRANSCRIPT_RECORDER.close()
+
+
+async def start_warm_up(app: web.Application):
+    # In the background, so that the server listens meanwhile and answers /health/live
+    WARM_UP.start()
+
+
+async def stop_warm_up(app: web.Application):
+    await WARM_UP.stop()
+
+
+# Liveness: the process serves requests. Readiness: the warm-up ended, the bot can take traffic.
+async def health_live(req: Request) -> Response:
+    return json_response({"status": "live"})
+
+
+async def health_ready(req: Request) -> Response:
+    if not WARM_UP.ready:
+        return json_response({"status": "warming up"}, status=HTTPStatus.SERVICE_UNAVAILABLE)
+    return json_response({"status": "ready", "warm_up": WARM_UP.durations, "errors": WARM_UP.errors})
+
+
 # we create the following function so that it can be called on application deployment
 # On the Azure web app, update <Startup Command> with:
 # python3.9 -m aiohttp.web -H 0.0.0.0 -P 8000 app:create_app
 def create_app(argv):
+    # pylint: disable=import-outside-toplevel
+    print("running Dev environment" if CONFIG.ENVIRONMENT == 'DEV' else "running Production environment")
     if CONFIG.ENVIRONMENT == 'DEV':
         print("Creating Application")
         printConfig(CONFIG) 
-    APP = web.Application(middlewares=[bot_telemetry_middleware, aiohttp_error_middleware])
+    build_bot()
+    from botbuilder.core.integration import aiohttp_error_middleware
+
+    # The admission middleware goes first, so that the requests it sheds are not read.
+    # No bot_telemetry_middleware: it keeps the body by thread, which the buffered items are not sent from.
+    APP = web.Application(middlewares=[ADMISSION.middleware(), aiohttp_error_middleware])
     APP.router.add_post("/api/messages", messages)
+    APP.router.add_get("/health/live", health_live)
+    APP.router.add_get("/health/ready", health_ready)
+    if CONFIG.METRICS_PATH:
+        APP.router.add_get(CONFIG.METRICS_PATH, metrics)
+    # The warm-up stops first, before the storage and the clients it uses are closed
+    APP.on_cleanup.append(stop_warm_up)
+    APP.on_startup.append(start_storage)
+    APP.on_cleanup.append(close_storage)
+    APP.on_startup.append(start_authentication)
+    APP.on_cleanup.append(stop_authentication)
+    APP.on_cleanup.append(close_recognizer)
+    APP.on_startup.append(start_timings)
+    APP.on_cleanup.append(stop_timings)
+    APP.on_startup.append(start_metrics)
+    APP.on_cleanup.append(stop_metrics)
+    # After stop_timings, so that the last export is sent
+    APP.on_startup.append(start_telemetry)
+    APP.on_cleanup.append(stop_telemetry)
+    APP.on_cleanup.append(close_transcript)
+    # Last, once the storage and the telemetry are started
+    APP.on_startup.append(start_warm_up)
     if CONFIG.ENVIRONMENT == 'DEV':
         print("Application created")
     return APP
@@ -104,6 +423,11 @@ if __name__ == "__main__":
     try:
         if CONFIG.ENVIRONMENT == 'DEV':
             print("Now running the web app")
-        web.run_app(APP, host=CONFIG.HOST, port=CONFIG.PORT)
+        if CONFIG.WORKERS > 1 and LOCAL_RECOGNIZER is not None:
+            # Load the date and number models before forking, so that the workers share them
+            LOCAL_RECOGNIZER.recognize_text("book a flight from Paris to London on May 5th 2022 for 500 dollars")
+        from workers import run_workers
+
+        run_workers(APP, CONFIG.HOST, CONFIG.PORT, CONFIG.WORKERS)
     except Exception as error:
         raise error
@@ -0,0 +1,401 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""
+Load test of whole booking conversations.
+
+Scripted conversations cover every step of the booking waterfall (details given up front or step by
+step, date reprompts, help and cancel interruptions, a declined confirmation), and random ones mix
+these paths. They run concurrently through DialogAndWelcomeBot with the local recognizer, either on
+TestAdapter instances or through the aiohttp app (activities posted with the expectReplies delivery
+mode, the app needs AppInsightsInstrumentationKey to be set). Every reply is checked against the
+script, LUIS is never called.
+
+    python -m benchmarks.bench_conversations --conversations 500 --concurrency 50
+    python -m benchmarks.bench_conversations --mode app --tracemalloc
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+import tracemalloc
+from datetime import date, timedelta
+from typing import List, NamedTuple, Optional, Tuple
+
+from botbuilder.core import ConversationState, UserState
+from botbuilder.core.adapters import TestAdapter
+from botbuilder.schema import Activity, ActivityTypes, ChannelAccount, ConversationAccount
+
+import dialog_state_codec
+from bounded_memory_storage import BoundedMemoryStorage, pickled_size
+from config import DefaultConfig
+
+CHANNEL_ID = "bench"
+USER = ChannelAccount(id="user", name="user")
+BOT = ChannelAccount(id="bot", name="Bot")
+
+CITIES = ["Paris", "London", "Berlin", "Rome", "Madrid", "Lisbon", "Marseille", "Toronto"]
+
+# Replies expected after each kind of user turn
+WELCOME = "<welcome card>"
+TICKET = "<flight ticket card>"
+ASK_INTENT = "What kind of flight are you looking for?"
+ASK_ORIGIN = "From what city will you be travelling?"
+ASK_DESTINATION = "To what city would you like to travel?"
+ASK_START_DATE = "Could you give me a departure date?"
+ASK_END_DATE = "And when would you like to return?"
+REPROMPT_DATE = "for best results, please enter your travel date"
+ASK_BUDGET = "what is your budget for this flight?"
+ASK_CONFIRM = "Please confirm that you would like to book a flight"
+HELP = "Show Help..."
+CANCELLED = "Cancelling"
+DECLINED = "I apologize this service could not help you."
+
+
+class Turn(NamedTuple):
+    text: Optional[str]  # None for the conversation update adding the user
+    expect: str
+
+
+class Script(NamedTuple):
+    name: str
+    turns: List[Turn]
+
+
+def date_text(day: date) -> str:
+    return f"{day.day} {day.strftime('%B').lower()} {day.year}"
+
+
+def booking_script(
+    name: str,
+    rng: random.Random,
+    upfront=(),
+    bad_dates: int = 0,
+    help_at: str = None,
+    cancel_at: str = None,
+    confirm: bool = True,
+) -> Script:
+    """
+    Builds a booking conversation. upfront lists the details given in the first utterance
+    (origin, destination, dates, budget), the others are answered to the bot's prompts.
+    bad_dates incomplete dates are given before each date, help_at and cancel_at name the
+    prompt at which the user asks for help or cancels.
+    """
+    origin, destination = rng.sample(CITIES, 2)
+    start = date(2023, 1, 1) + timedelta(days=rng.randrange(300))
+    end = start + timedelta(days=rng.randrange(1, 30))
+    budget = str(rng.randrange(100, 2000, 50))
+
+    utterance = "book a flight"
+    if "origin" in upfront:
+        utterance += f" from {origin}"
+    if "destination" in upfront:
+        utterance += f" to {destination}"
+    if "dates" in upfront:
+        utterance += f" starting {date_text(start)} and returning {date_text(end)}"
+    if "budget" in upfront:
+        utterance += f" with a budget of {budget}"
+
+    prompts = [
+        ("origin", ASK_ORIGIN, origin),
+        ("destination", ASK_DESTINATION, destination),
+        ("start_date", ASK_START_DATE, date_text(start)),
+        ("end_date", ASK_END_DATE, date_text(end)),
+        ("budget", ASK_BUDGET, budget),
+    ]
+
+    turns = [Turn(None, WELCOME), Turn("hello", ASK_INTENT)]
+    pending = utterance
+    for slot, prompt, answer in prompts:
+        if slot in upfront or (slot.endswith("_date") and "dates" in upfront):
+            continue
+        turns.append(Turn(pending, prompt))
+        if slot == help_at:
+            turns.append(Turn("help", HELP))
+        if slot == cancel_at:
+            turns.append(Turn("cancel", CANCELLED))
+            return Script(name, turns)
+        if slot.endswith("_date"):
+            for _ in range(bad_dates):
+                turns.append(Turn(rng.choice(["sometime in june", "next month", "soon"]), REPROMPT_DATE))
+        pending = answer
+    turns.append(Turn(pending, ASK_CONFIRM))
+    turns.append(Turn("yes" if confirm else "no", TICKET if confirm else DECLINED))
+    return Script(name, turns)
+
+
+def scripted_conversations(rng: random.Random) -> List[Script]:
+    everything = ("origin", "destination", "dates", "budget")
+    return [
+        booking_script("step by step", rng),
+        booking_script("all up front", rng, upfront=everything),
+        booking_script("date reprompts", rng, upfront=("origin", "destination"), bad_dates=1),
+        booking_script("help", rng, help_at="destination"),
+        booking_script("cancel", rng, upfront=("origin",), cancel_at="start_date"),
+        booking_script("declined", rng, upfront=everything, confirm=False),
+    ]
+
+
+def random_conversation(rng: random.Random, index: int) -> Script:
+    slots = ("origin", "destination", "dates", "budget")
+    prompts = ("origin", "destination", "start_date", "end_date", "budget")
+    return booking_script(
+        f"random {index}",
+        rng,
+        upfront=tuple(slot for slot in slots if rng.random() < 0.5),
+        bad_dates=1 if rng.random() < 0.2 else 0,
+        help_at=rng.choice(prompts) if rng.random() < 0.1 else None,
+        cancel_at=rng.choice(prompts) if rng.random() < 0.05 else None,
+        confirm=rng.random() < 0.8,
+    )
+
+
+def make_activity(conversation_id: str, text: Optional[str]) -> Activity:
+    if text is None:
+        return Activity(
+            type=ActivityTypes.conversation_update,
+            channel_id=CHANNEL_ID,
+            from_property=USER,
+            recipient=BOT,
+            conversation=ConversationAccount(id=conversation_id),
+            members_added=[USER],
+            service_url="https://bench",
+        )
+    return Activity(
+        type=ActivityTypes.message,
+        text=text,
+        channel_id=CHANNEL_ID,
+        from_property=USER,
+        recipient=BOT,
+        conversation=ConversationAccount(id=conversation_id),
+        service_url="https://bench",
+    )
+
+
+def check_replies(turn: Turn, replies: List[Activity]) -> bool:
+    if turn.expect in (WELCOME, TICKET):
+        return any(reply.attachments for reply in replies)
+    return any(turn.expect in (reply.text or "") for reply in replies)
+
+
+class AdapterDriver:
+    """Runs each conversation on its own TestAdapter, all sharing one bot and storage."""
+
+    def __init__(self):
+        # pylint: disable=import-outside-toplevel
+        from bots import DialogAndWelcomeBot
+        from command_router_middleware import CommandRouterMiddleware
+        from conversation_lock_middleware import ConversationLockMiddleware
+        from dialogs import BookingDialog, MainDialog
+        from flight_booking_recognizer import FlightBookingRecognizer
+        from local_flight_booking_recognizer import LocalFlightBookingRecognizer
+        from outbound_batching_middleware import OutboundBatchingMiddleware
+
+        config = DefaultConfig()
+        config.LUIS_APP_ID = ""
+        self.storage = BoundedMemoryStorage()
+        recognizer = FlightBookingRecognizer(config, local_recognizer=LocalFlightBookingRecognizer())
+        dialog = MainDialog(recognizer, BookingDialog())
+        conversation_state = ConversationState(self.storage)
+        self.bot = DialogAndWelcomeBot(conversation_state, UserState(self.storage), dialog, None)
+        # As in the app, the turns of a conversation are serialized, the replies of a turn are sent
+        # together, and help and cancel are answered before the bot
+        self.conversation_lock = ConversationLockMiddleware()
+        self.outbound_batching = OutboundBatchingMiddleware()
+        self.command_router = CommandRouterMiddleware(conversation_state)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def open(self, conversation_id: str):
+        template = make_activity(conversation_id, "")
+        adapter = TestAdapter(self.bot.on_turn, template)
+        return adapter.use(self.conversation_lock).use(self.outbound_batching).use(self.command_router)
+
+    async def send(self, adapter: TestAdapter, conversation_id: str, text: Optional[str]) -> List[Activity]:
+        adapter.activity_buffer.clear()
+        await adapter.receive_activity(make_activity(conversation_id, text))
+        return list(adapter.activity_buffer)
+
+
+class AppDriver:
+    """Posts the activities to the aiohttp app, and gets the replies in the responses."""
+
+    def __init__(self):
+        # The benchmark runs offline: unless told otherwise, the telemetry is serialized but not sent
+        if "TelemetrySink" not in os.environ:
+            DefaultConfig.TELEMETRY_SINK = os.devnull
+        # pylint: disable=import-outside-toplevel
+        import app as bot_app
+
+        self._bot_app = bot_app
+        self._app = bot_app.create_app(None)
+        self.storage = bot_app.MEMORY
+        self._server = None
+        self._session = None
+
+    async def start(self):
+        # pylint: disable=import-outside-toplevel
+        import aiohttp
+        from aiohttp.test_utils import TestServer
+
+        self._server = TestServer(self._app)
+        await self._server.start_server()
+        # The turns are timed once the worker is ready, as a load balancer would route them
+        await self._bot_app.WARM_UP.wait()
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0)
+        )
+
+    async def stop(self):
+        await self._session.close()
+        await self._server.close()
+
+    def open(self, conversation_id: str):
+        return None
+
+    async def send(self, _, conversation_id: str, text: Optional[str]) -> List[Activity]:
+        return await self.post(make_activity(conversation_id, text))
+
+    async def post(self, activity: Activity) -> List[Activity]:
+        """Posts an activity, and returns the replies."""
+        activity.delivery_mode = "expectReplies"
+        async with self._session.post(
+            self._server.make_url("/api/messages"), json=activity.serialize()
+        ) as response:
+            if response.status != 200:
+                raise Exception(f"[AppDriver]: HTTP {response.status}")
+            body = await response.json()
+        return [Activity().deserialize(reply) for reply in (body or {}).get("activities", [])]
+
+
+class Results:
+    def __init__(self):
+        self.latencies = []
+        self.state_sizes = []
+        self.compact_state_sizes = []
+        self.failures = []
+        self.conversations = 0
+
+
+async def state_size(storage, conversation_id: str) -> Tuple[int, int]:
+    """Pickled and compact sizes of the conversation and user states."""
+    keys = [f"{CHANNEL_ID}/conversations/{conversation_id}", f"{CHANNEL_ID}/users/{USER.id}"]
+    items = await storage.read(keys)
+    return (
+        sum(pickled_size(item) for item in items.values()),
+        sum(len(dialog_state_codec.dumps(item)) for item in items.values()),
+    )
+
+
+async def run_conversation(driver, script: Script, conversation_id: str, results: Results):
+    adapter = driver.open(conversation_id)
+    largest_state, largest_compact_state = 0, 0
+    for turn in script.turns:
+        start = time.perf_counter()
+        replies = await driver.send(adapter, conversation_id, turn.text)
+        results.latencies.append(time.perf_counter() - start)
+        if not check_replies(turn, replies):
+            results.failures.append(
+                (script.name, turn.text, turn.expect, [reply.text for reply in replies])
+            )
+            break
+        pickled, compact = await state_size(driver.storage, conversation_id)
+        largest_state, largest_compact_state = max(largest_state, pickled), max(largest_compact_state, compact)
+    results.state_sizes.append(largest_state)
+    results.compact_state_sizes.append(largest_compact_state)
+    results.conversations += 1
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def main(args):
+    rng = random.Random(args.seed)
+    driver = AppDriver() if args.mode == "app" else AdapterDriver()
+    await driver.start()
+
+    scripts = scripted_conversations(rng)
+    scripts += [random_conversation(rng, index) for index in range(args.conversations - len(scripts))]
+
+    # Load the recognizers' models before measuring
+    for index, script in enumerate(scripted_conversations(rng)):
+        await run_conversation(driver, script, f"warm-up-{index}", Results())
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    memory_before = tracemalloc.get_traced_memory()[0] if args.tracemalloc else 0
+
+    results = Results()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def run(index: int, script: Script):
+        async with semaphore:
+            await run_conversation(driver, script, f"conversation-{index}", results)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run(index, script) for index, script in enumerate(scripts)))
+    elapsed = time.perf_counter() - start
+
+    if args.tracemalloc:
+        memory_after, memory_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    await driver.stop()
+
+    latencies = sorted(results.latencies)
+    print(
+        f"{args.mode}: {results.conversations} conversations, {len(latencies)} turns,"
+        f" concurrency {args.concurrency}"
+    )
+    print(
+        f"throughput      {len(latencies) / elapsed:.0f} turns/s"
+        f"  {results.conversations / elapsed:.1f} conversations/s"
+    )
+    print(
+        f"turn latency    mean={statistics.mean(latencies) * 1000:.2f}ms"
+        f"  p50={percentile(latencies, 0.50) * 1000:.2f}ms"
+        f"  p95={percentile(latencies, 0.95) * 1000:.2f}ms"
+        f"  p99={percentile(latencies, 0.99) * 1000:.2f}ms"
+        f"  max={latencies[-1] * 1000:.2f}ms"
+    )
+    print(
+        f"state size      mean={statistics.mean(results.state_sizes):.0f}B"
+        f"  max={max(results.state_sizes)}B per conversation (pickled, at its largest)"
+    )
+    print(
+        f"                mean={statistics.mean(results.compact_state_sizes):.0f}B"
+        f"  max={max(results.compact_state_sizes)}B per conversation (compact codec, at its largest)"
+    )
+    if isinstance(driver.storage, BoundedMemoryStorage):
+        print(
+            f"state store     {driver.storage.entry_count} entries"
+            f"  {driver.storage.size_bytes / 1024:.0f}KiB retained"
+        )
+    if args.tracemalloc:
+        print(
+            f"memory          peak={(memory_peak - memory_before) / min(args.concurrency, len(scripts)) / 1024:.1f}KiB"
+            f" per concurrent conversation"
+            f"  retained={(memory_after - memory_before) / results.conversations / 1024:.1f}KiB per conversation"
+        )
+    for name, text, expect, replies in results.failures[:10]:
+        print(f"FAILED {name}: {text!r} expected {expect!r}, got {replies!r}")
+    if results.failures:
+        raise SystemExit(f"{len(results.failures)} conversations did not go as scripted")
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    PARSER.add_argument("--mode", choices=("adapter", "app"), default="adapter")
+    PARSER.add_argument("--conversations", type=int, default=200)
+    PARSER.add_argument("--concurrency", type=int, default=50)
+    PARSER.add_argument("--seed", type=int, default=0)
+    PARSER.add_argument(
+        "--tracemalloc", action="store_true", help="measure memory (slows the turns down)"
+    )
+    asyncio.run(main(PARSER.parse_args()))
@@ -0,0 +1,127 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""
+Cost of filling the booking slots of multi-entity utterances, rescanning versus indexing the entities.
+
+The rescanning lookup is LuisHelper._get_entity: every slot rescans the $instance lists of its entity and
+of its type. The indexed one is the single-pass index which was tried instead: the best-scoring instance
+of every entity and the closest instance of every type are found in one pass per type, shared by the slots
+of that type. The utterances carry every slot once (the local recognizer's, ie "from Paris to London"),
+then several times, as long utterances listing alternatives do; the slot values must be the same.
+
+    python -m benchmarks.bench_entity_index --entities 2 4 8
+"""
+
+import argparse
+import random
+import timeit
+from typing import Dict, List, Tuple
+
+from botbuilder.core import RecognizerResult
+
+from helpers.luis_helper import LuisHelper, luis_entities_type
+from local_flight_booking_recognizer import LocalFlightBookingRecognizer
+
+UTTERANCE = "book a flight from Paris to London from May 5th 2022 to May 12th 2022 for 500 dollars"
+
+
+def index_slots(recognizer_result) -> Dict[Tuple[str, str], object]:
+    """The slot values found by one pass over the instances of each type, with the rules of _get_entity."""
+    entities = recognizer_result.entities or {}
+    instances = entities.get("$instance") or {}
+    keys_by_type: Dict[str, List[str]] = {}
+    for key, type_name in luis_entities_type.items():
+        keys_by_type.setdefault(type_name, []).append(key)
+
+    slots = {}
+    for type_name, keys in keys_by_type.items():
+        values, type_instances = entities.get(type_name), instances.get(type_name) or ()
+        # [key, start, end, closest position, its distance] of the keys with a scored instance
+        targets = []
+        for key in keys:
+            slots[key, type_name] = None
+            best, best_score = None, 0
+            for metadata in instances.get(key) or () if entities.get(key) else ():
+                if metadata.get("score", 0) > best_score:
+                    best, best_score = metadata, metadata["score"]
+            if best is not None and values is not None:
+                targets.append([key, best["startIndex"], best["endIndex"], None, 100])
+        for position, metadata in enumerate(type_instances):
+            start, end = metadata["startIndex"], metadata["endIndex"]
+            for target in targets:
+                distance = abs(start - target[1]) + abs(end - target[2])
+                if distance < target[4]:
+                    target[3], target[4] = position, distance
+        for key, _, _, position, _ in targets:
+            if position is not None and position < len(values):
+                value = values[position]
+                slots[key, type_name] = (
+                    value.capitalize() if type_name == "geographyV2_city"
+                    else value["timex"][0] if type_name == "datetime"
+                    else value
+                )
+    return slots
+
+
+def make_result(count: int, rng: random.Random) -> RecognizerResult:
+    """A recognizer result shaped like LuisUtil's, with count instances of every slot entity and type."""
+    entities = {"$instance": {}}
+    position = 0
+
+    def add(name: str, value: object, length: int, score: float = None):
+        metadata = {"startIndex": position, "endIndex": position + length, "text": "x" * length, "type": name}
+        if score is not None:
+            metadata["score"] = score
+        entities.setdefault(name, []).append(value)
+        entities["$instance"].setdefault(name, []).append(metadata)
+
+    for index in range(count):
+        for key, type_name in luis_entities_type.items():
+            value = {
+                "geographyV2_city": f"city{index}",
+                "datetime": {"timex": [f"2022-05-{index % 28 + 1:02d}"], "type": "date"},
+                "number": 100 + index,
+            }[type_name]
+            length = rng.randint(4, 12)
+            add(key, value if type_name != "datetime" else f"day {index}", length, rng.uniform(0.5, 1.0))
+            add(type_name, value, length)
+            position += length + 1
+    return RecognizerResult(text="", intents={}, entities=entities)
+
+
+def fill_rescanning(recognizer_result) -> list:
+    return [
+        LuisHelper._get_entity(recognizer_result, key, type_name)
+        for key, type_name in luis_entities_type.items()
+    ]
+
+
+def fill_indexed(recognizer_result) -> list:
+    slots = index_slots(recognizer_result)
+    return [slots[key, type_name] for key, type_name in luis_entities_type.items()]
+
+
+def bench(name: str, recognizer_result, repeat: int) -> None:
+    if fill_rescanning(recognizer_result) != fill_indexed(recognizer_result):
+        raise SystemExit(f"{name}: the indexed slots differ from the rescanned ones")
+    rescanning = min(timeit.repeat(lambda: fill_rescanning(recognizer_result), number=repeat, repeat=5)) / repeat
+    indexed = min(timeit.repeat(lambda: fill_indexed(recognizer_result), number=repeat, repeat=5)) / repeat
+    print(
+        f"{name:<22} rescanning={rescanning * 1e6:8.1f}us  indexed={indexed * 1e6:8.1f}us"
+        f"  speedup={rescanning / indexed:.2f}x"
+    )
+
+
+def main(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    bench("local recognizer", LocalFlightBookingRecognizer().recognize_text(UTTERANCE), args.repeat)
+    for count in args.entities:
+        bench(f"{count} per slot ({count * 10} entities)", make_result(count, rng), max(1, args.repeat // count))
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    PARSER.add_argument("--entities", type=int, nargs="+", default=[2, 4, 8])
+    PARSER.add_argument("--repeat", type=int, default=2000)
+    PARSER.add_argument("--seed", type=int, default=0)
+    main(PARSER.parse_args())
@@ -0,0 +1,87 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""
+Throughput of the conversation state stores.
+
+Each simulated turn reads the state of its conversation, updates it and writes it back,
+as ConversationState does. Turns of different conversations run concurrently.
+
+    python -m benchmarks.bench_storage --conversations 200 --turns 20 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from botbuilder.core import MemoryStorage
+
+from bounded_memory_storage import BoundedMemoryStorage
+from sqlite_storage import SqliteStorage
+
+
+def make_state(turn: int) -> dict:
+    # Roughly the size and shape of a booking conversation's DialogState
+    return {
+        "DialogState": {
+            "dialog_stack": [
+                {"id": "MainDialog", "state": {"stepIndex": 1, "values": {}}},
+                {"id": "BookingDialog", "state": {"stepIndex": turn % 7, "options": "x" * 800}},
+            ]
+        }
+    }
+
+
+async def run_turns(storage, conversations: int, turns: int, concurrency: int) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def turn(conversation: int, index: int):
+        key = f"bench/conversations/{conversation}"
+        async with semaphore:
+            start = time.perf_counter()
+            items = await storage.read([key])
+            state = items.get(key) or {}
+            state.update(make_state(index))
+            await storage.write({key: state})
+            latencies.append(time.perf_counter() - start)
+
+    for index in range(turns):
+        await asyncio.gather(*(turn(conversation, index) for conversation in range(conversations)))
+    return latencies
+
+
+async def bench(name: str, storage, args) -> None:
+    start = time.perf_counter()
+    latencies = await run_turns(storage, args.conversations, args.turns, args.concurrency)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    extra = ""
+    if isinstance(storage, SqliteStorage):
+        extra = f"  writes/transaction={storage.batched_writes / max(storage.transactions, 1):.1f}"
+        await storage.close()
+    print(
+        f"{name:<22} {len(latencies) / elapsed:>10.0f} turns/s"
+        f"  mean={statistics.mean(latencies) * 1000:.3f}ms"
+        f"  p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:.3f}ms{extra}"
+    )
+
+
+async def main(args):
+    print(
+        f"{args.conversations} conversations x {args.turns} turns, concurrency {args.concurrency}"
+    )
+    await bench("MemoryStorage", MemoryStorage(), args)
+    await bench("BoundedMemoryStorage", BoundedMemoryStorage(), args)
+    with tempfile.TemporaryDirectory() as directory:
+        await bench("SqliteStorage", SqliteStorage(os.path.join(directory, "state.db")), args)
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    PARSER.add_argument("--conversations", type=int, default=200)
+    PARSER.add_argument("--turns", type=int, default=20)
+    PARSER.add_argument("--concurrency", type=int, default=50)
+    asyncio.run(main(PARSER.parse_args()))
@@ -0,0 +1,207 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""
+Replay of recorded transcripts through the bot, at their recorded pace or faster.
+
+The activities received in transcripts written by the TranscriptRecorder (TranscriptPath) are sent
+again, with the expectReplies delivery mode, either to the aiohttp app (app.messages) or straight to
+ADAPTER.process_activity. They are sent at the recorded pace (--speed 1), N times faster (--speed N)
+or as fast as possible (--speed 0); the turns of a conversation always wait for the previous one.
+The replies are diffed with the recorded ones, and the turn latencies compared with the recorded
+turn durations. Run it with the same configuration as the recorded bot, but without MicrosoftAppId
+(the replayed activities are not signed) and on an empty state store. Replies depending on the day,
+ie relative dates, differ when the transcript is not replayed on the day it was recorded.
+
+    python -m benchmarks.replay_transcripts transcripts.jsonl.gz
+    python -m benchmarks.replay_transcripts transcripts.*.jsonl.gz --target adapter --speed 0 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import difflib
+import statistics
+import time
+from typing import Dict, List, Optional
+
+from botbuilder.schema import Activity
+
+from benchmarks.bench_conversations import AppDriver, percentile
+from outbound_batching_middleware import merge_activities
+from transcript_recorder import DEFAULT_REDACTORS, read_transcript
+
+
+class RecordedTurn:
+    """An activity received by the bot, with the replies it sent and how long after the activity the last one was."""
+
+    __slots__ = ("at", "activity", "replies", "duration")
+
+    def __init__(self, at: float, activity: dict):
+        self.at = at
+        self.activity = activity
+        self.replies: List[dict] = []
+        self.duration: Optional[float] = None
+
+
+def load_conversations(paths: List[str]) -> Dict[str, List[RecordedTurn]]:
+    """The turns of the transcripts by conversation; each reply belongs to the last activity of its conversation."""
+    records = sorted((record for path in paths for record in read_transcript(path)), key=lambda record: record["t"])
+    conversations: Dict[str, List[RecordedTurn]] = {}
+    for record in records:
+        activity = record["activity"]
+        key = f"{activity.get('channelId')}/{(activity.get('conversation') or {}).get('id')}"
+        if record["dir"] == "in":
+            conversations.setdefault(key, []).append(RecordedTurn(record["t"], activity))
+        elif conversations.get(key):
+            turn = conversations[key][-1]
+            turn.replies.append(activity)
+            turn.duration = record["t"] - turn.at
+    return conversations
+
+
+def describe(replies: List[Activity]) -> List[str]:
+    """The replies as lines to diff: their type and text lines, and the content types of their attachments."""
+    lines = []
+    for reply in merge_activities(replies):
+        lines.extend(line.rstrip() for line in f"{reply.type}: {reply.text or ''}".splitlines())
+        lines.extend(f"  [{attachment.content_type}]" for attachment in reply.attachments or ())
+    return lines
+
+
+def redact(reply: Activity, redactors) -> Optional[Activity]:
+    """The reply as the recorder would have recorded it."""
+    serialized = reply.serialize()
+    for redactor in redactors:
+        serialized = redactor(serialized)
+        if serialized is None:
+            return None
+    return Activity().deserialize(serialized)
+
+
+class ProcessActivityDriver(AppDriver):
+    """Calls ADAPTER.process_activity of the app, without going through HTTP."""
+
+    async def start(self):
+        # pylint: disable=import-outside-toplevel
+        from aiohttp import web
+
+        # Runs the startup hooks of the app, ie the LUIS warm-up, without serving it
+        self._server = web.AppRunner(self._app)
+        await self._server.setup()
+
+    async def stop(self):
+        await self._server.cleanup()
+
+    async def post(self, activity: Activity) -> List[Activity]:
+        activity.delivery_mode = "expectReplies"
+        response = await self._bot_app.ADAPTER.process_activity(activity, "", self._bot_app.BOT.on_turn)
+        body = response.body if response else None
+        return [Activity().deserialize(reply) for reply in (body or {}).get("activities", [])]
+
+
+class Results:
+    def __init__(self):
+        self.latencies = []
+        self.recorded_latencies = []
+        self.lags = []
+        self.identical = 0
+        self.diffs = []
+
+
+async def replay_conversation(driver, key: str, turns: List[RecordedTurn], clock, args, in_flight, results: Results):
+    for turn in turns:
+        if args.speed > 0:
+            delay = clock(turn.at) - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                results.lags.append(-delay)
+
+        activity = Activity().deserialize(turn.activity)
+        activity.service_url = activity.service_url or "https://replay"
+        async with in_flight:
+            start = time.perf_counter()
+            replies = await driver.post(activity)
+            results.latencies.append(time.perf_counter() - start)
+        if turn.duration is not None:
+            results.recorded_latencies.append(turn.duration)
+
+        expected = describe([Activity().deserialize(reply) for reply in turn.replies])
+        actual = describe([reply for reply in (redact(reply, args.redactors) for reply in replies) if reply])
+        if expected == actual:
+            results.identical += 1
+        else:
+            diff = difflib.unified_diff(expected, actual, "recorded", "replayed", lineterm="", n=0)
+            results.diffs.append((key, activity.text, list(diff)[2:]))
+
+
+def summary(name: str, values: List[float]) -> str:
+    if not values:
+        return f"{name:<15} -"
+    values = sorted(values)
+    return (
+        f"{name:<15} mean={statistics.mean(values) * 1000:.2f}ms"
+        f"  p50={percentile(values, 0.50) * 1000:.2f}ms"
+        f"  p95={percentile(values, 0.95) * 1000:.2f}ms"
+        f"  p99={percentile(values, 0.99) * 1000:.2f}ms"
+        f"  max={values[-1] * 1000:.2f}ms"
+    )
+
+
+async def main(args):
+    args.redactors = DEFAULT_REDACTORS if args.redact else ()
+    conversations = load_conversations(args.transcripts)
+    if not conversations:
+        raise SystemExit("no activity received in the transcripts")
+    turn_count = sum(len(turns) for turns in conversations.values())
+    first_at = min(turns[0].at for turns in conversations.values())
+
+    driver = ProcessActivityDriver() if args.target == "adapter" else AppDriver()
+    await driver.start()
+    results = Results()
+    in_flight = asyncio.Semaphore(args.concurrency)
+    start = time.perf_counter() + 0.1
+
+    def clock(at: float) -> float:
+        """When a recorded activity is due in the replay."""
+        return start + (at - first_at) / args.speed
+
+    await asyncio.gather(
+        *(
+            replay_conversation(driver, key, turns, clock, args, in_flight, results)
+            for key, turns in conversations.items()
+        )
+    )
+    elapsed = time.perf_counter() - start
+    await driver.stop()
+
+    pace = f"{args.speed:g}x" if args.speed > 0 else "as fast as possible"
+    print(
+        f"{args.target}: {len(conversations)} conversations, {turn_count} turns in {elapsed:.1f}s ({pace}),"
+        f" {turn_count / elapsed:.0f} turns/s"
+    )
+    print(summary("turn latency", results.latencies))
+    print(summary("recorded", results.recorded_latencies))
+    if args.speed > 0:
+        print(f"pacing          {len(results.lags)} turns late, max={max(results.lags, default=0) * 1000:.1f}ms")
+    print(f"replies         {results.identical} identical, {len(results.diffs)} different")
+    for key, text, diff in results.diffs[: args.show_diffs]:
+        print(f"  {key} {text!r}")
+        for line in diff:
+            print(f"    {line}")
+    if args.strict and results.diffs:
+        raise SystemExit(f"{len(results.diffs)} turns replied differently")
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    PARSER.add_argument("transcripts", nargs="+", help="gzipped (.gz) or plain JSON lines transcripts")
+    PARSER.add_argument("--target", choices=["app", "adapter"], default="app")
+    PARSER.add_argument("--speed", type=float, default=1.0, help="pace factor, 0 to replay as fast as possible")
+    PARSER.add_argument("--concurrency", type=int, default=1000, help="maximum turns in flight")
+    PARSER.add_argument("--show-diffs", type=int, default=10)
+    PARSER.add_argument(
+        "--no-redact", dest="redact", action="store_false",
+        help="diff the replies as they are, for transcripts recorded without the default redactors",
+    )
+    PARSER.add_argument("--strict", action="store_true", help="exit with an error if any reply differs")
+    asyncio.run(main(PARSER.parse_args()))
@@ -1,8 +1,43 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
+"""Slots of a flight booking, filled by LUIS and the booking dialog."""
+
+import re
+from datetime import date
+from typing import Optional, Union
+
+# The leading amount of a budget given as text, ie "300" in "300 euros"
+BUDGET_AMOUNT = re.compile(r"\d+(?:[.,]\d+)?")
+
+
+def _to_day(timex: Optional[Union[str, date]]) -> Optional[Union[str, date]]:
+    """A definite date timex as a date, any other value unchanged: the date gives the timex back."""
+    if isinstance(timex, str) and len(timex) == 10:
+        try:
+            day = date.fromisoformat(timex)
+        except ValueError:
+            return timex  # ie "XXXX-05-05"
+        if day.isoformat() == timex:
+            return day
+    return timex
+
+
+def _to_budget(budget: Optional[Union[int, float, str]]) -> Optional[Union[int, float, str]]:
+    """A budget given as a whole number in text, ie "500", as an int; any other value unchanged."""
+    if isinstance(budget, str) and budget.isdigit() and str(int(budget)) == budget:
+        return int(budget)
+    return budget
 
 
 class BookingDetails:
+    """
+    The booking slots. It is kept in the dialog state for the whole booking, so it only has slots:
+    definite dates are held as dates, and whole number budgets as ints. start_date and end_date still
+    read and write timex strings, as the dialogs use them.
+    """
+
+    __slots__ = ("initial_prompt", "destination", "origin", "_start_date", "_end_date", "_budget")
+
     def __init__(
         self,
         initial_prompt: str = None,
@@ -11,7 +46,7 @@ class BookingDetails:
         start_date: str = None,
         end_date: str = None,
         budget: int = None
-    ):    
+    ):
 #        if unsupported_airports is None:
 #            unsupported_airports = []
         self.initial_prompt = initial_prompt
@@ -21,3 +56,67 @@ class BookingDetails:
         self.end_date = end_date
         self.budget = budget
 
+    @property
+    def start_date(self) -> Optional[str]:
+        """The departure date timex."""
+        return self._start_date.isoformat() if isinstance(self._start_date, date) else self._start_date
+
+    @start_date.setter
+    def start_date(self, timex: Optional[Union[str, date]]):
+        self._start_date = _to_day(timex)
+
+    @property
+    def end_date(self) -> Optional[str]:
+        """The return date timex."""
+        return self._end_date.isoformat() if isinstance(self._end_date, date) else self._end_date
+
+    @end_date.setter
+    def end_date(self, timex: Optional[Union[str, date]]):
+        self._end_date = _to_day(timex)
+
+    @property
+    def start_day(self) -> Optional[date]:
+        """The departure date, None until it is a definite one."""
+        return self._start_date if isinstance(self._start_date, date) else None
+
+    @property
+    def end_day(self) -> Optional[date]:
+        """The return date, None until it is a definite one."""
+        return self._end_date if isinstance(self._end_date, date) else None
+
+    @property
+    def budget(self) -> Optional[Union[int, float, str]]:
+        """The budget as the user gave it: a number, or the text of the budget prompt."""
+        return self._budget
+
+    @budget.setter
+    def budget(self, budget: Optional[Union[int, float, str]]):
+        self._budget = _to_budget(budget)
+
+    @property
+    def budget_amount(self) -> Optional[float]:
+        """The amount of the budget, ie 300.0 for "300 euros", None if there is no number in it."""
+        if isinstance(self._budget, (int, float)) and not isinstance(self._budget, bool):
+            return float(self._budget)
+        match = BUDGET_AMOUNT.search(self._budget) if isinstance(self._budget, str) else None
+        return float(match.group().replace(",", ".")) if match else None
+
+    def to_dict(self) -> dict:
+        """The slots by name, with the dates as timex strings."""
+        return {
+            "initial_prompt": self.initial_prompt,
+            "destination": self.destination,
+            "origin": self.origin,
+            "start_date": self.start_date,
+            "end_date": self.end_date,
+            "budget": self.budget,
+        }
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, BookingDetails):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in BookingDetails.__slots__)
+
+    def __repr__(self) -> str:
+        slots = ", ".join(f"{name}={value!r}" for name, value in self.to_dict().items() if value is not None)
+        return f"BookingDetails({slots})"
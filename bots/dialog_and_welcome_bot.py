@@ -1,7 +1,6 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 """Main dialog to welcome users."""
-import json
 import os.path
 
 from typing import List
@@ -14,6 +13,7 @@ from botbuilder.core import (
 )
 from botbuilder.schema import Activity, Attachment, ChannelAccount
 from helpers.activity_helper import create_activity_reply
+from helpers.card_helper import CardTemplate
 from .dialog_bot import DialogBot
 
 
@@ -32,6 +32,11 @@ class DialogAndWelcomeBot(DialogBot):
         )
         self.telemetry_client = telemetry_client
 
+        # Load the welcome card once, it is sent to every member added.
+        relative_path = os.path.abspath(os.path.dirname(__file__))
+        path = os.path.join(relative_path, "resources/welcomeCard.json")
+        self._welcome_card = CardTemplate.from_file(path)
+
     async def on_members_added_activity(
         self, members_added: List[ChannelAccount], turn_context: TurnContext
     ):
@@ -50,14 +55,6 @@ class DialogAndWelcomeBot(DialogBot):
         response.attachments = [attachment]
         return response
 
-    # Load attachment from file.
     def create_adaptive_card_attachment(self):
         """Create an adaptive card."""
-        relative_path = os.path.abspath(os.path.dirname(__file__))
-        path = os.path.join(relative_path, "resources/welcomeCard.json")
-        with open(path) as card_file:
-            card = json.load(card_file)
-
-        return Attachment(
-            content_type="application/vnd.microsoft.card.adaptive", content=card
-        )
+        return self._welcome_card.create_attachment()
@@ -12,6 +12,8 @@ from botbuilder.core import (
 )
 from botbuilder.dialogs import Dialog, DialogExtensions
 from helpers.dialog_helper import DialogHelper
+from helpers.state_helper import StateHelper
+from helpers.timing import TIMINGS
 
 
 class DialogBot(ActivityHandler):
@@ -39,15 +41,21 @@ class DialogBot(ActivityHandler):
         self.telemetry_client = telemetry_client
 
     async def on_message_activity(self, turn_context: TurnContext):
+        # Load the state up front, so that its cost is not hidden in the first dialog step.
+        # Both scopes are read with a single storage read.
+        with TIMINGS.span("state.load"):
+            await StateHelper.load_all(turn_context, self.conversation_state, self.user_state)
+
         await DialogExtensions.run_dialog(
             self.dialog,
             turn_context,
             self.conversation_state.create_property("DialogState"),
         )
 
-        # Save any state changes that might have occured during the turn.
-        await self.conversation_state.save_changes(turn_context, False)
-        await self.user_state.save_changes(turn_context, False)
+        # Save any state changes that might have occured during the turn,
+        # with a single storage write for both scopes, and none if nothing changed.
+        with TIMINGS.span("state.save"):
+            await StateHelper.save_all_changes(turn_context, self.conversation_state, self.user_state)
 
     @property
     def telemetry_client(self) -> BotTelemetryClient:
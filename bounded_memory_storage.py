@@ -0,0 +1,156 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Memory storage bounded in entries and bytes, with idle expiry."""
+
+import asyncio
+import pickle
+import sys
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List
+
+from botbuilder.core import MemoryStorage, StoreItem
+
+
+def pickled_size(value: object) -> int:
+    """Default size estimate of a stored item: the length of its pickle."""
+    try:
+        return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    except Exception:  # pylint: disable=broad-except
+        return sys.getsizeof(value)
+
+
+class BoundedMemoryStorage(MemoryStorage):
+    """
+    Drop-in replacement for MemoryStorage which does not grow without limit.
+    Items idle for more than idle_ttl seconds expire, and the least recently used items are evicted
+    once max_entries or max_bytes is exceeded. A background sweeper removes expired items.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        max_bytes: int = 256 * 1024 * 1024,
+        idle_ttl: float = 3600.0,
+        sweep_interval: float = 60.0,
+        sizeof: Callable[[object], int] = pickled_size,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        super(BoundedMemoryStorage, self).__init__(OrderedDict())
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+        self._sizeof = sizeof
+        self._timer = timer
+
+        # key -> (last access time, size in bytes), in the same order as self.memory
+        self._entries: Dict[str, tuple] = {}
+        self._size_bytes = 0
+        self._sweeper = None
+
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def entry_count(self) -> int:
+        return len(self.memory)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size_bytes
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": self.entry_count,
+            "bytes": self._size_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    async def read(self, keys: List[str]):
+        now = self._timer()
+        for key in keys or []:
+            entry = self._entries.get(key)
+            if entry is None:
+                continue
+            if now - entry[0] > self.idle_ttl:
+                self._remove(key)
+                self.expirations += 1
+            else:
+                self._touch(key, now, entry[1])
+        return await super(BoundedMemoryStorage, self).read(keys)
+
+    async def write(self, changes: Dict[str, StoreItem]):
+        await super(BoundedMemoryStorage, self).write(changes)
+        if not changes:
+            return
+
+        now = self._timer()
+        for key in changes:
+            previous = self._entries.get(key)
+            size = self._sizeof(self.memory[key])
+            self._size_bytes += size - (previous[1] if previous else 0)
+            self._touch(key, now, size)
+        self._evict(protected=changes.keys())
+
+    async def delete(self, keys: List[str]):
+        for key in keys:
+            if key in self._entries:
+                self._remove(key)
+        await super(BoundedMemoryStorage, self).delete(keys)
+
+    def sweep(self) -> int:
+        """Removes the items idle for more than idle_ttl seconds, returns how many were removed."""
+        deadline = self._timer() - self.idle_ttl
+        expired = []
+        # Entries are ordered by last access, so the scan stops at the first live one
+        for key, (last_access, _) in self._entries.items():
+            if last_access >= deadline:
+                break
+            expired.append(key)
+        for key in expired:
+            self._remove(key)
+        self.expirations += len(expired)
+        return len(expired)
+
+    def start_sweeper(self) -> None:
+        """Starts the background sweeper on the running event loop."""
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.ensure_future(self._sweep_forever())
+
+    async def stop_sweeper(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            self.sweep()
+
+    def _touch(self, key: str, now: float, size: int) -> None:
+        self._entries.pop(key, None)
+        self._entries[key] = (now, size)
+        self.memory.move_to_end(key)
+
+    def _remove(self, key: str) -> None:
+        _, size = self._entries.pop(key)
+        self._size_bytes -= size
+        self.memory.pop(key, None)
+
+    def _evict(self, protected) -> None:
+        # Evict least recently used items, but never the ones that were just written
+        while len(self._entries) > self.max_entries or self._size_bytes > self.max_bytes:
+            key = next((key for key in self._entries if key not in protected), None)
+            if key is None:
+                break
+            self._remove(key)
+            self.evictions += 1
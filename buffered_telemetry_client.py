@@ -0,0 +1,340 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Telemetry client buffering the items of the turns and sending them in batches, in the background."""
+
+import asyncio
+import contextvars
+import json
+import random
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from threading import current_thread
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from botbuilder.core import BotTelemetryClient
+
+from helpers.request_context import REQUEST_BODY
+
+OVERFLOW_POLICIES = ("drop", "sample")
+
+
+class TelemetryItem(NamedTuple):
+    """
+    One tracked item: kind is the name of the tracking method without "track_", ie "trace", and
+    request_body the REQUEST_BODY of the request which tracked it.
+    """
+
+    kind: str
+    timestamp: float
+    fields: dict
+    request_body: Optional[dict] = None
+
+
+def attach_aiohttp_request_body(body: Optional[dict]) -> None:
+    """
+    Hands the body of the request of an item to the Application Insights aiohttp processor, which
+    reads it by thread: that of the sender, not that of the request, once the items are buffered.
+    """
+    # pylint: disable=import-outside-toplevel,protected-access
+    from botbuilder.integration.applicationinsights.aiohttp import aiohttp_telemetry_middleware
+
+    aiohttp_telemetry_middleware._REQUEST_BODIES[current_thread().ident] = body
+
+
+class TelemetrySink:
+    """Destination of the batches. send runs in a worker thread, one batch at a time, and may block."""
+
+    def send(self, batch: List[TelemetryItem]) -> None:
+        raise NotImplementedError()
+
+    def close(self) -> None:
+        pass
+
+
+class ForwardingSink(TelemetrySink):
+    """
+    Forwards the batches to another telemetry client, ie ApplicationInsightsTelemetryClient, and flushes it
+    once per batch. Its queue should hold a whole batch, so that it never sends on its own.
+    attach_request_body, ie attach_aiohttp_request_body, is given the request body of each item before
+    it is forwarded, for the telemetry processor of the client.
+    """
+
+    def __init__(
+        self,
+        telemetry_client: BotTelemetryClient,
+        attach_request_body: Callable[[Optional[dict]], None] = None,
+    ):
+        self.telemetry_client = telemetry_client
+        self.attach_request_body = attach_request_body
+
+    def send(self, batch: List[TelemetryItem]) -> None:
+        for item in batch:
+            if self.attach_request_body is not None:
+                self.attach_request_body(item.request_body)
+            getattr(self.telemetry_client, "track_" + item.kind)(**item.fields)
+        if hasattr(self.telemetry_client, "flush"):
+            self.telemetry_client.flush()
+
+
+class JsonLinesSink(TelemetrySink):
+    """Writes the items as JSON lines to a file, or to stdout for "-", for offline runs and tests."""
+
+    def __init__(self, path: str = "-"):
+        self.path = path
+        self._stream = sys.stdout if path == "-" else open(path, "a", encoding="utf-8")
+
+    def send(self, batch: List[TelemetryItem]) -> None:
+        self._stream.write("".join(json.dumps(self.to_record(item), default=str) + "\n" for item in batch))
+        self._stream.flush()
+
+    def close(self) -> None:
+        if self._stream is not sys.stdout:
+            self._stream.close()
+
+    @staticmethod
+    def to_record(item: TelemetryItem) -> dict:
+        record = {"time": datetime.fromtimestamp(item.timestamp, timezone.utc).isoformat(), "type": item.kind}
+        fields = dict(item.fields)
+        if item.kind == "exception":
+            exception_type, value, trace = (
+                fields.pop("exception_type"), fields.pop("value"), fields.pop("trace")
+            )
+            fields["exception_type"] = getattr(exception_type, "__name__", None)
+            fields["message"] = str(value) if value is not None else None
+            fields["trace"] = "".join(traceback.format_exception(exception_type, value, trace)) if value else None
+        record.update(fields)
+        return record
+
+
+class BufferedTelemetryClient(BotTelemetryClient):
+    """
+    Telemetry client whose tracking methods only append to a bounded buffer, so that telemetry never
+    adds latency to a turn. A background flusher hands the buffer to the sink when batch_size items are
+    waiting, or every flush_interval seconds otherwise, so the exporter gets few, large batches.
+    When the buffer is full, new items are dropped ("drop"), or the buffer is kept as a uniform sample
+    of all the items tracked since the last batch ("sample").
+    """
+
+    def __init__(
+        self,
+        sink: TelemetrySink,
+        capacity: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 5.0,
+        overflow: str = "drop",
+        shutdown_timeout: float = 10.0,
+        seed: int = None,
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'"{overflow}" is not a telemetry overflow policy: {", ".join(OVERFLOW_POLICIES)}.')
+        self.sink = sink
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.shutdown_timeout = shutdown_timeout
+        self._rng = random.Random(seed)
+
+        self._buffer: List[TelemetryItem] = []
+        self._offered = 0  # items tracked since the last batch, for the sampling
+        self._wake = None
+        self._flusher = None
+        self._executor = None
+
+        self.tracked = 0
+        self.dropped = 0
+        self.sent = 0
+        self.batches = 0
+        self.errors = 0
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "buffered": len(self._buffer),
+            "capacity": self.capacity,
+            "tracked": self.tracked,
+            "dropped": self.dropped,
+            "sent": self.sent,
+            "batches": self.batches,
+            "errors": self.errors,
+        }
+
+    def track_pageview(self, name: str, url, duration: int = 0, properties=None, measurements=None) -> None:
+        self._add("pageview", name=name, url=url, duration=duration, properties=properties, measurements=measurements)
+
+    def track_exception(
+        self, exception_type: type = None, value: Exception = None, trace=None, properties=None, measurements=None
+    ) -> None:
+        # The exception being handled must be captured now, not when the item is sent
+        if not exception_type or not value or not trace:
+            exception_type, value, trace = sys.exc_info()
+        self._add(
+            "exception",
+            exception_type=exception_type,
+            value=value,
+            trace=trace,
+            properties=properties,
+            measurements=measurements,
+        )
+
+    def track_event(self, name: str, properties=None, measurements=None) -> None:
+        self._add("event", name=name, properties=properties, measurements=measurements)
+
+    def track_metric(
+        self,
+        name: str,
+        value: float,
+        tel_type=None,
+        count: int = None,
+        min_val: float = None,
+        max_val: float = None,
+        std_dev: float = None,
+        properties=None,
+    ) -> None:
+        self._add(
+            "metric",
+            name=name,
+            value=value,
+            tel_type=tel_type,
+            count=count,
+            min_val=min_val,
+            max_val=max_val,
+            std_dev=std_dev,
+            properties=properties,
+        )
+
+    def track_trace(self, name, properties=None, severity=None) -> None:
+        self._add("trace", name=name, properties=properties, severity=severity)
+
+    def track_request(
+        self,
+        name: str,
+        url: str,
+        success: bool,
+        start_time: str = None,
+        duration: int = None,
+        response_code: str = None,
+        http_method: str = None,
+        properties=None,
+        measurements=None,
+        request_id: str = None,
+    ) -> None:
+        self._add(
+            "request",
+            name=name,
+            url=url,
+            success=success,
+            start_time=start_time,
+            duration=duration,
+            response_code=response_code,
+            http_method=http_method,
+            properties=properties,
+            measurements=measurements,
+            request_id=request_id,
+        )
+
+    def track_dependency(
+        self,
+        name: str,
+        data: str,
+        type_name: str = None,
+        target: str = None,
+        duration: int = None,
+        success: bool = None,
+        result_code: str = None,
+        properties=None,
+        measurements=None,
+        dependency_id: str = None,
+    ) -> None:
+        self._add(
+            "dependency",
+            name=name,
+            data=data,
+            type_name=type_name,
+            target=target,
+            duration=duration,
+            success=success,
+            result_code=result_code,
+            properties=properties,
+            measurements=measurements,
+            dependency_id=dependency_id,
+        )
+
+    def flush(self) -> None:
+        """Asks the flusher for a batch now. Without a running flusher, sends the buffer in the calling thread."""
+        if self._flusher is not None and not self._flusher.done():
+            self._wake.set()
+        else:
+            self._send(self._take())
+
+    def start_flusher(self) -> None:
+        """Starts the background flusher on the running event loop."""
+        if self._flusher is None or self._flusher.done():
+            self._wake = asyncio.Event()
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="telemetry")
+            self._flusher = asyncio.ensure_future(self._flush_forever())
+
+    async def stop_flusher(self) -> None:
+        """Stops the flusher and sends what is left in the buffer, waiting at most shutdown_timeout seconds."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+            last_batch = asyncio.get_event_loop().run_in_executor(self._executor, self._send, self._take())
+            try:
+                await asyncio.wait_for(last_batch, self.shutdown_timeout)
+            except asyncio.TimeoutError:
+                print("[BufferedTelemetryClient]: the last batch could not be sent in time", file=sys.stderr)
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self.sink.close()
+
+    async def _flush_forever(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            batch = self._take()
+            if batch:
+                await loop.run_in_executor(self._executor, self._send, batch)
+
+    def _add(self, kind: str, **fields) -> None:
+        item = TelemetryItem(kind, time.time(), fields, REQUEST_BODY.get())
+        self.tracked += 1
+        self._offered += 1
+        if len(self._buffer) < self.capacity:
+            self._buffer.append(item)
+            if len(self._buffer) == self.batch_size and self._wake is not None:
+                self._wake.set()
+            return
+
+        self.dropped += 1
+        if self.overflow == "sample":
+            # Reservoir sampling: each item tracked since the last batch is kept with the same probability
+            index = self._rng.randrange(self._offered)
+            if index < self.capacity:
+                self._buffer[index] = item
+
+    def _take(self) -> List[TelemetryItem]:
+        batch, self._buffer, self._offered = self._buffer, [], 0
+        return batch
+
+    def _send(self, batch: List[TelemetryItem]) -> None:
+        for start in range(0, len(batch), self.batch_size):
+            chunk = batch[start : start + self.batch_size]
+            try:
+                self.sink.send(chunk)
+                self.sent += len(chunk)
+                self.batches += 1
+            except Exception as exception:  # pylint: disable=broad-except
+                self.errors += 1
+                print(f"[BufferedTelemetryClient]: {len(chunk)} items lost: {exception}", file=sys.stderr)
@@ -0,0 +1,169 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Cache of the validated bearer tokens, and OpenID signing keys refreshed in the background."""
+
+import asyncio
+import hashlib
+import json
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Optional
+
+from aiohttp import ClientError, ClientSession, ClientTimeout
+from botframework.connector.auth import ClaimsIdentity, JwtTokenExtractor
+from botframework.connector.auth.jwt_token_extractor import _OpenIdConfig, _OpenIdMetadata
+from jwt.algorithms import RSAAlgorithm
+
+from helpers.ttl_cache import TTLCache
+
+
+class TokenValidationCache:
+    """
+    The claims identities of the validated Authorization headers, until the exp claim of their token,
+    so that the signature of a token is verified once instead of on every turn. The entries are keyed
+    by a hash of the header, and by the channel id and the service url which the validation checked
+    along with the token. Tokens without an exp claim are not cached.
+    """
+
+    def __init__(self, max_size: int = 10000, max_ttl: float = 3600.0, timer: Callable[[], float] = time.time):
+        self._timer = timer
+        self._cache = TTLCache(max_size, max_ttl, timer)
+
+    @staticmethod
+    def key(auth_header: str, channel_id: str, service_url: str) -> tuple:
+        return hashlib.sha256(auth_header.encode("utf-8")).digest(), channel_id, service_url
+
+    def get(self, key: tuple) -> Optional[ClaimsIdentity]:
+        return self._cache.get(key)
+
+    def put(self, key: tuple, identity: ClaimsIdentity) -> None:
+        expires = identity.claims.get("exp") if identity.claims else None
+        if not isinstance(expires, (int, float)):
+            return
+        ttl = min(expires - self._timer(), self._cache.ttl)
+        if ttl > 0:
+            self._cache.put(key, identity, ttl)
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        stats = self._cache.stats
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+class BackgroundOpenIdMetadata(_OpenIdMetadata):
+    """
+    OpenID metadata and signing keys of an issuer, fetched without blocking the event loop and parsed
+    once per refresh, instead of with requests on the turn which finds them a day old.
+    A turn only waits for a fetch if there are no keys yet, or if its token was signed with a key
+    unknown so far (a rotation), at most once per retry_interval. Concurrent fetches are shared.
+    """
+
+    def __init__(self, url: str, retry_interval: float = 300.0, timer: Callable[[], float] = time.monotonic):
+        super().__init__(url)
+        self.retry_interval = retry_interval
+        self._timer = timer
+        self._configs: Dict[str, _OpenIdConfig] = {}
+        self._fetched_at = None
+        self._fetching: Optional[asyncio.Future] = None
+        self.failed = False
+        self.stats = Counter()
+
+    async def get(self, key_id: str) -> _OpenIdConfig:
+        if not self._configs:
+            await self.refresh()
+        config = self._configs.get(key_id)
+        if config is None and self._timer() - self._fetched_at >= self.retry_interval:
+            self.stats["unknown_keys"] += 1
+            await self.refresh()
+            config = self._configs.get(key_id)
+        if config is None:
+            raise PermissionError(f"Unauthorized. Unknown signing key {key_id}")
+        return config
+
+    async def refresh(self) -> None:
+        """Fetches the metadata and the keys; the keys fetched before are kept if it fails."""
+        if self._fetching is None or self._fetching.done():
+            self._fetching = asyncio.ensure_future(self._fetch())
+        await asyncio.shield(self._fetching)
+
+    async def _fetch(self):
+        try:
+            async with ClientSession(timeout=ClientTimeout(total=10)) as session:
+                async with session.get(self.url) as response:
+                    response.raise_for_status()
+                    keys_url = (await response.json(content_type=None))["jwks_uri"]
+                async with session.get(keys_url) as response:
+                    response.raise_for_status()
+                    keys = (await response.json(content_type=None))["keys"]
+            configs = {
+                key["kid"]: _OpenIdConfig(RSAAlgorithm.from_jwk(json.dumps(key)), key.get("endorsements", []))
+                for key in keys
+                if "kid" in key
+            }
+        except (ClientError, asyncio.TimeoutError, KeyError, TypeError, ValueError) as error:
+            self.failed = True
+            self.stats["refresh_errors"] += 1
+            print(f"[BackgroundOpenIdMetadata]: refreshing {self.url} failed: {error!r}", file=sys.stderr)
+        else:
+            self.keys = keys
+            self._configs = configs
+            self.last_updated = datetime.now()
+            self.failed = False
+            self.stats["refreshes"] += 1
+        finally:
+            self._fetched_at = self._timer()
+
+
+class OpenIdMetadataRefresher:
+    """
+    Puts BackgroundOpenIdMetadata in place of the metadata the token validation uses for the given
+    urls, fetches them at startup and refreshes them every refresh_interval seconds, or every
+    retry_interval seconds while a fetch fails. The fetches run in a background task, which a
+    caller waiting for the first one with wait_refreshed can not cancel.
+    """
+
+    def __init__(self, urls: Iterable[str], refresh_interval: float = 43200.0, retry_interval: float = 300.0):
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.metadata = [BackgroundOpenIdMetadata(url, retry_interval) for url in dict.fromkeys(urls)]
+        self._refresher = None
+        self._refreshed = None
+
+    def install(self) -> None:
+        for metadata in self.metadata:
+            JwtTokenExtractor.metadataCache[metadata.url] = metadata
+
+    async def refresh(self) -> None:
+        await asyncio.gather(*(metadata.refresh() for metadata in self.metadata))
+
+    def start(self) -> None:
+        self.install()
+        if self._refresher is None or self._refresher.done():
+            self._refreshed = asyncio.Event()
+            self._refresher = asyncio.ensure_future(self._refresh_forever())
+
+    async def wait_refreshed(self) -> None:
+        """Waits for the first fetch of the started refresher, whether it succeeded or not."""
+        await self._refreshed.wait()
+
+    async def stop(self) -> None:
+        if self._refresher is not None:
+            self._refresher.cancel()
+            try:
+                await self._refresher
+            except asyncio.CancelledError:
+                pass
+            self._refresher = None
+
+    async def _refresh_forever(self):
+        while True:
+            try:
+                await self.refresh()
+            finally:
+                self._refreshed.set()
+            failed = any(metadata.failed for metadata in self.metadata)
+            await asyncio.sleep(self.retry_interval if failed else self.refresh_interval)
@@ -0,0 +1,43 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Middleware answering the help and cancel commands before the dialogs run."""
+
+from typing import Awaitable, Callable
+
+from botbuilder.core import ConversationState, Middleware, TurnContext
+from botbuilder.schema import ActivityTypes
+
+from dialogs.cancel_and_help_dialog import CANCEL_TEXT, HELP_TEXT
+from helpers.command_matcher import CANCEL, COMMANDS, HELP, CommandMatcher
+from helpers.state_helper import StateHelper
+
+
+class CommandRouterMiddleware(Middleware):
+    """
+    Routes the interrupt commands ahead of the bot: help is answered without loading or saving any
+    state, cancel deletes the conversation state (the dialog stack) with a single storage delete, so
+    that the next message starts over. Other activities go on to the bot.
+    """
+
+    def __init__(self, conversation_state: ConversationState, matcher: CommandMatcher = COMMANDS):
+        if conversation_state is None:
+            raise Exception("[CommandRouterMiddleware]: Missing parameter. conversation_state is required")
+        self.conversation_state = conversation_state
+        self.matcher = matcher
+        self.stats = {HELP: 0, CANCEL: 0}
+
+    async def on_turn(self, context: TurnContext, logic: Callable[[], Awaitable]):
+        activity = context.activity
+        command = None
+        if activity.type == ActivityTypes.message:
+            command = self.matcher.match(activity.text, activity.locale)
+
+        if command == HELP:
+            self.stats[HELP] += 1
+            await context.send_activity(HELP_TEXT)
+        elif command == CANCEL:
+            self.stats[CANCEL] += 1
+            await context.send_activity(CANCEL_TEXT)
+            await StateHelper.delete_all(context, self.conversation_state)
+        else:
+            await logic()
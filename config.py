@@ -13,15 +13,14 @@ class DefaultConfig:
     PORT = 8000 # 3978
     HOST = "localhost"
     ENVIRONMENT = 'UNKNOWN'
+    # Nothing is printed here, so that importing the configuration stays silent: printConfig prints it
     if os.path.isfile(".development") :
-        print("running Dev environment")
         ENVIRONMENT = 'DEV'
         APP_ID = ""
         APP_PASSWORD = ""
         PORT = 3978
         HOST = "localhost"
     else:
-        print("running Production environment")
         ENVIRONMENT = 'PROD'
         #note that the user managed identity has no password (blank) but the environment variable cannot be blank, so we use a single space that needs to be removed
         #we also want to test the bot before registering it on azure. in this case the MicrosoftAppId must remain blank too in the environment variables 
@@ -32,9 +31,83 @@ class DefaultConfig:
 
     LUIS_APP_ID = os.environ.get("LuisAppId", "")
     LUIS_API_KEY = os.environ.get("LuisAPIKey", "")
-    # LUIS endpoint host name, ie "westus.api.cognitive.microsoft.com"
+    # LUIS endpoint host name, ie "westus.api.cognitive.microsoft.com" (https is implied),
+    # or a full base URL with its scheme, ie "http://localhost:5000"
     LUIS_API_HOST_NAME = os.environ.get("LuisAPIHostName", "")
+    # Published LUIS version, part of the cache key so that a new publication invalidates cached results
+    LUIS_APP_VERSION = os.environ.get("LuisAppVersion", "")
+    # In-process cache of LUIS results (a size of 0 disables the cache), TTL in seconds
+    LUIS_CACHE_SIZE = int(os.environ.get("LuisCacheSize", "1024"))
+    LUIS_CACHE_TTL = float(os.environ.get("LuisCacheTtl", "600"))
+    # Keep-alive connection pool to the LUIS endpoint: size, DNS cache TTL and timeouts in seconds,
+    # and number of connections opened at startup
+    LUIS_POOL_SIZE = int(os.environ.get("LuisPoolSize", "100"))
+    LUIS_DNS_CACHE_TTL = float(os.environ.get("LuisDnsCacheTtl", "300"))
+    LUIS_KEEPALIVE_TIMEOUT = float(os.environ.get("LuisKeepAliveTimeout", "60"))
+    LUIS_CONNECT_TIMEOUT = float(os.environ.get("LuisConnectTimeout", "3"))
+    LUIS_READ_TIMEOUT = float(os.environ.get("LuisReadTimeout", "10"))
+    LUIS_WARM_UP_CONNECTIONS = int(os.environ.get("LuisWarmUpConnections", "1"))
+    # Utterances the local recognizer scores at least this high skip LUIS (a value above 1 disables the fast path)
+    LOCAL_RECOGNIZER_THRESHOLD = float(os.environ.get("LocalRecognizerThreshold", "0.95"))
+    # Phrases of the help and cancel commands, as JSON: {"help": {"en": ["help", "?"]}, "cancel": {...}}
+    # (empty for the built-in phrases), and the language whose phrases are understood in every locale
+    INTERRUPT_PHRASES = os.environ.get("InterruptPhrases", "")
+    INTERRUPT_LOCALE = os.environ.get("InterruptLocale", "en")
     APPINSIGHTS_INSTRUMENTATION_KEY = os.environ.get("AppInsightsInstrumentationKey", "")
+    # Telemetry destination: "appinsights", "-" for stdout or the path of a JSON lines file.
+    # The items are buffered (at most TELEMETRY_BUFFER_SIZE, beyond which they are dropped or sampled
+    # depending on TELEMETRY_OVERFLOW) and sent by batches of TELEMETRY_BATCH_SIZE, or every
+    # TELEMETRY_FLUSH_INTERVAL seconds
+    TELEMETRY_SINK = os.environ.get("TelemetrySink", "appinsights")
+    TELEMETRY_BUFFER_SIZE = int(os.environ.get("TelemetryBufferSize", "10000"))
+    TELEMETRY_BATCH_SIZE = int(os.environ.get("TelemetryBatchSize", "500"))
+    TELEMETRY_FLUSH_INTERVAL = float(os.environ.get("TelemetryFlushInterval", "5"))
+    TELEMETRY_OVERFLOW = os.environ.get("TelemetryOverflow", "drop")
+
+    # Conversation/user state store: "memory" (bounded, per process) or "sqlite" (durable, shared by local processes)
+    STATE_STORE = os.environ.get("StateStore", "memory")
+    STATE_DB_PATH = os.environ.get("StateDbPath", "state.db")
+    # Encoding of the states in the SQLite store: "compact" (dialog_state_codec) or "pickle"
+    STATE_CODEC = os.environ.get("StateCodec", "compact")
+    # Bounds of the in-memory conversation/user state store: idle conversations expire after STATE_IDLE_TTL seconds
+    STATE_MAX_ENTRIES = int(os.environ.get("StateMaxEntries", "10000"))
+    STATE_MAX_BYTES = int(os.environ.get("StateMaxBytes", str(256 * 1024 * 1024)))
+    STATE_IDLE_TTL = float(os.environ.get("StateIdleTtl", "3600"))
+    STATE_SWEEP_INTERVAL = float(os.environ.get("StateSweepInterval", "60"))
+
+    # Gzipped JSON lines file recording the activities received and sent, for replays ("" to record none).
+    # With several workers, "{pid}" in the path is replaced by the id of the worker process.
+    TRANSCRIPT_PATH = os.environ.get("TranscriptPath", "")
+
+    # Timing spans of the turns: fraction of the turns recorded as traces, and seconds between
+    # two exports of the span histograms to Application Insights
+    TIMING_SAMPLE_RATE = float(os.environ.get("TimingSampleRate", "0"))
+    TIMING_EXPORT_INTERVAL = float(os.environ.get("TimingExportInterval", "60"))
+
+    # Local metrics in the Prometheus text format: route of the endpoint (empty to disable it), and
+    # seconds between two measures of the event loop lag
+    METRICS_PATH = os.environ.get("MetricsPath", "/metrics")
+    METRICS_LOOP_LAG_INTERVAL = float(os.environ.get("MetricsLoopLagInterval", "0.5"))
+
+    # Validated bearer tokens cached until their expiry (a size of 0 validates every request), and seconds
+    # between two background refreshes of the OpenID signing keys
+    AUTH_TOKEN_CACHE_SIZE = int(os.environ.get("AuthTokenCacheSize", "10000"))
+    OPENID_REFRESH_INTERVAL = float(os.environ.get("OpenIdRefreshInterval", "43200"))
+
+    # Warm-up of each worker before /health/ready reports it ready: seconds allowed to each step, and
+    # whether a synthetic booking is run through the bot (in the "warmup" channel, its state deleted)
+    WARM_UP_TIMEOUT = float(os.environ.get("WarmUpTimeout", "30"))
+    WARM_UP_TURNS = os.environ.get("WarmUpTurns", "true").lower() == "true"
+
+    # Admission control of /api/messages, per worker: turns handled at once (0 for no limit), requests
+    # waiting for one of them, at most ADMISSION_QUEUE_TIMEOUT seconds, beyond which requests get 429 or 503
+    ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("AdmissionMaxInFlight", "64"))
+    ADMISSION_MAX_QUEUE = int(os.environ.get("AdmissionMaxQueue", "128"))
+    ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("AdmissionQueueTimeout", "2"))
+
+    # Number of worker processes forked by "python app.py" (1 runs a single process).
+    # Several workers share their state through the SQLite store, whatever STATE_STORE says.
+    WORKERS = int(os.environ.get("Workers", "1"))
 
 
 def printConfig(conf):
@@ -46,5 +119,42 @@ def printConfig(conf):
     print("LUIS_APP_ID:",conf.LUIS_APP_ID)
     print("LUIS_API_KEY:",conf.LUIS_API_KEY)
     print("LUIS_API_HOST_NAME:",conf.LUIS_API_HOST_NAME)
+    print("LUIS_APP_VERSION:",conf.LUIS_APP_VERSION)
+    print("LUIS_CACHE_SIZE:",conf.LUIS_CACHE_SIZE)
+    print("LUIS_CACHE_TTL:",conf.LUIS_CACHE_TTL)
+    print("LUIS_POOL_SIZE:",conf.LUIS_POOL_SIZE)
+    print("LUIS_DNS_CACHE_TTL:",conf.LUIS_DNS_CACHE_TTL)
+    print("LUIS_KEEPALIVE_TIMEOUT:",conf.LUIS_KEEPALIVE_TIMEOUT)
+    print("LUIS_CONNECT_TIMEOUT:",conf.LUIS_CONNECT_TIMEOUT)
+    print("LUIS_READ_TIMEOUT:",conf.LUIS_READ_TIMEOUT)
+    print("LUIS_WARM_UP_CONNECTIONS:",conf.LUIS_WARM_UP_CONNECTIONS)
+    print("LOCAL_RECOGNIZER_THRESHOLD:",conf.LOCAL_RECOGNIZER_THRESHOLD)
+    print("INTERRUPT_PHRASES:",conf.INTERRUPT_PHRASES)
+    print("INTERRUPT_LOCALE:",conf.INTERRUPT_LOCALE)
     print("APPINSIGHTS_INSTRUMENTATION_KEY:",conf.APPINSIGHTS_INSTRUMENTATION_KEY) 
+    print("TELEMETRY_SINK:",conf.TELEMETRY_SINK)
+    print("TELEMETRY_BUFFER_SIZE:",conf.TELEMETRY_BUFFER_SIZE)
+    print("TELEMETRY_BATCH_SIZE:",conf.TELEMETRY_BATCH_SIZE)
+    print("TELEMETRY_FLUSH_INTERVAL:",conf.TELEMETRY_FLUSH_INTERVAL)
+    print("TELEMETRY_OVERFLOW:",conf.TELEMETRY_OVERFLOW)
+    print("STATE_STORE:",conf.STATE_STORE)
+    print("STATE_DB_PATH:",conf.STATE_DB_PATH)
+    print("STATE_CODEC:",conf.STATE_CODEC)
+    print("STATE_MAX_ENTRIES:",conf.STATE_MAX_ENTRIES)
+    print("STATE_MAX_BYTES:",conf.STATE_MAX_BYTES)
+    print("STATE_IDLE_TTL:",conf.STATE_IDLE_TTL)
+    print("STATE_SWEEP_INTERVAL:",conf.STATE_SWEEP_INTERVAL)
+    print("TRANSCRIPT_PATH:",conf.TRANSCRIPT_PATH)
+    print("TIMING_SAMPLE_RATE:",conf.TIMING_SAMPLE_RATE)
+    print("TIMING_EXPORT_INTERVAL:",conf.TIMING_EXPORT_INTERVAL)
+    print("METRICS_PATH:",conf.METRICS_PATH)
+    print("METRICS_LOOP_LAG_INTERVAL:",conf.METRICS_LOOP_LAG_INTERVAL)
+    print("AUTH_TOKEN_CACHE_SIZE:",conf.AUTH_TOKEN_CACHE_SIZE)
+    print("OPENID_REFRESH_INTERVAL:",conf.OPENID_REFRESH_INTERVAL)
+    print("WARM_UP_TIMEOUT:",conf.WARM_UP_TIMEOUT)
+    print("WARM_UP_TURNS:",conf.WARM_UP_TURNS)
+    print("ADMISSION_MAX_IN_FLIGHT:",conf.ADMISSION_MAX_IN_FLIGHT)
+    print("ADMISSION_MAX_QUEUE:",conf.ADMISSION_MAX_QUEUE)
+    print("ADMISSION_QUEUE_TIMEOUT:",conf.ADMISSION_QUEUE_TIMEOUT)
+    print("WORKERS:",conf.WORKERS)
 
@@ -0,0 +1,69 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Middleware running the turns of a conversation one after the other, and those of different conversations at once."""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, List
+
+from botbuilder.core import Middleware, TurnContext
+
+from helpers.timing import TIMINGS
+
+
+class KeyedLocks:
+    """
+    An asyncio lock per key, created when a turn needs it and dropped once no turn holds or waits
+    for it, so that there are only as many locks as conversations with a turn in progress.
+    """
+
+    def __init__(self):
+        # key -> [lock, number of turns holding or waiting for it]
+        self._locks: Dict[str, List] = {}
+        self.stats = {"acquired": 0, "contended": 0}
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    async def run(self, key: str, logic: Callable[[], Awaitable]):
+        """Runs logic holding the lock of key. The time spent waiting for it is the lock.wait span."""
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        lock = entry[0]
+        try:
+            if lock.locked():
+                self.stats["contended"] += 1
+                with TIMINGS.span("lock.wait"):
+                    await lock.acquire()
+            else:
+                await lock.acquire()
+            self.stats["acquired"] += 1
+            try:
+                return await logic()
+            finally:
+                lock.release()
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+
+class ConversationLockMiddleware(Middleware):
+    """
+    Serializes the turns of each conversation, ie a double tap or a retry of the connector, so that a
+    turn loads the state saved by the previous one instead of both loading the same state and the
+    last save winning. The locks are per process: the workers must not share conversations for
+    this to hold, ie behind a load balancer routing by conversation.
+    Register it before the middlewares which send or touch the state.
+    """
+
+    def __init__(self, locks: KeyedLocks = None):
+        self.locks = locks or KeyedLocks()
+
+    async def on_turn(self, context: TurnContext, logic: Callable[[], Awaitable]):
+        activity = context.activity
+        if activity.conversation is None or not activity.conversation.id:
+            await logic()
+            return
+        await self.locks.run(f"{activity.channel_id}/{activity.conversation.id}", logic)
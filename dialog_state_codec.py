@@ -0,0 +1,273 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Compact binary codec of the bot states, for the storages which keep bytes."""
+
+import pickle
+import struct
+import uuid
+from datetime import date
+from typing import Callable, Dict
+
+from botbuilder.dialogs import DialogInstance, DialogState
+from botbuilder.dialogs.prompts import PromptOptions
+from botbuilder.schema import Activity, ActivityTypes, InputHints, TextFormatTypes
+
+from booking_details import BookingDetails
+
+MAGIC = b"DS"
+VERSION = 1
+
+# Strings written as their index in this table: the dialog ids, the keys of the dialog instances
+# states and the usual values of the prompt activities. Entries are only ever appended, so that
+# the states written by a former VERSION can still be read.
+KNOWN_STRINGS = (
+    "DialogState",
+    "dialogs",
+    "options",
+    "values",
+    "instanceId",
+    "stepIndex",
+    "state",
+    "e_tag",
+    "MainDialog",
+    "BookingDialog",
+    "WFDialog",
+    "WaterfallDialog",
+    "WaterfallDialog2",
+    "TextPrompt",
+    "ConfirmPrompt",
+    "DateTimePrompt",
+    "StartDateResolverDialog",
+    "EndDateResolverDialog",
+    "DateResolverDialog",
+    "type",
+    "text",
+    "speak",
+    "input_hint",
+    "text_format",
+)
+_KNOWN_INDEXES = {string: index for index, string in enumerate(KNOWN_STRINGS)}
+# Enums of the prompt activities written as their index in this table and their value, appended to as well
+KNOWN_ENUMS = (ActivityTypes, InputHints, TextFormatTypes)
+_ENUM_INDEXES = {enum: index for index, enum in enumerate(KNOWN_ENUMS)}
+
+# Value tags
+NONE, TRUE, FALSE, INT, FLOAT, STR, KNOWN_STR, UUID, UUID_HEX, LIST, DICT, DATE = range(12)
+DIALOG_STATE, DIALOG_INSTANCE, BOOKING_DETAILS, PROMPT_OPTIONS, ACTIVITY, ENUM = range(12, 18)
+PICKLED = 255
+
+_FLOAT = struct.Struct("<d")
+_BOOKING_SLOTS = BookingDetails.__slots__
+_PROMPT_OPTIONS_FIELDS = tuple(vars(PromptOptions()))
+
+
+class _Writer:
+    __slots__ = ("buffer",)
+
+    def __init__(self):
+        self.buffer = bytearray(MAGIC)
+        self.buffer.append(VERSION)
+
+    def varint(self, number: int):
+        while number > 0x7F:
+            self.buffer.append(number & 0x7F | 0x80)
+            number >>= 7
+        self.buffer.append(number)
+
+    def raw(self, data: bytes):
+        self.varint(len(data))
+        self.buffer += data
+
+    def value(self, value: object):  # pylint: disable=too-many-branches
+        buffer = self.buffer
+        kind = type(value)
+        if value is None:
+            buffer.append(NONE)
+        elif kind is bool:
+            buffer.append(TRUE if value else FALSE)
+        elif kind is int:
+            buffer.append(INT)
+            self.varint(value << 1 if value >= 0 else (~value << 1) | 1)  # zigzag
+        elif kind is float:
+            buffer.append(FLOAT)
+            buffer += _FLOAT.pack(value)
+        elif kind is str:
+            self.string(value)
+        elif kind is list:
+            buffer.append(LIST)
+            self.varint(len(value))
+            for item in value:
+                self.value(item)
+        elif kind is dict:
+            buffer.append(DICT)
+            self.mapping(value)
+        elif kind is date:
+            buffer.append(DATE)
+            self.varint(value.toordinal())
+        elif kind is DialogState:
+            buffer.append(DIALOG_STATE)
+            self.varint(len(value.dialog_stack))
+            for instance in value.dialog_stack:
+                self.value(instance)
+        elif kind is DialogInstance and vars(value).keys() == {"id", "state"}:
+            buffer.append(DIALOG_INSTANCE)
+            self.value(value.id)
+            self.value(value.state)
+        elif kind is BookingDetails:
+            buffer.append(BOOKING_DETAILS)
+            for slot in _BOOKING_SLOTS:
+                self.value(getattr(value, slot))
+        elif kind is PromptOptions and tuple(vars(value)) == _PROMPT_OPTIONS_FIELDS:
+            buffer.append(PROMPT_OPTIONS)
+            for field in _PROMPT_OPTIONS_FIELDS:
+                self.value(getattr(value, field))
+        elif kind is Activity and not value.additional_properties:
+            # The attributes which are set, most often the type, text, speak and input hint only
+            buffer.append(ACTIVITY)
+            self.mapping(
+                {name: item for name, item in vars(value).items() if item is not None and name != "additional_properties"}
+            )
+        elif kind in _ENUM_INDEXES:
+            buffer.append(ENUM)
+            self.varint(_ENUM_INDEXES[kind])
+            self.string(value.value)
+        else:
+            buffer.append(PICKLED)
+            self.raw(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    def string(self, value: str):
+        index = _KNOWN_INDEXES.get(value)
+        if index is not None:
+            self.buffer.append(KNOWN_STR)
+            self.varint(index)
+        elif len(value) == 36 and value.count("-") == 4 and _is_uuid(value, str):
+            self.buffer.append(UUID)
+            self.buffer += uuid.UUID(value).bytes
+        elif len(value) == 32 and _is_uuid(value, lambda uid: uid.hex):
+            self.buffer.append(UUID_HEX)
+            self.buffer += uuid.UUID(value).bytes
+        else:
+            self.buffer.append(STR)
+            self.raw(value.encode("utf-8"))
+
+    def mapping(self, value: Dict[object, object]):
+        self.varint(len(value))
+        for key, item in value.items():
+            self.value(key)
+            self.value(item)
+
+
+def _is_uuid(value: str, formatted: Callable[[uuid.UUID], str]) -> bool:
+    """Whether value is a uuid which is written back exactly as it is."""
+    try:
+        return formatted(uuid.UUID(value)) == value
+    except ValueError:
+        return False
+
+
+class _Reader:
+    __slots__ = ("data", "position")
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.position = len(MAGIC) + 1
+
+    def varint(self) -> int:
+        number, shift = 0, 0
+        while True:
+            byte = self.data[self.position]
+            self.position += 1
+            number |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return number
+            shift += 7
+
+    def raw(self) -> bytes:
+        length = self.varint()
+        start, self.position = self.position, self.position + length
+        return self.data[start:self.position]
+
+    def uuid(self) -> uuid.UUID:
+        start, self.position = self.position, self.position + 16
+        return uuid.UUID(bytes=bytes(self.data[start:self.position]))
+
+    def value(self) -> object:  # pylint: disable=too-many-return-statements,too-many-branches
+        tag = self.data[self.position]
+        self.position += 1
+        if tag == NONE:
+            return None
+        if tag == TRUE:
+            return True
+        if tag == FALSE:
+            return False
+        if tag == INT:
+            number = self.varint()
+            return number >> 1 if not number & 1 else ~(number >> 1)
+        if tag == FLOAT:
+            start, self.position = self.position, self.position + _FLOAT.size
+            return _FLOAT.unpack_from(self.data, start)[0]
+        if tag == STR:
+            return bytes(self.raw()).decode("utf-8")
+        if tag == KNOWN_STR:
+            return KNOWN_STRINGS[self.varint()]
+        if tag == UUID:
+            return str(self.uuid())
+        if tag == UUID_HEX:
+            return self.uuid().hex
+        if tag == LIST:
+            return [self.value() for _ in range(self.varint())]
+        if tag == DICT:
+            return self.mapping()
+        if tag == DATE:
+            return date.fromordinal(self.varint())
+        if tag == DIALOG_STATE:
+            return DialogState([self.value() for _ in range(self.varint())])
+        if tag == DIALOG_INSTANCE:
+            instance = DialogInstance(self.value())
+            instance.state = self.value()
+            return instance
+        if tag == BOOKING_DETAILS:
+            booking_details = BookingDetails.__new__(BookingDetails)
+            for slot in _BOOKING_SLOTS:
+                setattr(booking_details, slot, self.value())
+            return booking_details
+        if tag == PROMPT_OPTIONS:
+            options = PromptOptions()
+            for field in _PROMPT_OPTIONS_FIELDS:
+                setattr(options, field, self.value())
+            return options
+        if tag == ACTIVITY:
+            activity = Activity()
+            for name, item in self.mapping().items():
+                setattr(activity, name, item)
+            return activity
+        if tag == ENUM:
+            enum = KNOWN_ENUMS[self.varint()]
+            return enum(self.value())
+        if tag == PICKLED:
+            return pickle.loads(self.raw())
+        raise ValueError(f"[dialog_state_codec]: unknown tag {tag} at {self.position - 1}")
+
+    def mapping(self) -> dict:
+        return {self.value(): self.value() for _ in range(self.varint())}
+
+
+def dumps(value: object) -> bytes:
+    """
+    Encodes a stored item, ie a conversation state and its dialog stack: dialog ids and keys are
+    table indexes, instance ids 16 bytes, step indexes and dates varints and the booking details
+    their slot values only. Other objects are pickled in the stream.
+    """
+    writer = _Writer()
+    writer.value(value)
+    return bytes(writer.buffer)
+
+
+def loads(data: bytes) -> object:
+    """Decodes what dumps encoded. Pickles, ie the items of a storage written before the codec, are unpickled."""
+    if data[:len(MAGIC)] != MAGIC:
+        return pickle.loads(data)
+    version = data[len(MAGIC)]
+    if version > VERSION:
+        raise ValueError(f"[dialog_state_codec]: version {version} is newer than {VERSION}")
+    return _Reader(memoryview(data)).value()
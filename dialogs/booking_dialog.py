@@ -2,17 +2,20 @@
 # Licensed under the MIT License.
 """Flight booking dialog."""
 
-from datatypes_date_time.timex import Timex
-
 from botbuilder.dialogs import WaterfallDialog, WaterfallStepContext, DialogTurnResult
 from botbuilder.dialogs.prompts import ConfirmPrompt, TextPrompt, PromptOptions
 from botbuilder.schema import InputHints # to address dialog failure
 from botbuilder.core import MessageFactory, BotTelemetryClient, NullTelemetryClient
+from helpers.timex_helper import parse_timex
+from helpers.metrics import METRICS, channel_label
+from helpers.timing import TIMINGS
 from .cancel_and_help_dialog import CancelAndHelpDialog
 from .date_resolver_dialog import DateResolverDialog
 from .start_date_resolver_dialog import StartDateResolverDialog
 from .end_date_resolver_dialog import EndDateResolverDialog
 
+BOOKINGS = METRICS.counter("bookings_total", "Bookings confirmed (success) or declined (fail) by the user.", ("channel", "outcome"))
+
 
 class BookingDialog(CancelAndHelpDialog):
     """Flight booking implementation."""
@@ -31,7 +34,7 @@ class BookingDialog(CancelAndHelpDialog):
 
         waterfall_dialog = WaterfallDialog(
             WaterfallDialog.__name__,
-            [
+            TIMINGS.timed_steps("BookingDialog", [
                 self.origin_step,
                 self.destination_step,
                 self.start_date_step,
@@ -39,7 +42,7 @@ class BookingDialog(CancelAndHelpDialog):
                 self.budget_step,
                 self.confirm_step,
                 self.final_step,
-            ],
+            ]),
         )
         waterfall_dialog.telemetry_client = telemetry_client
 
@@ -192,6 +195,7 @@ class BookingDialog(CancelAndHelpDialog):
             # print("We've got a success!")
             # print(step_context.result)
             self.telemetry_client.track_trace("SUCCESS", properties, "INFO")
+            BOOKINGS.inc(channel_label(step_context.context.activity.channel_id), "success")
             return await step_context.end_dialog(booking_details) 
         else: 
             # print("We've got a fail!")
@@ -200,10 +204,10 @@ class BookingDialog(CancelAndHelpDialog):
             prompt_fail_msg = MessageFactory.text(fail_msg, fail_msg, InputHints.ignoring_input)
             await step_context.context.send_activity(prompt_fail_msg)
             self.telemetry_client.track_trace("FAIL", properties, "ERROR")
+            BOOKINGS.inc(channel_label(step_context.context.activity.channel_id), "fail")
 
         return await step_context.end_dialog()
 
     def is_ambiguous(self, timex: str) -> bool:
         """Ensure time is correct."""
-        timex_property = Timex(timex)
-        return "definite" not in timex_property.types
+        return parse_timex(timex).is_ambiguous
@@ -10,6 +10,10 @@ from botbuilder.dialogs import (
     DialogTurnStatus,
 )
 from botbuilder.schema import ActivityTypes
+from helpers.command_matcher import CANCEL, COMMANDS, HELP
+
+HELP_TEXT = "Show Help..."
+CANCEL_TEXT = "Cancelling"
 
 
 class CancelAndHelpDialog(ComponentDialog):
@@ -40,16 +44,17 @@ class CancelAndHelpDialog(ComponentDialog):
         return await super(CancelAndHelpDialog, self).on_continue_dialog(inner_dc)
 
     async def interrupt(self, inner_dc: DialogContext) -> DialogTurnResult:
-        """Detect interruptions."""
-        if inner_dc.context.activity.type == ActivityTypes.message:
-            text = inner_dc.context.activity.text.lower()
+        """Detect interruptions, with the phrases of the command router."""
+        activity = inner_dc.context.activity
+        if activity.type == ActivityTypes.message:
+            command = COMMANDS.match(activity.text, activity.locale)
 
-            if text in ("help", "?"):
-                await inner_dc.context.send_activity("Show Help...")
+            if command == HELP:
+                await inner_dc.context.send_activity(HELP_TEXT)
                 return DialogTurnResult(DialogTurnStatus.Waiting)
 
-            if text in ("cancel", "quit"):
-                await inner_dc.context.send_activity("Cancelling")
+            if command == CANCEL:
+                await inner_dc.context.send_activity(CANCEL_TEXT)
                 return await inner_dc.cancel_all_dialogs()
 
         return None
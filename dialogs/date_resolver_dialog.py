@@ -2,7 +2,7 @@
 # Licensed under the MIT License.
 """Handle date/time resolution for booking dialog."""
 
-from datatypes_date_time.timex import Timex
+from helpers.timex_helper import parse_timex
 
 from botbuilder.core import MessageFactory, BotTelemetryClient, NullTelemetryClient
 from botbuilder.dialogs import WaterfallDialog, DialogTurnResult, WaterfallStepContext
@@ -66,7 +66,7 @@ class DateResolverDialog(CancelAndHelpDialog):
             )
 
         # We have a Date we just need to check it is unambiguous.
-        if "definite" in Timex(timex).types:
+        if parse_timex(timex).is_definite:
             # This is essentially a "reprompt" of the data we were given up front.
             return await step_context.prompt(
                 DateTimePrompt.__name__, PromptOptions(prompt=reprompt_msg)
@@ -85,7 +85,6 @@ class DateResolverDialog(CancelAndHelpDialog):
         if prompt_context.recognized.succeeded:
             timex = prompt_context.recognized.value[0].timex.split("T")[0]
 
-            # TODO: Needs TimexProperty
-            return "definite" in Timex(timex).types
+            return parse_timex(timex).is_definite
 
         return False
@@ -3,7 +3,7 @@
 """Handle date/time resolution for booking dialog."""
 # this class is inspired by the DateResolverDialog class 
 
-from datatypes_date_time.timex import Timex
+from helpers.timex_helper import parse_timex
 
 from botbuilder.core import MessageFactory, BotTelemetryClient, NullTelemetryClient
 from botbuilder.dialogs import WaterfallDialog, DialogTurnResult, WaterfallStepContext
@@ -54,7 +54,7 @@ class EndDateResolverDialog(CancelAndHelpDialog):
                 DateTimePrompt.__name__,
                 PromptOptions(prompt=prompt_msg, retry_prompt=reprompt_msg))
  
-        if "definite" in Timex(timex).types:
+        if parse_timex(timex).is_definite:
             # This is essentially a "reprompt" of the data we were given up front.
             return await step_context.prompt(DateTimePrompt.__name__, PromptOptions(prompt=reprompt_msg))
 
@@ -76,7 +76,6 @@ class EndDateResolverDialog(CancelAndHelpDialog):
         if prompt_context.recognized.succeeded:
             timex = prompt_context.recognized.value[0].timex.split("T")[0]
 
-            # TODO: Needs TimexProperty
-            return "definite" in Timex(timex).types
+            return parse_timex(timex).is_definite
 
         return False
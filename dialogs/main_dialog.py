@@ -14,14 +14,20 @@ from botbuilder.core import (
     BotTelemetryClient,
     NullTelemetryClient,
 )
-from botbuilder.schema import InputHints, Attachment
+from botbuilder.schema import InputHints
 
 from booking_details import BookingDetails
 from flight_booking_recognizer import FlightBookingRecognizer
+from helpers.card_helper import CardTemplate
 from helpers.luis_helper import LuisHelper, Intent
+from helpers.timing import TIMINGS
 from .booking_dialog import BookingDialog
 
-import json,re
+import os.path
+
+FLIGHT_CARD_PATH = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)), "../bots/resources/bookedFlightCard.json"
+)
 
 class MainDialog(ComponentDialog):
     def __init__(
@@ -39,7 +45,10 @@ class MainDialog(ComponentDialog):
         booking_dialog.telemetry_client = self.telemetry_client
 
         wf_dialog = WaterfallDialog(
-            "WFDialog", [self.intro_step, self.act_step, self.final_step]
+            "WFDialog",
+            TIMINGS.timed_steps(
+                "MainDialog", [self.intro_step, self.act_step, self.final_step]
+            ),
         )
         wf_dialog.telemetry_client = self.telemetry_client
 
@@ -52,6 +61,9 @@ class MainDialog(ComponentDialog):
 
         self.initial_dialog_id = "WFDialog"
 
+        # see https://messagecardplayground.azurewebsites.net/
+        self._flight_card = CardTemplate.from_file(FLIGHT_CARD_PATH)
+
     async def intro_step(self, step_context: WaterfallStepContext) -> DialogTurnResult:
         if not self._luis_recognizer.is_configured:
             await step_context.context.send_activity(
@@ -156,36 +168,14 @@ class MainDialog(ComponentDialog):
     #         await context.send_activity(message)
  
      
-    def replaceTemplateKeys(self, templateCard: dict, data: dict):
-        """Replace keys in a template (card) by their values provided in the data set."""
-        string_temp = str(templateCard)
-        for key in data:
-            pattern = "\${" + key + "}"
-            string_temp = re.sub(pattern, str(data[key]), string_temp)
-        return eval(string_temp)
-
     def create_flight_ticket_attachment(self, result):
         """Create an adaptive card."""
-        # see https://messagecardplayground.azurewebsites.net/
-
-        path =  "./bots/resources/bookedFlightCard.json"
-        with open(path) as card_file:
-            card = json.load(card_file)
-        
-        origin = result.origin
-        destination = result.destination
-        start_date = result.start_date
-        end_date = result.end_date
-        budget = result.budget
-
-        templateCard = {
-            "origin": origin, 
-            "destination": destination,
-            "start_date": start_date,
-            "end_date": end_date,
-            "budget": budget}
-
-        flightCard = self.replaceTemplateKeys(card, templateCard)
-
-        return Attachment(
-            content_type="application/vnd.microsoft.card.adaptive", content=flightCard)
\ No newline at end of file
+        return self._flight_card.create_attachment(
+            {
+                "origin": result.origin,
+                "destination": result.destination,
+                "start_date": result.start_date,
+                "end_date": result.end_date,
+                "budget": result.budget,
+            }
+        )
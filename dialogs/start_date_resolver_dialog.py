@@ -3,7 +3,7 @@
 """Handle date/time resolution for booking dialog."""
 # this class is inspired by the DateResolverDialog class 
 
-from datatypes_date_time.timex import Timex
+from helpers.timex_helper import parse_timex
 
 from botbuilder.core import MessageFactory, BotTelemetryClient, NullTelemetryClient
 from botbuilder.dialogs import WaterfallDialog, DialogTurnResult, WaterfallStepContext
@@ -55,7 +55,7 @@ class StartDateResolverDialog(CancelAndHelpDialog):
                 DateTimePrompt.__name__,
                 PromptOptions(prompt=prompt_msg, retry_prompt=reprompt_msg))
 
-        if "definite" in Timex(timex).types:
+        if parse_timex(timex).is_definite:
             # This is essentially a "reprompt" of the data we were given up front.
             return await step_context.prompt(DateTimePrompt.__name__, PromptOptions(prompt=reprompt_msg))
 
@@ -77,7 +77,6 @@ class StartDateResolverDialog(CancelAndHelpDialog):
         if prompt_context.recognized.succeeded:
             timex = prompt_context.recognized.value[0].timex.split("T")[0]
 
-            # TODO: Needs TimexProperty
-            return "definite" in Timex(timex).types
+            return parse_timex(timex).is_definite
 
         return False
@@ -1,7 +1,9 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
-from botbuilder.ai.luis import LuisApplication, LuisRecognizer, LuisPredictionOptions
+from copy import deepcopy
+
+from botbuilder.ai.luis import LuisApplication, LuisPredictionOptions
 from botbuilder.core import (
     Recognizer,
     RecognizerResult,
@@ -11,13 +13,26 @@ from botbuilder.core import (
 )
 
 from config import DefaultConfig
+from helpers.luis_helper import Intent
+from helpers.ttl_cache import TTLCache
+from pooled_luis_recognizer import LuisConnectionOptions, PooledLuisRecognizer
 
 
 class FlightBookingRecognizer(Recognizer):
     def __init__(
-        self, configuration: DefaultConfig, telemetry_client: BotTelemetryClient = None
+        self,
+        configuration: DefaultConfig,
+        telemetry_client: BotTelemetryClient = None,
+        local_recognizer: Recognizer = None,
+        connection_options: LuisConnectionOptions = None,
     ):
         self._recognizer = None
+        self._cache = None
+
+        # Optional in-process recognizer: a fast path for clear-cut utterances,
+        # and the only recognizer when LUIS is not configured.
+        self._local_recognizer = local_recognizer
+        self._local_threshold = configuration.LOCAL_RECOGNIZER_THRESHOLD
 
         luis_is_configured = (
             configuration.LUIS_APP_ID
@@ -27,23 +42,107 @@ class FlightBookingRecognizer(Recognizer):
         if luis_is_configured:
             # Set the recognizer options depending on which endpoint version you want to use e.g v2 or v3.
             # More details can be found in https://docs.microsoft.com/azure/cognitive-services/luis/luis-migration-api-v3
+            endpoint = configuration.LUIS_API_HOST_NAME
+            if not endpoint.startswith(("https://", "http://")):
+                endpoint = "https://" + endpoint
             luis_application = LuisApplication(
                 configuration.LUIS_APP_ID,
                 configuration.LUIS_API_KEY,
-                "https://" + configuration.LUIS_API_HOST_NAME,
+                endpoint,
             )
 
             options = LuisPredictionOptions()
             options.telemetry_client = telemetry_client or NullTelemetryClient()
 
-            self._recognizer = LuisRecognizer(
-                luis_application, prediction_options=options
+            # Queries share a keep-alive connection pool instead of opening a connection each
+            self._recognizer = PooledLuisRecognizer(
+                luis_application,
+                prediction_options=options,
+                connection_options=connection_options
+                or LuisConnectionOptions.from_config(configuration),
+            )
+
+            # Results are cached per LUIS app and published version, so that a new publication
+            # does not serve predictions of the previous model.
+            if configuration.LUIS_CACHE_SIZE > 0:
+                self._cache = TTLCache(
+                    configuration.LUIS_CACHE_SIZE, configuration.LUIS_CACHE_TTL
+                )
+            self._cache_namespace = (
+                configuration.LUIS_APP_ID,
+                configuration.LUIS_APP_VERSION,
             )
 
     @property
     def is_configured(self) -> bool:
-        # Returns true if luis is configured in the config.py and initialized.
-        return self._recognizer is not None
+        # Returns true if luis is configured in the config.py and initialized, or if a local recognizer is used.
+        return self._recognizer is not None or self._local_recognizer is not None
+
+    @property
+    def cache_stats(self) -> dict:
+        # Returns the hit/miss/eviction counters of the LUIS results cache, or None if it is disabled.
+        return self._cache.stats if self._cache is not None else None
+
+    @property
+    def pool_stats(self) -> dict:
+        # Returns the request and connection counters of the LUIS connection pool, or None without LUIS.
+        return self._recognizer.pool_stats if self._recognizer is not None else None
+
+    async def warm_up(self) -> int:
+        """Opens connections to LUIS ahead of the first turns, returns how many could be opened."""
+        if self._recognizer is None:
+            return 0
+        return await self._recognizer.warm_up()
+
+    async def close(self):
+        if self._recognizer is not None:
+            await self._recognizer.close()
+
+    async def recognize(
+        self, turn_context: TurnContext, use_cache: bool = True
+    ) -> RecognizerResult:
+        """
+        Returns the LUIS result for the turn's utterance, or the local recognizer's one when it is
+        clear-cut or when LUIS is not configured.
+        The results cache is looked up first, so that a hit costs neither LUIS nor the local recognizer:
+        it only holds LUIS results, of utterances which were not clear-cut.
+        Set use_cache to False to force a call to LUIS, bypassing the results cache.
+        """
+        if self._recognizer is None:
+            return await self._local_recognizer.recognize(turn_context)
+
+        utterance = turn_context.activity.text
+        use_cache = use_cache and self._cache is not None and bool(utterance)
+        if use_cache:
+            key = self._cache_key(utterance)
+            cached = self._cache.get(key)
+            if cached is not None:
+                return self._copy_result(cached, utterance)
+
+        if self._local_recognizer is not None:
+            local_result = await self._local_recognizer.recognize(turn_context)
+            if self._is_clear_cut(local_result):
+                return local_result
+
+        recognizer_result = await self._recognizer.recognize(turn_context)
+        if use_cache and recognizer_result is not None:
+            self._cache.put(key, deepcopy(recognizer_result))
+        return recognizer_result
+
+    def _is_clear_cut(self, recognizer_result: RecognizerResult) -> bool:
+        # "None" is never clear-cut: LUIS may understand what the local model does not.
+        if recognizer_result is None or not recognizer_result.intents:
+            return False
+        intent, score = recognizer_result.get_top_scoring_intent()
+        return intent not in ("", Intent.NONE_INTENT.value) and score >= self._local_threshold
+
+    def _cache_key(self, utterance: str) -> tuple:
+        # Normalize case and whitespace, so that "Book a  flight" and "book a flight" share an entry
+        return self._cache_namespace + (" ".join(utterance.lower().split()),)
 
-    async def recognize(self, turn_context: TurnContext) -> RecognizerResult:
-        return await self._recognizer.recognize(turn_context)
+    @staticmethod
+    def _copy_result(cached: RecognizerResult, utterance: str) -> RecognizerResult:
+        # Callers get their own copy, carrying their exact utterance
+        recognizer_result = deepcopy(cached)
+        recognizer_result.text = utterance
+        return recognizer_result
@@ -2,6 +2,26 @@
 # Licensed under the MIT License.
 """Helpers module."""
 
-from . import activity_helper, luis_helper, dialog_helper
+import importlib
 
-__all__ = ["activity_helper", "dialog_helper", "luis_helper"]
+__all__ = [
+    "activity_helper",
+    "card_helper",
+    "command_matcher",
+    "dialog_helper",
+    "luis_helper",
+    "metrics",
+    "request_context",
+    "state_helper",
+    "timex_helper",
+    "timing",
+    "ttl_cache",
+]
+
+
+def __getattr__(name: str):
+    # The helpers are imported on first use, so that importing a light one, ie timing, does not
+    # import the LUIS SDK and the dialogs the others need
+    if name in __all__:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,95 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Adaptive card templates, loaded once and rendered without re-parsing."""
+
+import json
+import re
+from typing import Dict, List, Union
+
+from botbuilder.schema import Attachment
+
+ADAPTIVE_CARD_CONTENT_TYPE = "application/vnd.microsoft.card.adaptive"
+
+SLOT_PATTERN = re.compile(r"\$\{(\w+)\}")
+
+
+class CardTemplate:
+    """
+    Adaptive card whose ${key} slots are located once, when the template is loaded.
+    Rendering copies the containers on the way to each slot and fills the slots; the other
+    parts of the card are shared with the template, so rendered cards must be treated as read-only.
+    """
+
+    def __init__(self, card: Union[dict, list]):
+        self._card = card
+        self._slot_names = set()
+        self._plan = self._compile(card)
+
+    @classmethod
+    def from_file(cls, path: str) -> "CardTemplate":
+        with open(path) as card_file:
+            return cls(json.load(card_file))
+
+    @property
+    def slot_names(self) -> List[str]:
+        return sorted(self._slot_names)
+
+    def render(self, data: Dict[str, object] = None) -> Union[dict, list]:
+        """Returns the card with its ${key} slots replaced by str(data[key]). Unknown keys are left as is."""
+        if self._plan is None:
+            return self._card
+        return self._render(self._card, self._plan, data or {})
+
+    def create_attachment(self, data: Dict[str, object] = None) -> Attachment:
+        return Attachment(content_type=ADAPTIVE_CARD_CONTENT_TYPE, content=self.render(data))
+
+    def _compile(self, node):
+        # The plan mirrors the card, keeping only the branches that lead to a slot.
+        # A slot is compiled into its parts: literal strings at even indexes, slot names at odd ones.
+        if isinstance(node, str):
+            parts = SLOT_PATTERN.split(node)
+            if len(parts) == 1:
+                return None
+            self._slot_names.update(parts[1::2])
+            return _Slot(parts)
+
+        if isinstance(node, dict):
+            items = node.items()
+        elif isinstance(node, list):
+            items = enumerate(node)
+        else:
+            return None
+
+        plan = {}
+        for key, child in items:
+            child_plan = self._compile(child)
+            if child_plan is not None:
+                plan[key] = child_plan
+        return plan or None
+
+    @staticmethod
+    def _render(node, plan, data: Dict[str, object]):
+        if isinstance(plan, _Slot):
+            return plan.fill(data)
+        copy = node.copy()
+        for key, child_plan in plan.items():
+            copy[key] = CardTemplate._render(node[key], child_plan, data)
+        return copy
+
+
+class _Slot:
+    __slots__ = ("parts",)
+
+    def __init__(self, parts: List[str]):
+        self.parts = parts
+
+    def fill(self, data: Dict[str, object]) -> str:
+        parts = self.parts
+        if len(parts) == 3 and not parts[0] and not parts[2]:
+            # The whole string is a single slot, the common case
+            name = parts[1]
+            return str(data[name]) if name in data else "${" + name + "}"
+        return "".join(
+            part if index % 2 == 0 else (str(data[part]) if part in data else "${" + part + "}")
+            for index, part in enumerate(parts)
+        )
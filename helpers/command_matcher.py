@@ -0,0 +1,67 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Matcher of the interrupt commands (help, cancel), shared by the command router and the dialogs."""
+
+from typing import Dict, Iterable, Mapping, Optional
+
+HELP = "help"
+CANCEL = "cancel"
+
+# Phrases of each command by language. The phrases of the default language are understood whatever
+# the locale of the activity.
+DEFAULT_PHRASES = {
+    HELP: {"en": ("help", "?"), "fr": ("aide", "?")},
+    CANCEL: {"en": ("cancel", "quit"), "fr": ("annuler", "quitter")},
+}
+
+
+def normalize(text: str) -> str:
+    """Case-folded text with single spaces and without trailing "." or "!", ie "help" for " Help! "."""
+    text = " ".join(text.casefold().split())
+    return text.rstrip(".!") or text
+
+
+class CommandMatcher:
+    """
+    Finds whether a whole utterance is an interrupt command, ie "cancel" but not "cancel my flight to Paris".
+    The phrases are normalized once into a table per language, so a match is a dict lookup.
+    """
+
+    def __init__(
+        self,
+        phrases: Mapping[str, Mapping[str, Iterable[str]]] = None,
+        default_locale: str = "en",
+    ):
+        self._default = {}
+        self._tables: Dict[str, Dict[str, str]] = {}
+        self.compile(phrases or DEFAULT_PHRASES, default_locale)
+
+    def compile(self, phrases: Mapping[str, Mapping[str, Iterable[str]]], default_locale: str = "en") -> None:
+        """Replaces the phrases: {command: {language: phrases}}."""
+        default_language = self.language(default_locale)
+        tables: Dict[str, Dict[str, str]] = {}
+        for command, by_language in phrases.items():
+            for language, command_phrases in by_language.items():
+                table = tables.setdefault(self.language(language), {})
+                for phrase in command_phrases:
+                    table[normalize(phrase)] = command
+        default = tables.get(default_language, {})
+        # The phrases of a language take precedence over those of the default one
+        self._tables = {language: {**default, **table} for language, table in tables.items()}
+        self._default = default
+
+    @staticmethod
+    def language(locale: Optional[str]) -> str:
+        """The language of a locale, ie "fr" for "fr-FR"."""
+        return (locale or "").split("-")[0].casefold()
+
+    def match(self, text: Optional[str], locale: str = None) -> Optional[str]:
+        """The command of the text in the given locale, None if it is not one."""
+        if not text:
+            return None
+        table = self._tables.get(self.language(locale), self._default) if locale else self._default
+        return table.get(normalize(text))
+
+
+# Matcher of the bot, configured by the app
+COMMANDS = CommandMatcher()
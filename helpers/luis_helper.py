@@ -6,12 +6,17 @@ from botbuilder.ai.luis import LuisRecognizer
 from botbuilder.core import IntentScore, TopIntent, TurnContext
 
 from booking_details import BookingDetails
+from helpers.metrics import METRICS, channel_label
+from helpers.timing import TIMINGS
 
 
 luis_bot_entities_mapping = {'or_city': 'origin', 'dst_city':'destination', 'str_date': 'start_date', 'end_date': 'end_date', 'budget': 'budget'}
 
 luis_entities_type = {'or_city': 'geographyV2_city', 'dst_city':'geographyV2_city', 'str_date': 'datetime', 'end_date': 'datetime', 'budget': 'number'}
 
+INTENTS = METRICS.counter("intents_total", "Top intents of the utterances recognized.", ("channel", "intent"))
+LUIS_ERRORS = METRICS.counter("luis_errors_total", "Utterances the recognizer failed to recognize.", ("channel",))
+
 
 class Intent(Enum):
     BOOK_FLIGHT = "Book"
@@ -43,8 +48,10 @@ class LuisHelper:
         intent = None
 
         try:
-            recognizer_result = await luis_recognizer.recognize(turn_context)
+            with TIMINGS.span("luis"):
+                recognizer_result = await luis_recognizer.recognize(turn_context)
             intent = recognizer_result.get_top_scoring_intent().intent
+            INTENTS.inc(channel_label(turn_context.activity.channel_id), intent or Intent.NONE_INTENT.value)
             # intent = (
             #     sorted(
             #         recognizer_result.intents,
@@ -112,6 +119,7 @@ class LuisHelper:
                         setattr(result, luis_bot_entities_mapping[key], entity)
                      
         except Exception as exception:
+            LUIS_ERRORS.inc(channel_label(turn_context.activity.channel_id))
             print(exception)
 
         return intent, result
@@ -130,12 +138,16 @@ class LuisHelper:
         score = 0
         index = None 
         # get the index of the entity "key" having the best score in the recognizer results
-        for i, entity in enumerate(recognizer_result.entities.get("$instance").get(key)):
-            if entity['score'] > score:
+        # (an instance without a score, or a key without $instance metadata, is never selected)
+        key_instances = recognizer_result.entities.get("$instance").get(key) or []
+        for i, entity in enumerate(key_instances):
+            if entity.get('score', 0) > score:
                 score = entity['score']
                 index = i
 
-        selected_entity = recognizer_result.entities.get("$instance").get(key)[index]
+        if index is None:
+            return None
+        selected_entity = key_instances[index]
 
         score = 100
         index = None
@@ -146,7 +158,8 @@ class LuisHelper:
             return None
 
         # among the types in the recognizer results, let's find the one now that minimizes the overlap between the selected entity
-        for i, entity in enumerate(recognizer_result.entities.get("$instance").get(type)):
+        # (a type without $instance metadata can not be located, so its entities are missing)
+        for i, entity in enumerate(recognizer_result.entities.get("$instance").get(type) or []):
             s = abs(entity['startIndex'] - selected_entity['startIndex']) + abs(entity['endIndex'] - selected_entity['endIndex'])
             if s < score:
                 score = s
@@ -168,4 +181,4 @@ class LuisHelper:
             else recognizer_result.entities.get(type)[index]
             if type == 'number'
             else None
-        )
\ No newline at end of file
+        )
@@ -0,0 +1,222 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Counters and gauges of the bot process, rendered with the timing histograms in the Prometheus text format."""
+
+import asyncio
+import contextvars
+import math
+import time
+from contextlib import contextmanager
+from typing import Callable, Container, Dict, Iterable, Optional, Tuple, Union
+
+from botbuilder.schema import ActivityTypes
+
+from helpers.timing import TIMINGS, TimingRegistry
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+ACTIVITY_TYPES = frozenset(activity_type.value for activity_type in ActivityTypes)
+_CHANNELS = None
+_UNCOUNTED: contextvars.ContextVar = contextvars.ContextVar("uncounted", default=False)
+
+
+def bounded_label(value: Optional[str], known: Container[str]) -> str:
+    """
+    The label of a value sent by the clients: itself if known, "unknown" if missing, "other" otherwise,
+    so that a client can not create series at will.
+    """
+    if not value:
+        return "unknown"
+    # The str values of the enums of the schema, ie ActivityTypes.message, not their name
+    value = getattr(value, "value", value)
+    return value if value in known else "other"
+
+
+def channel_label(channel_id: Optional[str]) -> str:
+    """The label of a channel id, bounded to the channels of the Bot Framework."""
+    global _CHANNELS  # pylint: disable=global-statement
+    if _CHANNELS is None:
+        # Imported on first use: the connector is only loaded once the bot is built
+        from botframework.connector import Channels  # pylint: disable=import-outside-toplevel
+
+        _CHANNELS = frozenset(channel.value for channel in Channels)
+    return bounded_label(channel_id, _CHANNELS)
+
+
+@contextmanager
+def uncounted():
+    """The counters are not incremented by the enclosed block, nor by the tasks it creates, ie synthetic turns."""
+    token = _UNCOUNTED.set(True)
+    try:
+        yield
+    finally:
+        _UNCOUNTED.reset(token)
+
+
+class Counter:
+    """
+    Totals by label values, which only go up. Incremented from the event loop thread only, so no
+    lock is needed: an increment is a dict lookup and an addition.
+    """
+
+    __slots__ = ("name", "help", "label_names", "values")
+
+    def __init__(self, name: str, help_text: str, label_names: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        if _UNCOUNTED.get():
+            return
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+class Gauge:
+    """
+    Values read when the metrics are rendered, from the state of a component: function returns a
+    number, a dict of numbers by label values, or None when there is nothing to report.
+    """
+
+    __slots__ = ("name", "help", "label_names", "function", "type")
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        function: Callable[[], Union[None, float, Dict[tuple, float]]],
+        label_names: Iterable[str] = (),
+        metric_type: str = "gauge",
+    ):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.function = function
+        self.type = metric_type
+
+    @property
+    def values(self) -> Dict[tuple, float]:
+        values = self.function()
+        if values is None:
+            return {}
+        if isinstance(values, dict):
+            return values
+        return {(): values}
+
+
+class MetricsRegistry:
+    """
+    The counters and gauges of the process, by name, and the histograms of the timing registry,
+    rendered as the flybot_span_seconds histogram with a span label. The names are prefixed with
+    namespace. Each process has its own: with several workers, a scrape gets those of the worker
+    which accepted it, labelled with its pid.
+    """
+
+    def __init__(self, namespace: str = "flybot", timings: TimingRegistry = TIMINGS):
+        self.namespace = namespace
+        self.timings = timings
+        self.const_labels: Dict[str, str] = {}
+        self._metrics: Dict[str, Union[Counter, Gauge]] = {}
+
+    def counter(self, name: str, help_text: str, label_names: Iterable[str] = ()) -> Counter:
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = Counter(name, help_text, label_names)
+        return metric
+
+    def gauge(
+        self,
+        name: str,
+        help_text: str,
+        function: Callable[[], Union[None, float, Dict[tuple, float]]],
+        label_names: Iterable[str] = (),
+        metric_type: str = "gauge",
+    ) -> Gauge:
+        """Registers a gauge, replacing the one of the same name. A metric_type of counter reports a total kept by a component."""
+        metric = self._metrics[name] = Gauge(name, help_text, function, label_names, metric_type)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            name = f"{self.namespace}_{metric.name}"
+            metric_type = "counter" if isinstance(metric, Counter) else metric.type
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for label_values, value in sorted(metric.values.items(), key=lambda item: tuple(map(str, item[0]))):
+                lines.append(self._sample(name, zip(metric.label_names, label_values), value))
+
+        histograms = sorted(self.timings.histograms.items())
+        if histograms:
+            name = f"{self.namespace}_span_seconds"
+            lines.append(f"# HELP {name} Durations of the stages of the turns, and of the event loop lag.")
+            lines.append(f"# TYPE {name} histogram")
+        for span, histogram in histograms:
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets + (math.inf,), histogram.bucket_counts):
+                cumulative += bucket_count
+                lines.append(self._sample(f"{name}_bucket", (("span", span), ("le", bound)), cumulative))
+            lines.append(self._sample(f"{name}_sum", (("span", span),), histogram.sum))
+            lines.append(self._sample(f"{name}_count", (("span", span),), histogram.count))
+        lines.append("")
+        return "\n".join(lines)
+
+    def _sample(self, name: str, labels: Iterable[Tuple[str, object]], value: float) -> str:
+        labels = list(self.const_labels.items()) + list(labels)
+        if not labels:
+            return f"{name} {_format_value(value)}"
+        label_text = ",".join(f'{label}="{_format_label(label_value)}"' for label, label_value in labels)
+        return f"{name}{{{label_text}}} {_format_value(value)}"
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+
+def _format_label(value: object) -> str:
+    if isinstance(value, float):
+        return _format_value(value)
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class EventLoopLagMonitor:
+    """
+    Sleeps interval seconds at a time and observes how late it wakes up as the loop.lag span: the
+    time the callbacks ready before it, ie the turns, held the event loop.
+    """
+
+    def __init__(self, interval: float = 0.5, timings: TimingRegistry = TIMINGS):
+        self.interval = interval
+        self.timings = timings
+        self.lag = 0.0
+        self._monitor: Optional[asyncio.Future] = None
+
+    def start(self) -> None:
+        if self._monitor is None or self._monitor.done():
+            self._monitor = asyncio.ensure_future(self._monitor_forever())
+
+    async def stop(self) -> None:
+        if self._monitor is not None:
+            self._monitor.cancel()
+            try:
+                await self._monitor
+            except asyncio.CancelledError:
+                pass
+            self._monitor = None
+
+    async def _monitor_forever(self):
+        histogram = self.timings.histogram("loop.lag")
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, time.perf_counter() - start - self.interval)
+            histogram.observe(self.lag)
+
+
+# The registry of the process
+METRICS = MetricsRegistry()
@@ -0,0 +1,8 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""State of the request being handled, kept apart so that the app sets it without importing the telemetry client."""
+
+import contextvars
+
+# The body of the request being handled, ie the activity, attached to the items tracked while handling it
+REQUEST_BODY: contextvars.ContextVar = contextvars.ContextVar("telemetry_request_body", default=None)
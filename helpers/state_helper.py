@@ -0,0 +1,74 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Utility to load, save and delete several bot states with one storage operation."""
+from typing import Dict, List
+
+from botbuilder.core import BotState, Storage, TurnContext
+from botbuilder.core.bot_state import CachedBotState
+
+
+class StateHelper:
+    """
+    Batched BotState persistence: the states sharing a storage are read with one read and written
+    with one write, instead of one round trip per state. Only the states whose serialized content
+    changed during the turn are written.
+    """
+
+    @staticmethod
+    async def load_all(turn_context: TurnContext, *bot_states: BotState, force: bool = False):
+        """Loads the states not cached in the turn yet (all of them with force), as BotState.load does."""
+        to_load = [
+            bot_state
+            for bot_state in bot_states
+            if force or not getattr(bot_state.get_cached_state(turn_context), "state", None)
+        ]
+        for storage, states in StateHelper._by_storage(to_load).items():
+            keys = {bot_state: bot_state.get_storage_key(turn_context) for bot_state in states}
+            items = await storage.read(list(keys.values()))
+            for bot_state, key in keys.items():
+                cached_state = CachedBotState(items.get(key))
+                if key not in items:
+                    # CachedBotState hashes None for a new state, which makes an untouched {} look changed
+                    cached_state.hash = cached_state.compute_hash(cached_state.state)
+                # pylint: disable=protected-access
+                turn_context.turn_state[bot_state._context_service_key] = cached_state
+
+    @staticmethod
+    async def save_all_changes(turn_context: TurnContext, *bot_states: BotState, force: bool = False):
+        """Writes the states which changed during the turn (all of them with force), as BotState.save_changes does."""
+        to_save = []
+        for bot_state in bot_states:
+            cached_state = bot_state.get_cached_state(turn_context)
+            if cached_state is None:
+                continue
+            # The state is serialized once, both to detect the changes and as the hash once saved
+            new_hash = cached_state.compute_hash(cached_state.state)
+            if force or new_hash != cached_state.hash:
+                to_save.append((bot_state, cached_state, new_hash))
+
+        for storage, states in StateHelper._by_storage([bot_state for bot_state, _, _ in to_save]).items():
+            await storage.write(
+                {
+                    bot_state.get_storage_key(turn_context): bot_state.get_cached_state(turn_context).state
+                    for bot_state in states
+                }
+            )
+        for _, cached_state, new_hash in to_save:
+            cached_state.hash = new_hash
+
+    @staticmethod
+    async def delete_all(turn_context: TurnContext, *bot_states: BotState):
+        """Deletes the states without loading them, with one delete per storage."""
+        for storage, states in StateHelper._by_storage(list(bot_states)).items():
+            await storage.delete([bot_state.get_storage_key(turn_context) for bot_state in states])
+            for bot_state in states:
+                # pylint: disable=protected-access
+                turn_context.turn_state.pop(bot_state._context_service_key, None)
+
+    @staticmethod
+    def _by_storage(bot_states: List[BotState]) -> Dict[Storage, List[BotState]]:
+        by_storage = {}
+        for bot_state in bot_states:
+            # pylint: disable=protected-access
+            by_storage.setdefault(bot_state._storage, []).append(bot_state)
+        return by_storage
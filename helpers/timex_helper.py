@@ -0,0 +1,42 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Memoized parsing and classification of TIMEX expressions, shared by the date dialogs."""
+
+from datetime import date
+from functools import lru_cache
+from typing import FrozenSet, NamedTuple, Optional
+
+from datatypes_date_time.timex import Timex
+
+# Distinct timex strings remembered; users give few distinct dates, so this is rarely reached
+TIMEX_CACHE_SIZE = 1024
+
+
+class TimexInfo(NamedTuple):
+    """What the dialogs need to know about a timex: its types, and its date when it is a definite one."""
+
+    timex: Optional[str]
+    types: FrozenSet[str]
+    date: Optional[date]
+
+    @property
+    def is_definite(self) -> bool:
+        return "definite" in self.types
+
+    @property
+    def is_ambiguous(self) -> bool:
+        return "definite" not in self.types
+
+
+@lru_cache(maxsize=TIMEX_CACHE_SIZE)
+def parse_timex(timex: Optional[str]) -> TimexInfo:
+    """Parses a timex, ie "2022-10-12" or "XXXX-10-12", once: later calls with the same string are cache hits."""
+    timex_property = Timex(timex)
+    types = frozenset(timex_property.types)
+    resolved = None
+    if "definite" in types:
+        try:
+            resolved = date(timex_property.year, timex_property.month, timex_property.day_of_month)
+        except (TypeError, ValueError):
+            pass  # ie the 31st of a 30 day month: still "definite" for Timex
+    return TimexInfo(timex, types, resolved)
@@ -0,0 +1,229 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Timing spans of the stages of a turn, aggregated in histograms and sampled into per-turn traces."""
+
+import asyncio
+import contextvars
+import functools
+import json
+import math
+import random
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+if TYPE_CHECKING:
+    from botbuilder.core import BotTelemetryClient
+
+# Upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Histogram:
+    """
+    Bucketed distribution of durations, in seconds. The cumulative bucket counts never reset;
+    count, sum, min and max are also kept per export interval.
+    Observations come from the event loop thread only, so no lock is needed.
+    """
+
+    __slots__ = (
+        "name", "buckets", "bucket_counts", "count", "sum",
+        "_interval_count", "_interval_sum", "_interval_squares", "_interval_min", "_interval_max",
+    )
+
+    def __init__(self, name: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._reset_interval()
+
+    def observe(self, value: float) -> None:
+        self.bucket_counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self._interval_count += 1
+        self._interval_sum += value
+        self._interval_squares += value * value
+        if value < self._interval_min:
+            self._interval_min = value
+        if value > self._interval_max:
+            self._interval_max = value
+
+    def quantile(self, fraction: float) -> float:
+        """Estimates a quantile from the buckets: the upper bound of the bucket holding it."""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for bound, bucket_count in zip(self.buckets, self.bucket_counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+    def take_interval(self) -> Optional[dict]:
+        """Returns the count, sum, min, max and standard deviation since the last call, or None if empty."""
+        if not self._interval_count:
+            return None
+        count, total = self._interval_count, self._interval_sum
+        variance = max(0.0, self._interval_squares / count - (total / count) ** 2)
+        interval = {
+            "count": count,
+            "sum": total,
+            "min": self._interval_min,
+            "max": self._interval_max,
+            "std_dev": math.sqrt(variance),
+        }
+        self._reset_interval()
+        return interval
+
+    def _reset_interval(self) -> None:
+        self._interval_count = 0
+        self._interval_sum = 0.0
+        self._interval_squares = 0.0
+        self._interval_min = math.inf
+        self._interval_max = 0.0
+
+
+class TurnTrace:
+    """The spans of one sampled turn, as offsets from the start of the turn."""
+
+    __slots__ = ("start", "spans", "properties")
+
+    def __init__(self, **properties):
+        self.start = time.perf_counter()
+        self.spans: List[tuple] = []
+        self.properties = properties
+
+    def add(self, name: str, start: float, duration: float) -> None:
+        self.spans.append((name, start - self.start, duration))
+
+    def to_dict(self) -> dict:
+        record = dict(self.properties)
+        record["duration_ms"] = round((time.perf_counter() - self.start) * 1000, 3)
+        record["spans"] = [
+            {"name": name, "start_ms": round(offset * 1000, 3), "duration_ms": round(duration * 1000, 3)}
+            for name, offset, duration in sorted(self.spans, key=lambda span: span[1])
+        ]
+        return record
+
+
+_CURRENT_TRACE: contextvars.ContextVar = contextvars.ContextVar("turn_trace", default=None)
+
+
+class TimingRegistry:
+    """The histograms of the spans, by name, and the sampling of per-turn traces."""
+
+    def __init__(self, sample_rate: float = 0.0, buckets=DEFAULT_BUCKETS):
+        self.sample_rate = sample_rate
+        self.buckets = buckets
+        self.histograms: Dict[str, Histogram] = {}
+        self.trace_sink: Callable[[dict], None] = None
+        self._exporter = None
+
+    def histogram(self, name: str) -> Histogram:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(name, self.buckets)
+        return histogram
+
+    def observe(self, name: str, start: float, duration: float) -> None:
+        self.histogram(name).observe(duration)
+        trace = _CURRENT_TRACE.get()
+        if trace is not None:
+            trace.add(name, start, duration)
+
+    @contextmanager
+    def span(self, name: str):
+        """Times the enclosed block, which may await."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, start, time.perf_counter() - start)
+
+    def timed(self, name: str):
+        """Decorates a coroutine function so that each call is timed as a span."""
+
+        def decorator(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return await function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def timed_steps(self, prefix: str, steps: list) -> list:
+        """Wraps waterfall steps, so that each one is timed as the span prefix.step_name."""
+        return [self.timed(f"{prefix}.{step.__name__}")(step) for step in steps]
+
+    @contextmanager
+    def turn(self, **properties):
+        """
+        Times a whole turn as the "turn" span. Sampled turns also record their spans, and
+        the trace is passed to trace_sink when the turn ends.
+        """
+        trace = None
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            trace = TurnTrace(**properties)
+        token = _CURRENT_TRACE.set(trace)
+        start = time.perf_counter()
+        try:
+            yield trace
+        finally:
+            self.histogram("turn").observe(time.perf_counter() - start)
+            _CURRENT_TRACE.reset(token)
+            if trace is not None and self.trace_sink is not None:
+                self.trace_sink(trace.to_dict())
+
+    def current_trace(self) -> Optional[TurnTrace]:
+        return _CURRENT_TRACE.get()
+
+    def export(self, telemetry_client: "BotTelemetryClient") -> None:
+        """Sends one aggregated metric (the default metric type) per span observed since the last export."""
+        for name, histogram in list(self.histograms.items()):
+            interval = histogram.take_interval()
+            if interval is None:
+                continue
+            telemetry_client.track_metric(
+                f"span.{name}",
+                interval["sum"],
+                count=interval["count"],
+                min_val=interval["min"],
+                max_val=interval["max"],
+                std_dev=interval["std_dev"],
+            )
+
+    def start_exporter(self, telemetry_client: "BotTelemetryClient", interval: float) -> None:
+        """Exports the histograms every interval seconds, and the sampled traces as they end."""
+        self.trace_sink = lambda record: telemetry_client.track_trace(
+            "turn timing", {"trace": json.dumps(record)}, "INFO"
+        )
+        if self._exporter is None or self._exporter.done():
+            self._exporter = asyncio.ensure_future(self._export_forever(telemetry_client, interval))
+
+    async def stop_exporter(self, telemetry_client: "BotTelemetryClient") -> None:
+        if self._exporter is not None:
+            self._exporter.cancel()
+            try:
+                await self._exporter
+            except asyncio.CancelledError:
+                pass
+            self._exporter = None
+            self.export(telemetry_client)
+
+    async def _export_forever(self, telemetry_client: "BotTelemetryClient", interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            self.export(telemetry_client)
+
+
+# The registry of the process
+TIMINGS = TimingRegistry()
@@ -0,0 +1,86 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Bounded LRU cache with time-to-live expiry."""
+
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable
+
+
+class TTLCache:
+    """
+    In-process LRU cache whose entries also expire after a fixed time-to-live.
+    The least recently used entry is evicted once max_size is reached.
+    """
+
+    _MISSING = object()
+
+    def __init__(
+        self,
+        max_size: int = 1024,
+        ttl: float = 300.0,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        if max_size <= 0:
+            raise ValueError("[TTLCache]: max_size must be a positive integer")
+        if ttl <= 0:
+            raise ValueError("[TTLCache]: ttl must be a positive number of seconds")
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self._timer = timer
+        # key -> (expiry time, value), ordered from least to most recently used
+        self._entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, self._MISSING, count=False) is not self._MISSING
+
+    def get(self, key: Hashable, default: object = None, count: bool = True):
+        """Returns the cached value for key, or default if it is missing or expired."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > self._timer():
+                self._entries.move_to_end(key)
+                if count:
+                    self.hits += 1
+                return entry[1]
+            del self._entries[key]
+            self.expirations += 1
+        if count:
+            self.misses += 1
+        return default
+
+    def put(self, key: Hashable, value: object, ttl: float = None) -> None:
+        """Stores value under key for ttl seconds (the cache ttl by default), evicting the least recently used entry if needed."""
+        if key in self._entries:
+            del self._entries[key]
+        elif len(self._entries) >= self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        self._entries[key] = (self._timer() + (self.ttl if ttl is None else ttl), value)
+
+    def pop(self, key: Hashable, default: object = None):
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
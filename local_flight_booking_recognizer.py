@@ -0,0 +1,318 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""In-process recognizer compiled from the LUIS model export."""
+
+import json
+import os.path
+import re
+from collections import OrderedDict, defaultdict
+from typing import Dict, List
+
+from botbuilder.ai.luis.luis_util import LuisUtil
+from botbuilder.core import IntentScore, Recognizer, RecognizerResult, TurnContext
+from botbuilder.schema import ActivityTypes
+from recognizers_date_time import DateTimeRecognizer
+from recognizers_number import NumberRecognizer
+from recognizers_text import Culture
+
+from helpers.luis_helper import Intent
+
+DEFAULT_MODEL_PATH = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)), "cognitiveModels/FlightBooking.json"
+)
+
+# The exported model predates the published LUIS app: map its intents and composites
+# onto the names the bot's dialogs consume (see helpers.luis_helper).
+INTENT_MAPPING = {
+    "Book flight": Intent.BOOK_FLIGHT.value,
+    "Cancel": Intent.CANCEL.value,
+    "None": Intent.NONE_INTENT.value,
+}
+COMPOSITE_MAPPING = {"From": "or_city", "To": "dst_city"}
+
+# The model has no labels for dates and budget, so their roles are told apart with these cues.
+START_DATE_CUES = {"on", "starting", "start", "leaving", "leave", "departing", "depart", "departure"}
+END_DATE_CUES = {"return", "returning", "back", "until", "till", "coming"}
+BUDGET_CUES = {"budget", "max", "maximum", "under", "$", "€", "£", "eur", "euro", "euros", "usd", "dollar", "dollars"}
+DATE_RANGE_SEPARATOR = re.compile(r"\s(?:to|and|until|till|through)\s|\s?-\s?")
+
+# Words that never name a city, even right after a "from"/"to" cue.
+STOP_WORDS = {
+    "a", "an", "the", "my", "me", "i", "you", "we", "and", "or", "be", "make", "get", "have", "see",
+    "with", "for", "on", "in", "at", "by", "of", "starting", "leaving", "returning",
+}
+
+TOKEN = re.compile(r"[\w']+|[$€£]")
+
+# Cheap pre-checks: the recognizers-text models cost milliseconds, skip them when they cannot match.
+MAY_HOLD_DATE = re.compile(
+    r"\d|\b(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec|mon|tue|wed|thu|fri|sat|sun|"
+    r"today|tomorrow|tonight|yesterday|next|this|last|week|month|year|day|christmas|easter)",
+    re.IGNORECASE,
+)
+MAY_HOLD_NUMBER = re.compile(
+    r"\d|\b(?:one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|twenty|thirty|forty|"
+    r"fifty|sixty|seventy|eighty|ninety|hundred|thousand|million|dozen|half)",
+    re.IGNORECASE,
+)
+
+
+class LocalFlightBookingRecognizer(Recognizer):
+    """
+    Pure-Python recognizer built from the closed lists, composites and labeled utterances of
+    cognitiveModels/FlightBooking.json. Dates and numbers are extracted with the recognizers-text
+    models used by the dialog prompts. Results are shaped like LUIS v2 results (with $instance metadata),
+    so that LuisHelper consumes them unchanged.
+    """
+
+    def __init__(self, model_path: str = DEFAULT_MODEL_PATH, culture: str = Culture.English):
+        with open(model_path) as model_file:
+            model = json.load(model_file)
+
+        self._intents = [
+            INTENT_MAPPING.get(intent["name"], LuisUtil.normalized_intent(intent["name"]))
+            for intent in model["intents"]
+        ]
+
+        # Gazetteer of closed list synonyms, longest first so that "new york" wins over "york"
+        self._gazetteer = {}
+        for closed_list in model["closedLists"]:
+            for sub_list in closed_list["subLists"]:
+                for synonym in sub_list["list"] + [sub_list["canonicalForm"]]:
+                    self._gazetteer[synonym.lower()] = sub_list["canonicalForm"]
+        synonyms = sorted(self._gazetteer, key=len, reverse=True)
+        self._gazetteer_pattern = re.compile(
+            r"\b(" + "|".join(re.escape(synonym) for synonym in synonyms) + r")\b"
+        ) if synonyms else None
+
+        # Intent vocabulary and composite cue words, learned from the labeled utterances
+        self._token_intents = defaultdict(set)
+        self._entity_intents = set()
+        self._city_cues = {}
+        for utterance in model["utterances"]:
+            intent = INTENT_MAPPING.get(
+                utterance["intent"], LuisUtil.normalized_intent(utterance["intent"])
+            )
+            text = utterance["text"].lower()
+            spans = [(entity["startPos"], entity["endPos"] + 1) for entity in utterance["entities"]]
+            tokens = [
+                (match.start(), match.group()) for match in TOKEN.finditer(text)
+            ]
+            for start, token in tokens:
+                if not any(begin <= start < end for begin, end in spans):
+                    self._token_intents[token].add(intent)
+            for entity in utterance["entities"]:
+                self._entity_intents.add(intent)
+                role = COMPOSITE_MAPPING.get(entity["entity"])
+                preceding = [token for start, token in tokens if start < entity["startPos"]]
+                if role and preceding:
+                    self._city_cues[preceding[-1]] = role
+
+        self._datetime_model = DateTimeRecognizer(culture).get_datetime_model()
+        self._number_model = NumberRecognizer(culture).get_number_model()
+
+    async def recognize(self, turn_context: TurnContext) -> RecognizerResult:
+        if turn_context.activity.type != ActivityTypes.message:
+            return None
+        return self.recognize_text(turn_context.activity.text)
+
+    def recognize_text(self, text: str) -> RecognizerResult:
+        """Returns a LUIS-like result for the given utterance."""
+        if not text or text.isspace():
+            return RecognizerResult(text=text, intents={"": IntentScore(score=1.0)}, entities={})
+
+        lowered = text.lower()
+        tokens = [(match.start(), match.end(), match.group()) for match in TOKEN.finditer(lowered)]
+        entities = {LuisUtil._metadata_key: {}}  # pylint: disable=protected-access
+
+        dates = self._extract_dates(text, tokens)
+        numbers = self._extract_numbers(text, tokens, dates)
+        cities = self._extract_cities(text, lowered, tokens, dates + numbers)
+
+        for span in cities + dates + numbers:
+            self._add_entity(entities, span)
+
+        # Intent votes: each known word votes for the intents it appeared in, each entity for the
+        # intents that carry entities. Unknown words lower the confidence, so that only clear-cut
+        # utterances score high.
+        covered = [(span["startIndex"], span["endIndex"]) for span in cities + dates + numbers]
+        words = [
+            token for start, _, token in tokens
+            if not any(begin <= start < end for begin, end in covered)
+        ]
+        roles = [span for span in cities + dates + numbers if span.get("role")]
+        votes = dict.fromkeys(self._intents, 0.0)
+        unknown = 0.0
+        for word in words:
+            intents = self._token_intents.get(word)
+            if not intents:
+                unknown += 1
+                continue
+            for intent in intents:
+                votes[intent] += 1.0 / len(intents)
+        for span in roles:
+            for intent in self._entity_intents:
+                votes[intent] += span["score"] / len(self._entity_intents)
+            unknown += 1.0 - span["score"]
+
+        total = len(words) + len(roles)
+        if Intent.NONE_INTENT.value in votes:
+            votes[Intent.NONE_INTENT.value] += unknown
+        intents = {
+            intent: IntentScore(score=round(vote / total, 4) if total else 0.0)
+            for intent, vote in votes.items()
+        }
+
+        return RecognizerResult(text=text, intents=intents, entities=entities)
+
+    def _extract_cities(self, text: str, lowered: str, tokens: list, taken: list) -> List[dict]:
+        cities = []
+        if self._gazetteer_pattern is not None:
+            for match in self._gazetteer_pattern.finditer(lowered):
+                cities.append(self._span(text, match.start(), match.end(), "builtin.geographyV2.city", 1.0))
+
+        # Unknown words right after a learned cue ("from", "to") are taken as cities, with a low score
+        def is_free(start: int) -> bool:
+            return not any(
+                span["startIndex"] <= start < span["endIndex"] for span in cities + taken
+            )
+
+        for index, (start, end, token) in enumerate(tokens):
+            role = self._city_cues.get(token)
+            if role is None:
+                continue
+            captured = []
+            for next_start, next_end, next_token in tokens[index + 1:index + 4]:
+                if (
+                    not next_token.isalpha()
+                    or len(next_token) < 2
+                    or next_token in self._token_intents
+                    or next_token in self._city_cues
+                    or next_token in STOP_WORDS
+                    or not is_free(next_start)
+                ):
+                    break
+                captured.append((next_start, next_end))
+            if captured:
+                cities.append(
+                    self._span(text, captured[0][0], captured[-1][1], "builtin.geographyV2.city", 0.5)
+                )
+
+        # Roles: the cue right before the city, then the remaining roles in order
+        cities.sort(key=lambda span: span["startIndex"])
+        free_roles = list(OrderedDict.fromkeys(COMPOSITE_MAPPING.values()))
+        for city in cities:
+            preceding = [token for start, _, token in tokens if start < city["startIndex"]]
+            role = self._city_cues.get(preceding[-1]) if preceding else None
+            if role in free_roles:
+                city["role"] = role
+                free_roles.remove(role)
+        for city in cities:
+            if "role" not in city and free_roles:
+                city["role"] = free_roles.pop(0)
+        return cities
+
+    def _extract_dates(self, text: str, tokens: list) -> List[dict]:
+        dates = []
+        if not MAY_HOLD_DATE.search(text):
+            return dates
+        for result in self._datetime_model.parse(text):
+            values = result.resolution.get("values") if result.resolution else None
+            if not values:
+                continue
+            timexes = list(OrderedDict.fromkeys(value["timex"] for value in values))
+            start, end = result.start, result.end + 1
+            type_name = "builtin." + result.type_name
+
+            range_match = re.fullmatch(r"\(([^,]+),([^,]+),[^)]*\)", timexes[0])
+            if range_match:
+                # A range carries both dates: split it when its text tells where each part is
+                separator = DATE_RANGE_SEPARATOR.search(text, start, end)
+                first = self._span(text, start, separator.start() if separator else end, type_name, 0.9)
+                first["value"] = {"type": "date", "timex": [range_match.group(1)]}
+                first["role"] = "str_date"
+                dates.append(first)
+                if separator:
+                    second = self._span(text, separator.end(), end, type_name, 0.9)
+                    second["value"] = {"type": "date", "timex": [range_match.group(2)]}
+                    second["role"] = "end_date"
+                    dates.append(second)
+                continue
+
+            words = [token for token_start, _, token in tokens if token_start < start][-2:]
+            if BUDGET_CUES.intersection(words) and result.text.isdigit():
+                # "a budget of 1150" is an amount, not the year 1150
+                continue
+            span = self._span(text, start, end, type_name, 0.9)
+            span["value"] = {"type": values[0]["type"], "timex": timexes}
+            words += [token for token_start, _, token in tokens if start <= token_start < end][:1]
+            if END_DATE_CUES.intersection(words):
+                span["role"] = "end_date"
+            elif START_DATE_CUES.intersection(words):
+                span["role"] = "str_date"
+            dates.append(span)
+
+        free_roles = [role for role in ("str_date", "end_date") if role not in [d.get("role") for d in dates]]
+        for date in dates:
+            if "role" not in date and free_roles:
+                date["role"] = free_roles.pop(0)
+        return dates
+
+    def _extract_numbers(self, text: str, tokens: list, dates: list) -> List[dict]:
+        numbers = []
+        if not MAY_HOLD_NUMBER.search(text):
+            return numbers
+        for result in self._number_model.parse(text):
+            span = self._span(text, result.start, result.end + 1, "builtin.number", 0.9)
+            span["value"] = LuisUtil.number(result.resolution["value"])
+            numbers.append(span)
+
+        # The budget is the number next to a budget cue, or else the only number outside of the dates
+        free = [
+            number for number in numbers
+            if not any(d["startIndex"] <= number["startIndex"] < d["endIndex"] for d in dates)
+        ]
+        budget = None
+        for number in free:
+            around = [token for start, _, token in tokens if start < number["startIndex"]][-3:]
+            around += [token for start, _, token in tokens if start >= number["endIndex"]][:1]
+            if BUDGET_CUES.intersection(around):
+                budget = number
+                break
+        if budget is None and len(free) == 1:
+            budget = free[0]
+        if budget is not None:
+            budget["role"] = "budget"
+        return numbers
+
+    @staticmethod
+    def _span(text: str, start: int, end: int, type_name: str, score: float) -> dict:
+        return {
+            "startIndex": start,
+            "endIndex": end,
+            "text": text[start:end],
+            "type": type_name,
+            "score": score,
+        }
+
+    @staticmethod
+    def _add_entity(entities: Dict[str, object], span: dict) -> None:
+        instance = entities[LuisUtil._metadata_key]  # pylint: disable=protected-access
+        metadata = {key: span[key] for key in ("startIndex", "endIndex", "text", "type")}
+        name = LocalFlightBookingRecognizer._entity_name(span["type"])
+        value = span.get("value", span["text"].lower())
+
+        entities.setdefault(name, []).append(value)
+        instance.setdefault(name, []).append(metadata)
+
+        role = span.get("role")
+        if role:
+            entities.setdefault(role, []).append(span["text"].lower())
+            instance.setdefault(role, []).append(dict(metadata, type=role, score=span["score"]))
+
+    @staticmethod
+    def _entity_name(type_name: str) -> str:
+        # Same naming as LuisUtil: builtin.geographyV2.city -> geographyV2_city, builtin.datetimeV2.* -> datetime
+        if type_name.startswith("builtin.datetimeV2."):
+            return "datetime"
+        return type_name[len("builtin."):].replace(".", "_")
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""
+Local stand-in for the LUIS V2 prediction endpoint, for offline tests, benchmarks and latency experiments.
+
+Responses are replayed from recordings, or else generated by the local recognizer compiled from
+cognitiveModels/FlightBooking.json (labeled utterances get their labeled intent). Latency, timeouts
+and 429/5xx errors can be injected. Point the bot at it with LuisAPIHostName=http://localhost:5000
+(any GUIDs for LuisAppId and LuisAPIKey).
+
+    python luis_stub_server.py --port 5000 --latency lognormal:80,0.5 --errors 429:0.01,503:0.005
+    python luis_stub_server.py --record recorded.jsonl --upstream https://westus.api.cognitive.microsoft.com
+    python luis_stub_server.py --replay recorded.jsonl
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+from collections import Counter
+from typing import Callable, Dict, List
+
+from aiohttp import ClientSession, web
+from botbuilder.core import IntentScore, RecognizerResult
+
+from local_flight_booking_recognizer import (
+    DEFAULT_MODEL_PATH,
+    INTENT_MAPPING,
+    LocalFlightBookingRecognizer,
+)
+
+PREDICTION_ROUTE = "/luis/v2.0/apps/{app_id}"
+METADATA_KEY = "$instance"
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    Parses a latency distribution, in milliseconds, into a sampler returning seconds:
+    "0", "fixed:50", "uniform:20,80", "normal:50,10", "lognormal:50,0.5" (median, sigma), "exponential:50" (mean).
+    """
+    name, _, args = spec.partition(":")
+    if not args:
+        name, args = "fixed", name
+    values = [float(value) for value in args.split(",")]
+    if name == "fixed":
+        return lambda rng: values[0] / 1000
+    if name == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1]) / 1000
+    if name == "normal":
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1])) / 1000
+    if name == "lognormal":
+        return lambda rng: values[0] * rng.lognormvariate(0.0, values[1]) / 1000
+    if name == "exponential":
+        return lambda rng: rng.expovariate(1.0 / values[0]) / 1000 if values[0] > 0 else 0.0
+    raise ValueError(f'"{spec}" is not a valid latency distribution.')
+
+
+def parse_errors(spec: str) -> List[tuple]:
+    """Parses "429:0.01,503:0.005" into [(429, 0.01), (503, 0.005)]: status codes and their probabilities."""
+    errors = []
+    for item in filter(None, spec.split(",")):
+        status, _, rate = item.partition(":")
+        errors.append((int(status), float(rate)))
+    return errors
+
+
+def normalize_query(query: str) -> str:
+    return " ".join((query or "").lower().split())
+
+
+def to_v2_response(query: str, recognizer_result: RecognizerResult) -> dict:
+    """Converts a recognizer result, with its $instance metadata, to the JSON returned by the LUIS V2 API."""
+    intents = sorted(
+        ({"intent": name, "score": score.score} for name, score in recognizer_result.intents.items()),
+        key=lambda intent: -intent["score"],
+    )
+    entities = []
+    instances = recognizer_result.entities.get(METADATA_KEY, {})
+    for name, metadata_list in instances.items():
+        for metadata, value in zip(metadata_list, recognizer_result.entities.get(name, [])):
+            entity = {
+                "entity": metadata["text"].lower(),
+                "type": metadata["type"],
+                "startIndex": metadata["startIndex"],
+                "endIndex": metadata["endIndex"] - 1,  # inclusive in V2
+            }
+            if "score" in metadata:
+                entity["score"] = metadata["score"]
+            resolution = _resolution(metadata["type"], value)
+            if resolution is not None:
+                entity["resolution"] = resolution
+            entities.append(entity)
+    return {
+        "query": query,
+        "topScoringIntent": intents[0] if intents else None,
+        "intents": intents,
+        "entities": entities,
+    }
+
+
+def _resolution(type_name: str, value: object):
+    if type_name.startswith("builtin.datetimeV2."):
+        return {"values": [{"timex": timex, "type": value["type"]} for timex in value["timex"]]}
+    if type_name == "builtin.number":
+        subtype = "integer" if isinstance(value, int) else "decimal"
+        return {"subtype": subtype, "value": str(value)}
+    return None
+
+
+def load_recordings(paths: List[str]) -> Dict[str, dict]:
+    """Loads JSONL recordings of {"query": ..., "response": ...} lines, keyed by normalized query."""
+    recordings = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as recording_file:
+            for line in recording_file:
+                if line.strip():
+                    recording = json.loads(line)
+                    recordings[normalize_query(recording["query"])] = recording["response"]
+    return recordings
+
+
+def load_labels(model_path: str) -> Dict[str, str]:
+    """Labeled utterances of the exported LUIS model, with their intent as named by the deployed app."""
+    with open(model_path, encoding="utf-8") as model_file:
+        model = json.load(model_file)
+    return {
+        normalize_query(utterance["text"]): INTENT_MAPPING.get(utterance["intent"], utterance["intent"])
+        for utterance in model["utterances"]
+    }
+
+
+class LuisStub:
+    """The prediction endpoint, with its response sources and fault injection."""
+
+    def __init__(
+        self,
+        recognizer: LocalFlightBookingRecognizer,
+        labels: Dict[str, str] = None,
+        recordings: Dict[str, dict] = None,
+        latency: Callable[[random.Random], float] = None,
+        errors: List[tuple] = (),
+        timeout_rate: float = 0.0,
+        timeout: float = 30.0,
+        subscription_key: str = None,
+        upstream: str = None,
+        record_path: str = None,
+        seed: int = None,
+    ):
+        self.recognizer = recognizer
+        self.labels = labels or {}
+        self.recordings = recordings or {}
+        self.latency = latency or parse_latency("0")
+        self.errors = list(errors)
+        self.timeout_rate = timeout_rate
+        self.timeout = timeout
+        self.subscription_key = subscription_key
+        self.upstream = upstream
+        self.record_path = record_path
+        self.rng = random.Random(seed)
+        self.stats = Counter()
+        self._session = None
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(PREDICTION_ROUTE, self.predict)
+        app.router.add_get(PREDICTION_ROUTE, self.predict)
+        app.router.add_get("/stats", self.get_stats)
+        app.on_cleanup.append(self._close)
+        return app
+
+    async def predict(self, request: web.Request) -> web.Response:
+        self.stats["requests"] += 1
+        if self.subscription_key and self.subscription_key not in (
+            request.headers.get("Ocp-Apim-Subscription-Key"),
+            request.query.get("subscription-key"),
+        ):
+            self.stats["unauthorized"] += 1
+            return web.json_response({"statusCode": 401, "message": "Access denied"}, status=401)
+
+        if request.method == "POST":
+            query = await request.json()
+        else:
+            query = request.query.get("q", "")
+
+        if self.upstream:
+            return await self._proxy(request, query)
+
+        await asyncio.sleep(self.latency(self.rng))
+        fault = self._draw_fault()
+        if fault == "timeout":
+            self.stats["timeouts"] += 1
+            await asyncio.sleep(self.timeout)
+            raise web.HTTPGatewayTimeout()
+        if fault is not None:
+            self.stats[f"status_{fault}"] += 1
+            headers = {"Retry-After": "1"} if fault == 429 else None
+            return web.json_response(
+                {"statusCode": fault, "message": "Injected error"}, status=fault, headers=headers
+            )
+
+        recorded = self.recordings.get(normalize_query(query))
+        if recorded is not None:
+            self.stats["replayed"] += 1
+            return web.json_response(dict(recorded, query=query))
+        self.stats["generated"] += 1
+        return web.json_response(self.generate(query))
+
+    def generate(self, query: str) -> dict:
+        recognizer_result = self.recognizer.recognize_text(query)
+        label = self.labels.get(normalize_query(query))
+        if label is not None:
+            # Labeled utterances are recognized as labeled
+            recognizer_result.intents = {
+                name: IntentScore(score=1.0 if name == label else 0.0)
+                for name in recognizer_result.intents
+            }
+        return to_v2_response(query, recognizer_result)
+
+    async def get_stats(self, request: web.Request) -> web.Response:  # pylint: disable=unused-argument
+        return web.json_response(dict(self.stats))
+
+    def _draw_fault(self):
+        draw = self.rng.random()
+        if draw < self.timeout_rate:
+            return "timeout"
+        draw -= self.timeout_rate
+        for status, rate in self.errors:
+            if draw < rate:
+                return status
+            draw -= rate
+        return None
+
+    async def _proxy(self, request: web.Request, query: str) -> web.Response:
+        # Forward to the real endpoint and record its successful responses for later replays
+        if self._session is None:
+            self._session = ClientSession()
+        url = self.upstream.rstrip("/") + request.path
+        headers = {
+            name: value for name, value in request.headers.items()
+            if name.lower() in ("ocp-apim-subscription-key", "content-type", "accept", "user-agent")
+        }
+        async with self._session.request(
+            request.method, url, params=request.query, headers=headers,
+            data=await request.read() if request.method == "POST" else None,
+        ) as upstream_response:
+            body = await upstream_response.read()
+            status = upstream_response.status
+        self.stats[f"upstream_{status}"] += 1
+        if status == 200 and self.record_path:
+            with open(self.record_path, "a", encoding="utf-8") as record_file:
+                record_file.write(json.dumps({"query": query, "response": json.loads(body)}) + "\n")
+            self.stats["recorded"] += 1
+        return web.Response(body=body, status=status, content_type="application/json")
+
+    async def _close(self, app: web.Application):  # pylint: disable=unused-argument
+        if self._session is not None:
+            await self._session.close()
+
+
+def create_stub(args: argparse.Namespace) -> LuisStub:
+    if args.record and not args.upstream:
+        raise ValueError("--record needs the --upstream LUIS endpoint to record from.")
+    return LuisStub(
+        LocalFlightBookingRecognizer(args.model),
+        labels=load_labels(args.model),
+        recordings=load_recordings(args.replay),
+        latency=parse_latency(args.latency),
+        errors=parse_errors(args.errors),
+        timeout_rate=args.timeout_rate,
+        timeout=args.timeout,
+        subscription_key=args.key,
+        upstream=args.upstream,
+        record_path=args.record,
+        seed=args.seed,
+    )
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH, help="exported LUIS model")
+    parser.add_argument("--replay", action="append", default=[], help="JSONL recordings to replay")
+    parser.add_argument("--record", help="JSONL file recording the upstream responses")
+    parser.add_argument("--upstream", help="real LUIS endpoint to proxy to, ie https://westus.api.cognitive.microsoft.com")
+    parser.add_argument("--latency", default="0", help="latency distribution in ms, ie lognormal:80,0.5")
+    parser.add_argument("--errors", default="", help="injected error statuses and rates, ie 429:0.01,503:0.005")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="rate of requests left hanging")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds before a hanging request fails")
+    parser.add_argument("--key", help="subscription key to require (any key is accepted by default)")
+    parser.add_argument("--seed", type=int, help="seed of the latency and fault draws")
+    args = parser.parse_args(argv)
+
+    stub = create_stub(args)
+    print(
+        f"LUIS stub on http://{args.host}:{args.port}: {len(stub.recordings)} recorded responses,"
+        f" {len(stub.labels)} labeled utterances",
+        file=sys.stderr,
+    )
+    web.run_app(stub.create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""
+Local stand-in for the Bot Framework token issuer, for offline tests of the authentication of the bot.
+
+It serves OpenID metadata and the public key of an RSA key pair generated at startup, and signs
+tokens as the Bot Framework channel does (issuer https://api.botframework.com, audience the app id).
+Point the bot at it with BotOpenIdMetadata=http://localhost:5124/v1/.well-known/openidconfiguration
+and MicrosoftAppId set to the audience; it prints a token to send as "Authorization: Bearer <token>".
+
+    python openid_stub_issuer.py --port 5124 --app-id 00000000-0000-0000-0000-000000000000
+"""
+
+import argparse
+import json
+import sys
+import time
+import uuid
+from collections import Counter
+from typing import Iterable, List
+
+import jwt
+from aiohttp import web
+from botframework.connector.auth import AuthenticationConstants
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+
+METADATA_ROUTE = "/v1/.well-known/openidconfiguration"
+KEYS_ROUTE = "/v1/keys"
+
+
+class StubIssuer:
+    """An RSA signing key, its OpenID metadata and keys endpoints, and the tokens it signs."""
+
+    def __init__(
+        self,
+        issuer: str = AuthenticationConstants.TO_BOT_FROM_CHANNEL_TOKEN_ISSUER,
+        endorsements: Iterable[str] = (),
+    ):
+        self.issuer = issuer
+        self.endorsements = list(endorsements)
+        self.keys = []
+        self.stats = Counter()
+        self.rotate()
+
+    def rotate(self) -> str:
+        """Signs with a new key from now on, published along with the former ones. Returns its id."""
+        self._private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.key_id = uuid.uuid4().hex
+        jwk = json.loads(RSAAlgorithm.to_jwk(self._private_key.public_key()))
+        jwk.update(kid=self.key_id, use="sig", endorsements=self.endorsements)
+        self.keys.append(jwk)
+        return self.key_id
+
+    def token(self, audience: str, service_url: str = None, lifetime: float = 3600.0, **claims) -> str:
+        """A token of the channel for the bot audience, valid for lifetime seconds."""
+        now = int(time.time())
+        payload = {"iss": self.issuer, "aud": audience, "nbf": now - 60, "iat": now, "exp": int(now + lifetime)}
+        if service_url:
+            payload["serviceurl"] = service_url
+        payload.update(claims)
+        return jwt.encode(payload, self._private_key, algorithm="RS256", headers={"kid": self.key_id})
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get(METADATA_ROUTE, self.get_metadata)
+        app.router.add_get(KEYS_ROUTE, self.get_keys)
+        return app
+
+    async def get_metadata(self, request: web.Request) -> web.Response:
+        self.stats["metadata"] += 1
+        base_url = str(request.url.origin())
+        return web.json_response(
+            {
+                "issuer": self.issuer,
+                "jwks_uri": base_url + KEYS_ROUTE,
+                "id_token_signing_alg_values_supported": ["RS256"],
+            }
+        )
+
+    async def get_keys(self, request: web.Request) -> web.Response:  # pylint: disable=unused-argument
+        self.stats["keys"] += 1
+        return web.json_response({"keys": self.keys})
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5124)
+    parser.add_argument("--app-id", required=True, help="audience of the tokens, the MicrosoftAppId of the bot")
+    parser.add_argument("--service-url", help="serviceurl claim of the token, the service url of the activities")
+    parser.add_argument("--lifetime", type=float, default=3600.0, help="seconds before the token expires")
+    args = parser.parse_args(argv)
+
+    issuer = StubIssuer()
+    print(f"Issuer metadata on http://{args.host}:{args.port}{METADATA_ROUTE}", file=sys.stderr)
+    print(issuer.token(args.app_id, args.service_url, args.lifetime))
+    web.run_app(issuer.create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
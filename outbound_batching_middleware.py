@@ -0,0 +1,97 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Middleware buffering the activities sent during a turn, and sending them merged when it ends."""
+
+from typing import Awaitable, Callable, List
+
+from botbuilder.core import Middleware, TurnContext
+from botbuilder.schema import Activity, ActivityTypes, DeliveryModes
+
+BUFFER_KEY = "OutboundBatchingMiddleware.buffer"
+# Activity types which can wait for the end of the turn; others, ie invoke responses, are sent at once
+BUFFERED_TYPES = (ActivityTypes.message, ActivityTypes.trace)
+
+
+def _mergeable(activity: Activity) -> bool:
+    return (
+        activity.type == ActivityTypes.message
+        and not activity.suggested_actions
+        and not activity.channel_data
+        and not activity.entities
+        and activity.value is None
+    )
+
+
+def merge_activities(activities: List[Activity]) -> List[Activity]:
+    """
+    Merges each run of plain messages into one message: their texts joined by blank lines, their
+    attachments in order after the texts, and the input hint of the last one, ie the prompt.
+    Messages with suggested actions, channel data or entities, and the other activities, stay as they are.
+    """
+    merged: List[Activity] = []
+    run: List[Activity] = []
+
+    def close_run():
+        if len(run) == 1:
+            merged.append(run[0])
+        elif run:
+            first = run[0]
+            first.text = "\n\n".join(activity.text for activity in run if activity.text) or None
+            first.speak = " ".join(activity.speak for activity in run if activity.speak) or None
+            first.attachments = [attachment for activity in run for attachment in activity.attachments or ()] or None
+            first.input_hint = run[-1].input_hint
+            merged.append(first)
+        run.clear()
+
+    for activity in activities:
+        if _mergeable(activity) and (not run or activity.text_format == run[0].text_format):
+            run.append(activity)
+        else:
+            close_run()
+            (run if _mergeable(activity) else merged).append(activity)
+    close_run()
+    return merged
+
+
+class OutboundBatchingMiddleware(Middleware):
+    """
+    Sends the activities of a turn together once the bot has handled it, merged with merge_activities,
+    so that a turn sending a card and then a prompt makes one call to the channel instead of two.
+    The activities buffered are also sent if the turn fails, before the error handler's.
+    Turns with the expectReplies delivery mode are not buffered, since their replies are already
+    returned in the response body. Register it first, so that the other middlewares see what is sent.
+    """
+
+    def __init__(self):
+        self.stats = {"activities": 0, "sends": 0}
+
+    async def on_turn(self, context: TurnContext, logic: Callable[[], Awaitable]):
+        if context.activity.delivery_mode == DeliveryModes.expect_replies:
+            await logic()
+            return
+
+        context.turn_state[BUFFER_KEY] = []
+        context.on_send_activities(self._on_send_activities)
+        try:
+            await logic()
+        finally:
+            # The activities sent from now on, ie by the error handler, are not buffered
+            buffer = context.turn_state.pop(BUFFER_KEY)
+            if buffer:
+                self.stats["activities"] += len(buffer)
+                self.stats["sends"] += 1
+                await context.send_activities(merge_activities(buffer))
+
+    @staticmethod
+    async def _on_send_activities(context: TurnContext, activities: List[Activity], next_send: Callable):
+        buffer = context.turn_state.get(BUFFER_KEY)
+        if buffer is not None:
+            if all(activity.type in BUFFERED_TYPES for activity in activities):
+                buffer.extend(activities)
+                # The turn context sends what is left in the list once the handlers ran
+                activities.clear()
+            elif buffer:
+                # The buffered activities go first, so that the order is kept
+                activities[:0] = merge_activities(buffer)
+                buffer.clear()
+        return await next_send()
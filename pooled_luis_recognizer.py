@@ -0,0 +1,344 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""LUIS recognizer calling the prediction endpoint through a long-lived keep-alive connection pool."""
+
+import asyncio
+import functools
+import os
+from typing import Dict, Union
+
+import aiohttp
+from azure.cognitiveservices.language.luis.runtime import models
+from azure.cognitiveservices.language.luis.runtime.models import LuisResult
+from botbuilder.ai.luis import (
+    LuisApplication,
+    LuisPredictionOptions,
+    LuisRecognizer,
+    LuisRecognizerOptionsV3,
+)
+from botbuilder.ai.luis.luis_recognizer_options_v2 import LuisRecognizerOptionsV2
+from botbuilder.ai.luis.luis_recognizer_v2 import LuisRecognizerV2
+from botbuilder.ai.luis.luis_util import LuisUtil
+from botbuilder.core import RecognizerResult, TurnContext
+from msrest import Deserializer
+
+from config import DefaultConfig
+from helpers.timing import TIMINGS
+
+LUIS_V2_PATH = "/luis/v2.0/apps/"
+
+_DESERIALIZE = Deserializer(
+    {name: model for name, model in models.__dict__.items() if isinstance(model, type)}
+)
+
+
+class LuisConnectionOptions:
+    """Options of the connection pool to the LUIS endpoint. Timeouts are in seconds."""
+
+    def __init__(
+        self,
+        pool_size: int = 100,
+        dns_cache_ttl: float = 300,
+        keepalive_timeout: float = 60,
+        connect_timeout: float = 3,
+        read_timeout: float = 10,
+        warm_up_connections: int = 1,
+    ):
+        self.pool_size = pool_size
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.warm_up_connections = warm_up_connections
+
+    @classmethod
+    def from_config(cls, configuration: DefaultConfig) -> "LuisConnectionOptions":
+        return cls(
+            pool_size=configuration.LUIS_POOL_SIZE,
+            dns_cache_ttl=configuration.LUIS_DNS_CACHE_TTL,
+            keepalive_timeout=configuration.LUIS_KEEPALIVE_TIMEOUT,
+            connect_timeout=configuration.LUIS_CONNECT_TIMEOUT,
+            read_timeout=configuration.LUIS_READ_TIMEOUT,
+            warm_up_connections=configuration.LUIS_WARM_UP_CONNECTIONS,
+        )
+
+
+class PooledLuisRecognizerV2(LuisRecognizerV2):
+    """
+    LUIS V2 recognizer sending its queries on a shared aiohttp session, instead of a new blocking
+    HTTP client per query. Results, trace activities and telemetry are the same as LuisRecognizerV2's.
+    The session is opened on first use in each process, so the recognizer can be built before forking.
+    Concurrent queries of the same utterance share a single request to LUIS.
+    """
+
+    def __init__(
+        self,
+        luis_application: LuisApplication,
+        luis_recognizer_options_v2: LuisRecognizerOptionsV2 = None,
+        connection_options: LuisConnectionOptions = None,
+    ):
+        super().__init__(
+            luis_application, luis_recognizer_options_v2 or LuisRecognizerOptionsV2()
+        )
+        self.connection_options = connection_options or LuisConnectionOptions()
+        self._url = luis_application.endpoint.rstrip("/") + LUIS_V2_PATH + luis_application.application_id
+        self._headers = {
+            "Ocp-Apim-Subscription-Key": luis_application.endpoint_key,
+            "Content-Type": "application/json; charset=utf-8",
+            "Accept": "application/json",
+            "User-Agent": LuisUtil.get_user_agent(),
+        }
+        self._params = self._query_parameters(self.luis_recognizer_options_v2)
+
+        self._pid = None
+        self._session = None
+        # Requests in flight, by query key, for the queries of the same utterance to join
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._stats = dict.fromkeys(
+            (
+                "requests",
+                "coalesced",
+                "errors",
+                "in_flight",
+                "connections_created",
+                "connections_reused",
+                "connections_queued",
+                "dns_cache_hits",
+                "dns_cache_misses",
+            ),
+            0,
+        )
+
+    @property
+    def pool_stats(self) -> Dict[str, int]:
+        """Request and connection counters of the pool, and its currently open connections."""
+        stats = dict(self._stats)
+        stats["pool_size"] = self.connection_options.pool_size
+        stats["open_connections"] = 0
+        if self._session is not None and not self._session.closed:
+            connector = self._session.connector
+            # pylint: disable=protected-access
+            stats["open_connections"] = len(connector._acquired) + sum(
+                len(connections) for connections in connector._conns.values()
+            )
+        return stats
+
+    async def recognizer_internal(self, turn_context: TurnContext):
+        utterance: str = turn_context.activity.text if turn_context.activity is not None else None
+        luis_result = await self.resolve(utterance)
+
+        recognizer_result: RecognizerResult = RecognizerResult(
+            text=utterance,
+            altered_text=luis_result.altered_query,
+            intents=LuisUtil.get_intents(luis_result),
+            entities=LuisUtil.extract_entities_and_metadata(
+                luis_result.entities,
+                luis_result.composite_entities,
+                self.luis_recognizer_options_v2.include_instance_data
+                if self.luis_recognizer_options_v2.include_instance_data is not None
+                else True,
+            ),
+        )
+
+        LuisUtil.add_properties(luis_result, recognizer_result)
+        if self.luis_recognizer_options_v2.include_api_results:
+            recognizer_result.properties["luisResult"] = luis_result
+
+        await self._emit_trace_info(
+            turn_context,
+            luis_result,
+            recognizer_result,
+            self.luis_recognizer_options_v2,
+        )
+
+        return recognizer_result
+
+    async def resolve(self, utterance: str) -> LuisResult:
+        """
+        Returns the prediction of the utterance, raises aiohttp.ClientError on failure. If the same utterance
+        is already being resolved, waits for that request instead of sending another one: all the callers
+        get its result or its error. A cancelled caller does not cancel the request of the others.
+        """
+        key = self._query_key(utterance)
+        request = self._in_flight.get(key)
+        if request is None:
+            request = asyncio.ensure_future(self._resolve(utterance))
+            self._in_flight[key] = request
+            request.add_done_callback(functools.partial(self._request_done, key))
+        else:
+            self._stats["coalesced"] += 1
+        return await asyncio.shield(request)
+
+    async def _resolve(self, utterance: str) -> LuisResult:
+        session = self._get_session()
+        self._stats["requests"] += 1
+        self._stats["in_flight"] += 1
+        try:
+            with TIMINGS.span("luis.request"):
+                async with session.post(
+                    self._url, params=self._params, json=utterance, headers=self._headers
+                ) as response:
+                    response.raise_for_status()
+                    data = await response.json(content_type=None)
+        except Exception:
+            self._stats["errors"] += 1
+            raise
+        finally:
+            self._stats["in_flight"] -= 1
+        return _DESERIALIZE("LuisResult", data)
+
+    def _request_done(self, key: str, request: asyncio.Future):
+        if self._in_flight.get(key) is request:
+            del self._in_flight[key]
+        # Retrieve the error, in case every caller was cancelled
+        if not request.cancelled():
+            request.exception()
+
+    @staticmethod
+    def _query_key(utterance: str) -> str:
+        # LUIS ignores the case, but the entity offsets depend on the spacing: only the case is normalized
+        return (utterance or "").lower()
+
+    async def warm_up(self) -> int:
+        """
+        Opens warm_up_connections connections to the endpoint, so that the first turns do not pay for
+        the DNS lookup and the TLS handshake. The requests are not predictions: they are not billed
+        and their status does not matter. Returns the number of connections that could be opened.
+        """
+        session = self._get_session()
+        endpoint = self._url[: self._url.index(LUIS_V2_PATH)]
+
+        async def connect() -> bool:
+            try:
+                # Reading the response, even an error, lets the connection go back to the pool
+                async with session.get(endpoint, headers={"User-Agent": self._headers["User-Agent"]}) as response:
+                    await response.read()
+                    return True
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return False
+
+        opened = await asyncio.gather(
+            *(connect() for _ in range(max(1, self.connection_options.warm_up_connections)))
+        )
+        return sum(opened)
+
+    async def close(self):
+        if self._session is not None and self._pid == os.getpid():
+            await self._session.close()
+        self._session = None
+        self._pid = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # A forked worker must not share the connections of its parent
+        if self._session is None or self._pid != os.getpid() or self._session.closed:
+            self._pid = os.getpid()
+            self._session = self._create_session()
+        return self._session
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        options = self.connection_options
+        connector = aiohttp.TCPConnector(
+            limit=options.pool_size,
+            ttl_dns_cache=options.dns_cache_ttl,
+            keepalive_timeout=options.keepalive_timeout,
+        )
+        timeout = aiohttp.ClientTimeout(
+            connect=options.connect_timeout, sock_read=options.read_timeout
+        )
+        return aiohttp.ClientSession(
+            connector=connector, timeout=timeout, trace_configs=[self._trace_config()]
+        )
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+        signals = (
+            (trace_config.on_connection_create_end, "connections_created"),
+            (trace_config.on_connection_reuseconn, "connections_reused"),
+            (trace_config.on_connection_queued_start, "connections_queued"),
+            (trace_config.on_dns_cache_hit, "dns_cache_hits"),
+            (trace_config.on_dns_cache_miss, "dns_cache_misses"),
+        )
+        for signal, counter in signals:
+            signal.append(self._counter(counter))
+        return trace_config
+
+    def _counter(self, name: str):
+        async def count(session, context, params):  # pylint: disable=unused-argument
+            self._stats[name] += 1
+
+        return count
+
+    @staticmethod
+    def _query_parameters(options: LuisRecognizerOptionsV2) -> Dict[str, str]:
+        # Same parameters as LUISRuntimeClient.prediction.resolve
+        values = {
+            "timezoneOffset": options.timezone_offset,
+            "verbose": options.include_all_intents,
+            "staging": options.staging,
+            "spellCheck": options.spell_check,
+            "bing-spell-check-subscription-key": options.bing_spell_check_subscription_key,
+            "log": options.log if options.log is not None else True,
+        }
+        return {
+            name: (str(value).lower() if isinstance(value, bool) else str(value))
+            for name, value in values.items()
+            if value is not None
+        }
+
+
+class PooledLuisRecognizer(LuisRecognizer):
+    """LuisRecognizer whose V2 queries all go through the same PooledLuisRecognizerV2."""
+
+    def __init__(
+        self,
+        application: LuisApplication,
+        prediction_options: LuisPredictionOptions = None,
+        include_api_results: bool = False,
+        connection_options: LuisConnectionOptions = None,
+    ):
+        super().__init__(application, prediction_options, include_api_results)
+        self._pooled_recognizer = PooledLuisRecognizerV2(
+            self._application,
+            self._v2_options(self._options),
+            connection_options,
+        )
+
+    @property
+    def pool_stats(self) -> Dict[str, int]:
+        return self._pooled_recognizer.pool_stats
+
+    async def warm_up(self) -> int:
+        return await self._pooled_recognizer.warm_up()
+
+    async def close(self):
+        await self._pooled_recognizer.close()
+
+    def _build_recognizer(
+        self,
+        luis_prediction_options: Union[
+            LuisRecognizerOptionsV3, LuisRecognizerOptionsV2, LuisPredictionOptions
+        ],
+    ):
+        # Per-call options other than the defaults still get their own recognizer
+        if luis_prediction_options is self._options:
+            return self._pooled_recognizer
+        return super()._build_recognizer(luis_prediction_options)
+
+    def _v2_options(
+        self, options: Union[LuisRecognizerOptionsV2, LuisPredictionOptions]
+    ) -> LuisRecognizerOptionsV2:
+        if isinstance(options, LuisRecognizerOptionsV2):
+            return options
+        return LuisRecognizerOptionsV2(
+            options.bing_spell_check_subscription_key,
+            options.include_all_intents,
+            options.include_instance_data,
+            options.log,
+            options.spell_check,
+            options.staging,
+            options.timeout,
+            options.timezone_offset,
+            self._include_api_results,
+            options.telemetry_client,
+            options.log_personal_information,
+        )
@@ -0,0 +1,229 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Durable local storage backed by an embedded SQLite database."""
+
+import asyncio
+import os
+import pickle
+import sqlite3
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from botbuilder.core import Storage, StoreItem
+
+CREATE_TABLE = (
+    "CREATE TABLE IF NOT EXISTS state ("
+    " key TEXT PRIMARY KEY,"
+    " etag TEXT,"
+    " value BLOB NOT NULL)"
+)
+SELECT_ITEM = "SELECT value FROM state WHERE key = ?"
+SELECT_ETAG = "SELECT etag FROM state WHERE key = ?"
+UPSERT_ITEM = "INSERT OR REPLACE INTO state (key, etag, value) VALUES (?, ?, ?)"
+DELETE_ITEM = "DELETE FROM state WHERE key = ?"
+
+
+def _get_e_tag(item: object):
+    if isinstance(item, dict):
+        return item.get("e_tag", None)
+    return getattr(item, "e_tag", None)
+
+
+def _set_e_tag(item: object, e_tag: str):
+    if isinstance(item, dict):
+        item["e_tag"] = e_tag
+    else:
+        item.e_tag = e_tag
+
+
+class SqliteStorage(Storage):
+    """
+    Storage persisted in a local SQLite database in WAL mode, so that state survives restarts and
+    can be shared by several worker processes on the same host.
+    Writes issued while a transaction is being committed are queued and group-committed together
+    in the next transaction. E-tags follow the MemoryStorage rules.
+    The database is only meant to be written by this bot: values are pickled by default.
+    """
+
+    def __init__(
+        self,
+        path: str = "state.db",
+        timeout: float = 5.0,
+        dumps: Callable[[object], bytes] = pickle.dumps,
+        loads: Callable[[bytes], object] = pickle.loads,
+    ):
+        super(SqliteStorage, self).__init__()
+        self.path = path
+        self.timeout = timeout
+        self._dumps = dumps
+        self._loads = loads
+
+        # The connection and its thread are created on first use in each process,
+        # so that the storage can be built before the workers are forked.
+        self._pid = None
+        self._connection = None
+        self._executor = None
+        self._pending = []
+        self._flushing = None
+
+        self.transactions = 0
+        self.batched_writes = 0
+
+    @property
+    def size_bytes(self) -> int:
+        """Size on disk of the database and of its write-ahead log."""
+        size = 0
+        for path in (self.path, self.path + "-wal"):
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return size
+
+    async def read(self, keys: List[str]) -> Dict[str, object]:
+        if not keys:
+            return {}
+        rows = await self._run(self._read_rows, list(keys))
+        return {key: self._loads(value) for key, value in rows.items()}
+
+    async def write(self, changes: Dict[str, StoreItem]):
+        if changes is None:
+            raise Exception("Changes are required when writing")
+        if not changes:
+            return
+        await self._enqueue(
+            [("write", key, change, self._dumps(change)) for key, change in changes.items()]
+        )
+
+    async def delete(self, keys: List[str]):
+        if keys:
+            await self._enqueue([("delete", key, None, None) for key in keys])
+
+    async def close(self):
+        """Commits the pending writes and closes the database."""
+        if self._flushing is not None:
+            await self._flushing
+        if self._executor is not None and self._pid == os.getpid():
+            # No connection if the database never could be opened, ie its directory is missing
+            try:
+                if self._connection is not None:
+                    await self._run(self._connection.close)
+            finally:
+                self._executor.shutdown(wait=True)
+        self._connection = None
+        self._executor = None
+        self._pid = None
+
+    async def _enqueue(self, operations: list):
+        future = asyncio.get_event_loop().create_future()
+        self._ensure_open()
+        self._pending.append((operations, future))
+        if self._flushing is None:
+            self._flushing = asyncio.ensure_future(self._flush())
+        await future
+
+    async def _flush(self):
+        # Keep committing while writes accumulate during the previous commit
+        try:
+            while self._pending:
+                batch, self._pending = self._pending, []
+                try:
+                    errors = await self._run(self._commit, [operations for operations, _ in batch])
+                except Exception as error:  # pylint: disable=broad-except
+                    errors = [error] * len(batch)
+                self.transactions += 1
+                self.batched_writes += len(batch)
+                for (operations, future), error in zip(batch, errors):
+                    if future.done():
+                        continue
+                    if error is not None:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(None)
+        finally:
+            self._flushing = None
+
+    def _ensure_open(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-storage")
+        self._connection = None
+        self._pending = []
+        self._flushing = None
+
+    async def _run(self, function, *args):
+        self._ensure_open()
+        return await asyncio.get_event_loop().run_in_executor(self._executor, function, *args)
+
+    # The methods below run on the storage thread.
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(CREATE_TABLE)
+            self._connection = connection
+        return self._connection
+
+    def _read_rows(self, keys: List[str]) -> Dict[str, bytes]:
+        cursor = self._connect().cursor()
+        rows = {}
+        for key in keys:
+            row = cursor.execute(SELECT_ITEM, (key,)).fetchone()
+            if row is not None:
+                rows[key] = row[0]
+        return rows
+
+    def _commit(self, batches: List[list]) -> list:
+        """Applies every batch in one transaction, returns the error of each batch (or None)."""
+        connection = self._connect()
+        cursor = connection.cursor()
+        errors = []
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            for operations in batches:
+                savepoint_error = None
+                cursor.execute("SAVEPOINT batch")
+                try:
+                    for kind, key, change, value in operations:
+                        if kind == "delete":
+                            cursor.execute(DELETE_ITEM, (key,))
+                            continue
+                        self._write_item(cursor, key, change, value)
+                    cursor.execute("RELEASE batch")
+                except Exception as error:  # pylint: disable=broad-except
+                    cursor.execute("ROLLBACK TO batch")
+                    cursor.execute("RELEASE batch")
+                    savepoint_error = error
+                errors.append(savepoint_error)
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        return errors
+
+    def _write_item(self, cursor, key: str, change: object, value: bytes):
+        row = cursor.execute(SELECT_ETAG, (key,)).fetchone()
+        old_e_tag = row[0] if row is not None else None
+
+        new_e_tag = _get_e_tag(change)
+        if new_e_tag == "":
+            raise Exception("sqlite_storage.write(): etag missing")
+        if old_e_tag is not None and new_e_tag is not None and new_e_tag not in ("*", old_e_tag):
+            raise KeyError(
+                "Etag conflict.\nOriginal: %s\r\nCurrent: %s" % (new_e_tag, old_e_tag)
+            )
+
+        # As in MemoryStorage, the stored item only gets a new e-tag if the previous one had one.
+        # E-tags are unique across processes.
+        if old_e_tag:
+            new_e_tag = uuid.uuid4().hex
+            item = self._loads(value)
+            _set_e_tag(item, new_e_tag)
+            value = self._dumps(item)
+        cursor.execute(UPSERT_ITEM, (key, new_e_tag, value))
@@ -98,7 +98,7 @@ async def test_luis_results():
             json_activity = json.dumps(
                     {
                         "intent": intent,
-                        "booking_details": None if not hasattr(result, "__dict__") else result.__dict__,
+                        "booking_details": result.to_dict() if isinstance(result, BookingDetails) else None,
                     }
                 )
             # print("activity",json_activity)
@@ -117,7 +117,7 @@ async def test_luis_results():
                         start_date = "2022-10-12",
                         end_date = "2022-10-19",
                         budget = 500
-                    ).__dict__
+                    ).to_dict()
         # print("expected activity",expected_booking_details)
 
         await adapter.test(
@@ -151,3 +151,1212 @@ def test_booking_dialog_is_ambiguous():
         # print(tx.types,file=sys.stderr)
         is_ambiguous = bd.is_ambiguous(timex = d)
         assert d!="" and is_ambiguous        
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+from uuid import uuid4
+from botbuilder.core import RecognizerResult, IntentScore
+from botbuilder.schema import Activity, ActivityTypes, ChannelAccount, ConversationAccount
+from helpers.ttl_cache import TTLCache
+
+
+def make_turn_context(text):
+    activity = Activity(
+        type=ActivityTypes.message,
+        text=text,
+        channel_id="test",
+        from_property=ChannelAccount(id="user"),
+        recipient=ChannelAccount(id="bot"),
+        conversation=ConversationAccount(id="conversation"),
+    )
+    return TurnContext(TestAdapter(), activity)
+
+
+def test_ttl_cache_evicts_and_expires():
+    """Check LRU eviction and TTL expiry of the results cache
+    """
+    now = [0.0]
+    cache = TTLCache(max_size=2, ttl=10, timer=lambda: now[0])
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)  # "b" is the least recently used entry
+    assert "b" not in cache and "a" in cache and "c" in cache
+    now[0] = 11.0
+    assert cache.get("a") is None
+    assert cache.stats["evictions"] == 1 and cache.stats["expirations"] == 1
+    assert cache.stats["hits"] == 1 and cache.stats["misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_recognizer_cache_skips_luis_on_hit():
+    """Check that repeated utterances are served from the cache, before the local recognizer, and that the cache can be bypassed
+    """
+    config = DefaultConfig()
+    config.LUIS_APP_ID = str(uuid4())
+    config.LUIS_API_KEY = str(uuid4())
+    config.LUIS_API_HOST_NAME = "localhost"
+
+    calls, local_calls = [], []
+
+    class UnsureRecognizer:
+        async def recognize(self, turn_context):
+            local_calls.append(turn_context.activity.text)
+            return RecognizerResult(text=turn_context.activity.text, intents={}, entities={})
+
+    recognizer = FlightBookingRecognizer(config, local_recognizer=UnsureRecognizer())
+
+    class CountingRecognizer:
+        async def recognize(self, turn_context):
+            calls.append(turn_context.activity.text)
+            return RecognizerResult(
+                text=turn_context.activity.text,
+                intents={Intent.BOOK_FLIGHT.value: IntentScore(0.9)},
+                entities={},
+            )
+
+    recognizer._recognizer = CountingRecognizer()
+
+    await recognizer.recognize(make_turn_context("Book a flight"))
+    result = await recognizer.recognize(make_turn_context("book a  FLIGHT "))
+    assert len(calls) == 1
+    assert len(local_calls) == 1
+    assert result.text == "book a  FLIGHT "
+    assert result.get_top_scoring_intent().intent == Intent.BOOK_FLIGHT.value
+
+    await recognizer.recognize(make_turn_context("book a flight"), use_cache=False)
+    assert len(calls) == 2
+    assert recognizer.cache_stats["hits"] == 1
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+from local_flight_booking_recognizer import LocalFlightBookingRecognizer
+
+LOCAL_RECOGNIZER = LocalFlightBookingRecognizer()
+
+
+def make_local_recognizer():
+    config = DefaultConfig()
+    config.LUIS_APP_ID = ""
+    return FlightBookingRecognizer(config, local_recognizer=LOCAL_RECOGNIZER)
+
+
+@pytest.mark.asyncio
+async def test_local_recognizer_booking_details():
+    """Check that the local recognizer fills the booking details like LUIS does
+    """
+    recognizer = make_local_recognizer()
+    assert recognizer.is_configured
+
+    query = "I want to Book a flight from Marseille to Paris starting 12 october 2022 and returning 19 october 2022 with a budget of 500"
+    intent, result = await LuisHelper.execute_luis_query(recognizer, make_turn_context(query))
+    assert intent == Intent.BOOK_FLIGHT.value
+    assert (result.origin, result.destination) == ("Marseille", "Paris")
+    assert (result.start_date, result.end_date) == ("2022-10-12", "2022-10-19")
+    assert result.budget == 500
+    assert result.initial_prompt == query
+
+
+def test_local_recognizer_intents():
+    """Check the intents and confidence of the local recognizer
+    """
+    clear_cut = LOCAL_RECOGNIZER.recognize_text("book a flight from paris to london")
+    assert clear_cut.get_top_scoring_intent() == (Intent.BOOK_FLIGHT.value, 1.0)
+    assert clear_cut.entities["$instance"]["or_city"][0]["text"] == "paris"
+
+    assert LOCAL_RECOGNIZER.recognize_text("cancel").get_top_scoring_intent().intent == Intent.CANCEL.value
+    assert LOCAL_RECOGNIZER.recognize_text("hello there").get_top_scoring_intent().intent == Intent.NONE_INTENT.value
+
+    unclear = LOCAL_RECOGNIZER.recognize_text("I would like to go somewhere sunny")
+    assert unclear.get_top_scoring_intent().score < 0.95
+
+    budget_only = LOCAL_RECOGNIZER.recognize_text("book a flight to Madrid with a budget of 1150")
+    assert budget_only.entities["dst_city"] == ["madrid"]
+    assert budget_only.entities["budget"] == ["1150"]
+    assert "str_date" not in budget_only.entities
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+from helpers.card_helper import CardTemplate
+from dialogs.main_dialog import FLIGHT_CARD_PATH
+
+
+def test_card_template_render():
+    """Check that card slots are filled without altering the template
+    """
+    template = CardTemplate.from_file(FLIGHT_CARD_PATH)
+    assert template.slot_names == ["budget", "destination", "end_date", "origin", "start_date"]
+
+    data = {"origin": "Paris", "destination": "London", "start_date": "2022-10-12", "end_date": "2022-10-19", "budget": 500}
+    card = template.render(data)
+    rendered = json.dumps(card)
+    for value in data.values():
+        assert str(value) in rendered
+    assert "${" not in rendered
+
+    # the template itself is left untouched, and renders stay independent
+    assert "${origin}" in json.dumps(template.render())
+    assert template.render(dict(data, origin="Berlin"))["body"][2]["text"] == "2022-10-12"
+    assert card["body"][3]["columns"][0]["items"][0]["text"] == "Paris"
+
+    partial = CardTemplate({"text": "From ${origin} to ${destination}"}).render({"origin": "Paris"})
+    assert partial == {"text": "From Paris to ${destination}"}
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+from bounded_memory_storage import BoundedMemoryStorage
+
+
+@pytest.mark.asyncio
+async def test_bounded_memory_storage_evicts_and_expires():
+    """Check LRU eviction, idle expiry and memory accounting of the bounded state store
+    """
+    now = [0.0]
+    storage = BoundedMemoryStorage(max_entries=2, idle_ttl=60, sizeof=lambda value: 10, timer=lambda: now[0])
+
+    await storage.write({"a": {"turns": 1}, "b": {"turns": 1}})
+    await storage.read(["a"])
+    await storage.write({"c": {"turns": 1}})  # "b" is the least recently used conversation
+    assert sorted(storage.memory) == ["a", "c"]
+    assert storage.entry_count == 2 and storage.size_bytes == 20 and storage.evictions == 1
+
+    now[0] = 30.0
+    await storage.read(["c"])
+    now[0] = 70.0
+    assert await storage.read(["a"]) == {}
+    assert storage.sweep() == 0  # "c" was read 40 seconds ago
+    now[0] = 100.0
+    assert storage.sweep() == 1
+    assert storage.entry_count == 0 and storage.size_bytes == 0 and storage.expirations == 2
+
+    await storage.write({"d": {"turns": 1}})
+    await storage.delete(["d"])
+    assert storage.entry_count == 0 and storage.size_bytes == 0
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+import sqlite3
+
+from sqlite_storage import SqliteStorage
+
+
+@pytest.mark.asyncio
+async def test_sqlite_storage_is_durable_and_batches_writes(tmp_path):
+    """Check that the SQLite store survives a restart, groups concurrent writes and checks e-tags
+    """
+    path = str(tmp_path / "state.db")
+    storage = SqliteStorage(path)
+    await asyncio.gather(*(storage.write({f"conversation/{i}": {"turn": i}}) for i in range(20)))
+    assert storage.transactions < 20
+    await storage.write({"etag": {"value": 1, "e_tag": "*"}})
+    await storage.close()
+
+    restarted = SqliteStorage(path)
+    items = await restarted.read(["conversation/3", "conversation/19", "missing"])
+    assert items == {"conversation/3": {"turn": 3}, "conversation/19": {"turn": 19}}
+
+    stored = (await restarted.read(["etag"]))["etag"]
+    await restarted.write({"etag": dict(stored, value=2)})
+    with pytest.raises(KeyError):
+        await restarted.write({"etag": dict(stored, value=3, e_tag="stale")})
+    assert (await restarted.read(["etag"]))["etag"]["value"] == 2
+
+    await restarted.delete(["conversation/3"])
+    assert await restarted.read(["conversation/3"]) == {}
+    await restarted.close()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_storage_closes_when_the_database_never_opened(tmp_path):
+    """Check that closing a store whose database could not be opened releases its thread without raising
+    """
+    storage = SqliteStorage(str(tmp_path / "missing" / "state.db"))
+    with pytest.raises(sqlite3.OperationalError):
+        await storage.read(["conversation/1"])
+    executor = storage._executor
+    await storage.close()
+    assert executor._shutdown and storage._executor is None
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+
+@pytest.mark.asyncio
+async def test_luis_queries_reuse_pooled_connections():
+    """Check that LUIS queries are sent on one kept-alive connection and converted like the SDK does
+    """
+    queries = []
+
+    async def predict(request):
+        queries.append((request.match_info["app_id"], await request.json(), dict(request.query)))
+        return web.json_response({
+            "query": "fly from paris",
+            "topScoringIntent": {"intent": "Book", "score": 0.9},
+            "intents": [{"intent": "Book", "score": 0.9}, {"intent": "None", "score": 0.1}],
+            "entities": [
+                {"entity": "paris", "type": "builtin.geographyV2.city", "startIndex": 9, "endIndex": 13},
+                {"entity": "paris", "type": "or_city", "startIndex": 9, "endIndex": 13, "score": 0.8},
+            ],
+        })
+
+    async def warm_up(request):
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post("/luis/v2.0/apps/{app_id}", predict)
+    app.router.add_get("/", warm_up)
+    server = TestServer(app)
+    await server.start_server()
+
+    config = DefaultConfig()
+    config.LUIS_APP_ID = str(uuid4())
+    config.LUIS_API_KEY = str(uuid4())
+    config.LUIS_API_HOST_NAME = f"http://{server.host}:{server.port}"
+    config.LUIS_CACHE_SIZE = 0
+    recognizer = FlightBookingRecognizer(config)
+    try:
+        assert await recognizer.warm_up() == 1
+        for _ in range(3):
+            result = await recognizer.recognize(make_turn_context("fly from paris"))
+        stats = recognizer.pool_stats
+    finally:
+        await recognizer.close()
+        await server.close()
+
+    assert result.get_top_scoring_intent().intent == Intent.BOOK_FLIGHT.value
+    assert result.entities["or_city"] == ["paris"]
+    assert result.entities["$instance"]["or_city"][0]["endIndex"] == 14
+    assert queries[0] == (config.LUIS_APP_ID, "fly from paris", {"log": "true"})
+    assert stats["requests"] == 3 and stats["errors"] == 0
+    assert stats["connections_created"] == 1 and stats["connections_reused"] == 3
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+from aiohttp import ClientResponseError
+from luis_stub_server import LuisStub, load_labels
+from local_flight_booking_recognizer import DEFAULT_MODEL_PATH
+
+
+@pytest.mark.asyncio
+async def test_luis_stub_server_answers_like_luis():
+    """Check that the LUIS stub's predictions give the booking details, and that it injects errors
+    """
+    stub = LuisStub(LOCAL_RECOGNIZER, labels=load_labels(DEFAULT_MODEL_PATH))
+    server = TestServer(stub.create_app())
+    await server.start_server()
+
+    config = DefaultConfig()
+    config.LUIS_APP_ID = str(uuid4())
+    config.LUIS_API_KEY = str(uuid4())
+    config.LUIS_API_HOST_NAME = f"http://{server.host}:{server.port}"
+    config.LUIS_CACHE_SIZE = 0
+    recognizer = FlightBookingRecognizer(config)
+    try:
+        query = "I want to Book a flight from Marseille to Paris starting 12 october 2022 and returning 19 october 2022 with a budget of 500"
+        intent, result = await LuisHelper.execute_luis_query(recognizer, make_turn_context(query))
+        assert intent == Intent.BOOK_FLIGHT.value
+        assert (result.origin, result.destination) == ("Marseille", "Paris")
+        assert (result.start_date, result.end_date, result.budget) == ("2022-10-12", "2022-10-19", 500)
+
+        labeled = await recognizer.recognize(make_turn_context("bye"))
+        assert labeled.get_top_scoring_intent() == (Intent.CANCEL.value, 1.0)
+
+        stub.errors = [(503, 1.0)]
+        with pytest.raises(ClientResponseError):
+            await recognizer.recognize(make_turn_context("book a flight"))
+        assert stub.stats["status_503"] == 1 and stub.stats["generated"] == 2
+    finally:
+        await recognizer.close()
+        await server.close()
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+from helpers.timing import TIMINGS, TimingRegistry
+
+
+@pytest.mark.asyncio
+async def test_timing_spans_fill_histograms_and_sampled_traces():
+    """Check that the spans of a turn are counted in histograms and recorded in the sampled trace
+    """
+    timings = TimingRegistry(sample_rate=1.0)
+    records = []
+    timings.trace_sink = records.append
+
+    async def step(value):
+        return value * 2
+
+    (timed_step,) = timings.timed_steps("Dialog", [step])
+    with timings.turn(channel_id="test") as trace:
+        with timings.span("parse"):
+            pass
+        assert await timed_step(21) == 42
+        trace.properties["conversation_id"] = "c1"
+    with timings.span("parse"):
+        pass  # outside of any turn: in the histogram only
+
+    assert timings.histogram("turn").count == 1
+    assert timings.histogram("parse").count == 2
+    assert timings.histogram("Dialog.step").count == 1
+    assert len(records) == 1
+    assert records[0]["channel_id"] == "test" and records[0]["conversation_id"] == "c1"
+    assert [span["name"] for span in records[0]["spans"]] == ["parse", "Dialog.step"]
+
+    interval = timings.histogram("parse").take_interval()
+    assert interval["count"] == 2 and interval["min"] <= interval["max"]
+    assert timings.histogram("parse").take_interval() is None
+    assert timings.histogram("parse").bucket_counts[0] == 2  # cumulative counts are kept
+
+    luis_count = TIMINGS.histogram("luis").count
+    await LuisHelper.execute_luis_query(LOCAL_RECOGNIZER, make_turn_context("book a flight to Paris"))
+    assert TIMINGS.histogram("luis").count == luis_count + 1
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+import json
+from types import SimpleNamespace
+from botbuilder.core import NullTelemetryClient
+from botbuilder.integration.applicationinsights.aiohttp import AiohttpTelemetryProcessor
+from buffered_telemetry_client import (
+    REQUEST_BODY, BufferedTelemetryClient, ForwardingSink, JsonLinesSink, attach_aiohttp_request_body
+)
+
+
+@pytest.mark.asyncio
+async def test_buffered_telemetry_sends_batches_in_background(tmp_path):
+    """Check that tracked items are written by batches to the sink, and that a full buffer drops or samples
+    """
+    path = tmp_path / "telemetry.jsonl"
+    client = BufferedTelemetryClient(JsonLinesSink(str(path)), capacity=100, batch_size=3, flush_interval=60)
+    client.start_flusher()
+    client.track_trace("SUCCESS", {"origin": "Paris"}, "INFO")
+    client.track_event("WaterfallStep")
+    await asyncio.sleep(0.05)
+    assert client.stats["buffered"] == 2 and client.stats["sent"] == 0  # waits for a whole batch
+    try:
+        raise ValueError("no flight")
+    except ValueError:
+        client.track_exception()
+    for _ in range(50):
+        if client.stats["sent"] == 3:
+            break
+        await asyncio.sleep(0.01)
+    client.track_metric("span.luis", 0.5, count=2)
+    await client.stop_flusher()  # sends the rest
+    assert client.stats["batches"] == 2 and client.stats["sent"] == 4
+
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [record["type"] for record in records] == ["trace", "event", "exception", "metric"]
+    assert records[0]["name"] == "SUCCESS" and records[0]["properties"] == {"origin": "Paris"}
+    assert records[2]["exception_type"] == "ValueError" and "no flight" in records[2]["trace"]
+
+    dropping = BufferedTelemetryClient(JsonLinesSink(str(tmp_path / "dropped.jsonl")), capacity=10)
+    sampling = BufferedTelemetryClient(JsonLinesSink(str(tmp_path / "sampled.jsonl")), capacity=10, overflow="sample", seed=1)
+    for index in range(100):
+        dropping.track_event(str(index))
+        sampling.track_event(str(index))
+    assert dropping.stats["buffered"] == 10 and dropping.stats["dropped"] == 90
+    assert [item.fields["name"] for item in dropping._buffer] == [str(index) for index in range(10)]
+    assert sampling.stats["buffered"] == 10 and sampling.stats["dropped"] == 90
+    assert max(int(item.fields["name"]) for item in sampling._buffer) >= 10
+    with pytest.raises(ValueError):
+        BufferedTelemetryClient(JsonLinesSink("-"), overflow="block")
+
+
+class ProcessedTelemetryClient(NullTelemetryClient):
+    """Runs the Application Insights aiohttp processor on each event, as ApplicationInsightsTelemetryClient does."""
+
+    def __init__(self):
+        super().__init__()
+        self.processor = AiohttpTelemetryProcessor()
+        self.events = []
+
+    def track_event(self, name: str, properties=None, measurements=None) -> None:
+        data = SimpleNamespace(properties=dict(properties or {}))
+        context = SimpleNamespace(user=SimpleNamespace(id=None), session=SimpleNamespace(id=None))
+        self.processor(data, context)
+        self.events.append((name, data.properties, context.user.id))
+
+
+@pytest.mark.asyncio
+async def test_forwarded_telemetry_carries_the_activity_of_its_request():
+    """Check that the items forwarded from the sender thread carry the activity properties of the request which tracked them
+    """
+    forwarded = ProcessedTelemetryClient()
+    client = BufferedTelemetryClient(ForwardingSink(forwarded, attach_aiohttp_request_body), flush_interval=60)
+    client.start_flusher()
+    body = {
+        "id": "activity-1",
+        "type": "message",
+        "channelId": "emulator",
+        "from": {"id": "user-1"},
+        "conversation": {"id": "conversation-1"},
+    }
+
+    async def handle_request():
+        REQUEST_BODY.set(body)
+        client.track_event("BookingDialog", {"origin": "Paris"})
+
+    await asyncio.ensure_future(handle_request())
+    client.track_event("startup")
+    await client.stop_flusher()
+    assert forwarded.events == [
+        (
+            "BookingDialog",
+            {"origin": "Paris", "activityId": "activity-1", "channelId": "emulator", "activityType": "message"},
+            "emulatoruser-1",
+        ),
+        ("startup", {}, None),
+    ]
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+from datetime import date
+from helpers.timex_helper import parse_timex
+
+
+def test_parse_timex_is_memoized_and_classifies_like_timex():
+    """Check that a timex is parsed once, and that its types, date and ambiguity match Timex
+    """
+    parse_timex.cache_clear()
+    for timex in ["2022-10-12", "XXXX-10-12", "2022-10-12T10", "tomorrow", None]:
+        info = parse_timex(timex)
+        assert info.types == frozenset(Timex(timex).types)
+        assert info.is_definite == ("definite" in Timex(timex).types) != info.is_ambiguous
+    assert parse_timex("2022-10-12").date == date(2022, 10, 12)
+    assert parse_timex("XXXX-10-12").date is None
+    assert parse_timex("2022-10-12") is parse_timex("2022-10-12")
+    assert parse_timex.cache_info().misses == 5
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+
+
+def test_get_entity_skips_unscored_and_unlocated_entities():
+    """Check that _get_entity picks the best-scoring entity and the closest typed entity, and leaves a slot empty without a score or $instance metadata
+    """
+    def instance(start, end, score=None):
+        metadata = {"startIndex": start, "endIndex": end, "text": "x", "type": "t"}
+        if score is not None:
+            metadata["score"] = score
+        return metadata
+
+    entities = {
+        "or_city": ["paris", "rome"],
+        "dst_city": ["london"],
+        "geographyV2_city": ["paris", "london", "rome"],
+        "budget": ["500"],
+        "number": [500],
+        "$instance": {
+            "or_city": [instance(10, 15, 0.4), instance(30, 34, 0.9)],
+            "dst_city": [instance(19, 25)],  # not scored
+            "geographyV2_city": [instance(10, 15), instance(19, 25), instance(29, 34)],
+            "budget": [instance(50, 53, 0.8)],
+            "number": [instance(50, 53)],
+        },
+    }
+    result = RecognizerResult(text="", intents={}, entities=entities)
+    assert LuisHelper._get_entity(result, "or_city", "geographyV2_city") == "Rome"
+    assert LuisHelper._get_entity(result, "dst_city", "geographyV2_city") is None
+    assert LuisHelper._get_entity(result, "budget", "number") == 500
+    assert LuisHelper._get_entity(result, "str_date", "datetime") is None
+
+    # Values without $instance metadata, for the type or for the key
+    del entities["$instance"]["number"]
+    assert LuisHelper._get_entity(result, "budget", "number") is None
+    entities["str_date"] = ["12 may"]
+    assert LuisHelper._get_entity(result, "str_date", "datetime") is None
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+from luis_stub_server import parse_latency
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_luis_queries_share_one_request():
+    """Check that concurrent queries of the same utterance send one request, survive a cancelled caller and share errors
+    """
+    stub = LuisStub(LOCAL_RECOGNIZER, latency=parse_latency("fixed:100"))
+    server = TestServer(stub.create_app())
+    await server.start_server()
+
+    config = DefaultConfig()
+    config.LUIS_APP_ID = str(uuid4())
+    config.LUIS_API_KEY = str(uuid4())
+    config.LUIS_API_HOST_NAME = f"http://{server.host}:{server.port}"
+    config.LUIS_CACHE_SIZE = 0
+    recognizer = FlightBookingRecognizer(config)
+    try:
+        texts = ["Book a flight to Paris", "book a flight to paris", "BOOK A FLIGHT TO PARIS", "book a flight to Paris"]
+        turns = [asyncio.ensure_future(recognizer.recognize(make_turn_context(text))) for text in texts]
+        await asyncio.sleep(0.02)
+        turns[0].cancel()  # the turn which sent the request goes away
+        results = await asyncio.gather(*turns[1:])
+        assert stub.stats["requests"] == 1
+        assert recognizer.pool_stats["coalesced"] == 3
+        assert [result.text for result in results] == texts[1:]
+        assert all(result.get_top_scoring_intent().intent == Intent.BOOK_FLIGHT.value for result in results)
+
+        stub.errors = [(503, 1.0)]
+        failures = await asyncio.gather(
+            *(recognizer.recognize(make_turn_context("book a flight")) for _ in range(3)), return_exceptions=True
+        )
+        assert stub.stats["requests"] == 2
+        assert all(isinstance(failure, ClientResponseError) for failure in failures)
+        assert recognizer.pool_stats["in_flight"] == 0
+    finally:
+        await recognizer.close()
+        await server.close()
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+from botbuilder.core import ConversationState, MemoryStorage, UserState
+from helpers.state_helper import StateHelper
+
+
+class CountingStorage(MemoryStorage):
+    def __init__(self):
+        super().__init__()
+        self.reads, self.writes = [], []
+
+    async def read(self, keys):
+        self.reads.append(sorted(keys))
+        return await super().read(keys)
+
+    async def write(self, changes):
+        self.writes.append(sorted(changes))
+        await super().write(changes)
+
+
+@pytest.mark.asyncio
+async def test_state_helper_batches_reads_and_skips_unchanged_writes():
+    """Check that both state scopes are read in one read, and written in one write only when they changed
+    """
+    storage = CountingStorage()
+    conversation_state, user_state = ConversationState(storage), UserState(storage)
+    dialog_state = conversation_state.create_property("DialogState")
+    profile = user_state.create_property("Profile")
+
+    turn_context = make_turn_context("hello")
+    await StateHelper.load_all(turn_context, conversation_state, user_state)
+    assert len(storage.reads) == 1 and len(storage.reads[0]) == 2
+
+    await dialog_state.set(turn_context, {"step": 1})
+    await StateHelper.save_all_changes(turn_context, conversation_state, user_state)
+    conversation_key = conversation_state.get_storage_key(turn_context)
+    assert storage.writes == [[conversation_key]]  # the user state did not change
+    await StateHelper.save_all_changes(turn_context, conversation_state, user_state)
+    assert len(storage.writes) == 1  # nothing changed since
+
+    await dialog_state.set(turn_context, {"step": 2})
+    await profile.set(turn_context, {"name": "Ada"})
+    await StateHelper.save_all_changes(turn_context, conversation_state, user_state)
+    assert len(storage.writes) == 2 and len(storage.writes[1]) == 2
+
+    # (BotState accessors reload empty states, so the first turn of a conversation reads them again)
+    reads = len(storage.reads)
+    next_turn = make_turn_context("again")
+    await StateHelper.load_all(next_turn, conversation_state, user_state)
+    assert await dialog_state.get(next_turn) == {"step": 2}
+    assert await profile.get(next_turn) == {"name": "Ada"}
+    assert len(storage.reads) == reads + 1  # the accessors use the loaded states
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+import pickle
+import jsonpickle
+import dialog_state_codec
+from botbuilder.dialogs import DialogState
+from bots import DialogAndWelcomeBot
+from dialogs import MainDialog
+
+
+def test_booking_details_have_typed_slots():
+    """Check that the booking details only have slots, and hold definite dates as dates and whole budgets as ints
+    """
+    details = BookingDetails("query", "Paris", "Marseille", "2022-10-12", "XXXX-10-19", "500")
+    assert not hasattr(details, "__dict__")
+    assert details.start_date == "2022-10-12" and details.start_day == date(2022, 10, 12)
+    assert details.end_date == "XXXX-10-19" and details.end_day is None
+    assert details.budget == 500 and details.budget_amount == 500.0
+    assert BookingDetails(budget="300 euros").budget_amount == 300.0
+    assert details.to_dict()["start_date"] == "2022-10-12"
+    assert pickle.loads(pickle.dumps(details)) == details
+
+
+def dialog_steps(dialog_state, steps):
+    """Adds the (dialog id, step index) of the waterfalls of a dialog stack and of its inner stacks to steps
+    """
+    for instance in dialog_state.dialog_stack:
+        if "stepIndex" in instance.state:
+            steps.add((instance.id, instance.state["stepIndex"]))
+        if isinstance(instance.state.get("dialogs"), DialogState):
+            dialog_steps(instance.state["dialogs"], steps)
+
+
+@pytest.mark.asyncio
+async def test_dialog_state_codec_round_trips_every_waterfall_step(tmp_path):
+    """Check that the codec encodes the conversation state losslessly at every waterfall step, in fewer bytes than pickle
+    """
+    config = DefaultConfig()
+    config.LUIS_APP_ID = ""
+    storage = SqliteStorage(str(tmp_path / "state.db"), dumps=dialog_state_codec.dumps, loads=dialog_state_codec.loads)
+    recognizer = FlightBookingRecognizer(config, local_recognizer=LocalFlightBookingRecognizer())
+    bot = DialogAndWelcomeBot(
+        ConversationState(storage), UserState(storage), MainDialog(recognizer, BookingDialog()), None
+    )
+    adapter = TestAdapter(bot.on_turn)
+    key = f"{adapter.template.channel_id}/conversations/{adapter.template.conversation.id}"
+
+    steps = set()
+    for text in ["hello", "book a flight", "Paris", "London", "may", "5 may 2027", "12 may 2027", "300 euros", "yes"]:
+        await adapter.receive_activity(text)
+        stored = (await storage.read([key]))[key]
+        data = dialog_state_codec.dumps(stored)
+        decoded = dialog_state_codec.loads(data)
+        # jsonpickle flattens the states to detect their changes: both must flatten alike
+        assert jsonpickle.Pickler().flatten(decoded) == jsonpickle.Pickler().flatten(stored)
+        assert dialog_state_codec.dumps(decoded) == data
+        assert len(data) < len(pickle.dumps(stored, pickle.HIGHEST_PROTOCOL)) / 2
+        dialog_steps(decoded["DialogState"], steps)
+
+    booking_steps = {("WaterfallDialog", index) for index in range(6)}
+    assert booking_steps | {("WFDialog", 0), ("WFDialog", 1), ("WaterfallDialog2", 0)} <= steps
+    assert adapter.activity_buffer[-1].text.startswith("Thanks for using this service.")
+    # rows pickled before the codec are still read
+    assert dialog_state_codec.dumps(dialog_state_codec.loads(pickle.dumps(stored))) == data
+    await storage.close()
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+from command_router_middleware import CommandRouterMiddleware
+from helpers.command_matcher import CANCEL, HELP, CommandMatcher
+
+
+def test_command_matcher_understands_phrases_by_locale():
+    """Check that whole utterances are matched in the locale of the activity and in the default one
+    """
+    matcher = CommandMatcher()
+    assert matcher.match(" Help! ") == HELP and matcher.match("?") == HELP
+    assert matcher.match("QUIT") == CANCEL
+    assert matcher.match("Annuler", "fr-FR") == CANCEL and matcher.match("cancel", "fr-FR") == CANCEL
+    assert matcher.match("annuler") is None and matcher.match("annuler", "de-DE") is None
+    assert matcher.match("cancel my flight to Paris") is None and matcher.match(None) is None
+
+    matcher.compile({HELP: {"en": ["what can you do"]}, CANCEL: {"en": ["stop"]}})
+    assert matcher.match("What can you do") == HELP and matcher.match("stop") == CANCEL
+    assert matcher.match("help") is None
+
+
+@pytest.mark.asyncio
+async def test_command_router_answers_help_and_cancel_before_the_dialogs():
+    """Check that help touches no state, that cancel only deletes the conversation state, and that the rest reaches the bot
+    """
+    storage = CountingStorage()
+    storage.deletes = []
+    delete = storage.delete
+
+    async def counting_delete(keys):
+        storage.deletes.append(sorted(keys))
+        await delete(keys)
+
+    storage.delete = counting_delete
+    conversation_state = ConversationState(storage)
+    dialog_state = conversation_state.create_property("DialogState")
+    turns = []
+
+    async def logic(turn_context: TurnContext):
+        turns.append(turn_context.activity.text)
+        await dialog_state.set(turn_context, {"step": len(turns)})
+        await conversation_state.save_changes(turn_context)
+        await turn_context.send_activity("bot")
+
+    adapter = TestAdapter(logic).use(CommandRouterMiddleware(conversation_state))
+    await adapter.test("book a flight", "bot")
+    reads, writes = len(storage.reads), len(storage.writes)
+
+    await adapter.test("Help", "Show Help...")
+    assert (len(storage.reads), len(storage.writes), storage.deletes) == (reads, writes, [])
+
+    await adapter.test("quit", "Cancelling")
+    assert storage.deletes == storage.writes[:1]  # the conversation state written by the first turn
+    assert (len(storage.reads), len(storage.writes)) == (reads, writes)
+    assert await storage.read(storage.deletes[0]) == {}
+    assert turns == ["book a flight"]
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+from botbuilder.core import CardFactory, MessageFactory
+from botbuilder.schema import DeliveryModes, HeroCard
+from outbound_batching_middleware import BUFFER_KEY, OutboundBatchingMiddleware
+
+
+@pytest.mark.asyncio
+async def test_outbound_batching_sends_a_turn_in_one_call():
+    """Check that the replies of a turn are merged into one send, also when the turn fails, and that expectReplies turns are left alone
+    """
+    async def logic(turn_context: TurnContext):
+        if turn_context.activity.delivery_mode == DeliveryModes.expect_replies:
+            assert BUFFER_KEY not in turn_context.turn_state
+        await turn_context.send_activity(MessageFactory.attachment(CardFactory.hero_card(HeroCard(title="ticket"))))
+        await turn_context.send_activity("Thanks for using this service.")
+        await turn_context.send_activity(MessageFactory.text("What else?", input_hint="expectingInput"))
+        if turn_context.activity.text == "fail":
+            raise Exception("failed")
+
+    adapter = TestAdapter(logic).use(OutboundBatchingMiddleware())
+    sends = []
+    send_activities = adapter.send_activities
+
+    async def counting_send_activities(context, activities):
+        if activities:  # the buffered sends reach the adapter with an empty list
+            sends.append(len(activities))
+        return await send_activities(context, activities)
+
+    adapter.send_activities = counting_send_activities
+
+    async def on_error(turn_context: TurnContext, error: Exception):
+        await turn_context.send_activity(f"error: {error}")
+
+    adapter.on_turn_error = on_error
+
+    await adapter.receive_activity("book")
+    assert sends == [1]
+    reply = adapter.activity_buffer.pop()
+    assert reply.text == "Thanks for using this service.\n\nWhat else?"
+    assert reply.attachments[0].content.title == "ticket" and reply.input_hint == "expectingInput"
+
+    await adapter.receive_activity("fail")
+    assert sends == [1, 1, 1]
+    assert [reply.text for reply in adapter.activity_buffer] == ["Thanks for using this service.\n\nWhat else?", "error: failed"]
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+from transcript_recorder import TranscriptRecorder, TranscriptRecorderMiddleware, read_transcript
+from benchmarks.replay_transcripts import load_conversations
+
+
+@pytest.mark.asyncio
+async def test_transcript_recorder_writes_redacted_turns_for_replays(tmp_path):
+    """Check that the activities received and the merged replies are recorded, redacted and readable while recording
+    """
+    async def logic(turn_context: TurnContext):
+        await turn_context.send_activity(f"you said {turn_context.activity.text}")
+        await turn_context.send_activity("anything else?")
+
+    path = str(tmp_path / "transcript.jsonl.gz")
+    recorder = TranscriptRecorder(path, flush_interval=0)
+    adapter = TestAdapter(logic).use(TranscriptRecorderMiddleware(recorder)).use(OutboundBatchingMiddleware())
+    adapter.template.from_property.name = "Ada Lovelace"
+    await adapter.receive_activity("mail me at ada@example.com or call +33 6 12 34 56 78")
+    await adapter.receive_activity("book a flight on 2022-10-12")
+
+    records = list(read_transcript(path))
+    assert [record["dir"] for record in records] == ["in", "out", "in", "out"]
+    assert records[0]["activity"]["text"] == "mail me at <email> or call <number>"
+    assert "name" not in records[0]["activity"]["from"]
+    assert records[3]["activity"]["text"] == "you said book a flight on 2022-10-12\n\nanything else?"
+    recorder.close()
+
+    conversations = load_conversations([path])
+    (turns,) = conversations.values()
+    assert [turn.activity["text"] for turn in turns] == ["mail me at <email> or call <number>", "book a flight on 2022-10-12"]
+    assert [len(turn.replies) for turn in turns] == [1, 1] and turns[1].duration >= 0
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+from aiohttp import ClientSession
+from admission_control import AdmissionController
+
+
+@pytest.mark.asyncio
+async def test_admission_control_sheds_requests_beyond_the_queue():
+    """Check that the requests beyond the turns in flight wait in order, and that those beyond the queue or its timeout are rejected before their body is read
+    """
+    release = asyncio.Event()
+    bodies_read = []
+
+    async def messages(request: web.Request) -> web.Response:
+        bodies_read.append(await request.json())
+        await release.wait()
+        return web.Response(text="ok")
+
+    async def health(request: web.Request) -> web.Response:
+        return web.Response(text="up")
+
+    admission = AdmissionController(max_in_flight=2, max_queue=2, queue_timeout=0.5)
+    app = web.Application(middlewares=[admission.middleware()])
+    app.router.add_post("/api/messages", messages)
+    app.router.add_get("/health", health)
+    server = TestServer(app)
+    await server.start_server()
+    try:
+        async with ClientSession() as session:
+
+            async def post(index: int):
+                async with session.post(server.make_url("/api/messages"), json={"index": index}) as response:
+                    return response.status, response.headers.get("Retry-After"), await response.text()
+
+            posts = [asyncio.ensure_future(post(index)) for index in range(4)]
+            while admission.queue_depth < 2:
+                await asyncio.sleep(0.01)
+            assert admission.in_flight == 2 and len(bodies_read) == 2
+
+            status, retry_after, _ = await post(4)
+            assert status == 429 and int(retry_after) >= 1
+            async with session.get(server.make_url("/health")) as response:
+                assert response.status == 200
+
+            release.set()
+            assert [status for status, _, _ in await asyncio.gather(*posts)] == [200, 200, 200, 200]
+            assert len(bodies_read) == 4 and admission.in_flight == 0 and admission.queue_depth == 0
+
+            release.clear()
+            posts = [asyncio.ensure_future(post(index)) for index in range(3)]
+            results = await asyncio.gather(posts[2], asyncio.sleep(0.7))
+            assert results[0][0] == 503 and results[0][1] is not None
+            release.set()
+            await asyncio.gather(*posts)
+    finally:
+        await server.close()
+
+    assert admission.stats == {
+        "admitted": 6, "queued": 3, "rejected_queue_full": 1, "rejected_timeout": 1, "max_queue_depth": 2,
+    }
+    assert admission.in_flight == 0 and admission.queue_depth == 0 and len(bodies_read) == 6
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+from conversation_lock_middleware import ConversationLockMiddleware
+
+
+@pytest.mark.asyncio
+async def test_conversation_lock_serializes_the_turns_of_a_conversation():
+    """Check that concurrent turns of a conversation see each other's state, that other conversations run meanwhile, and that idle locks are dropped
+    """
+    conversation_state = ConversationState(MemoryStorage())
+    count = conversation_state.create_property("count")
+    running = []
+    max_running = []
+
+    async def logic(turn_context: TurnContext):
+        running.append(turn_context.activity.conversation.id)
+        max_running.append(len(running))
+        value = await count.get(turn_context, lambda: 0)
+        await asyncio.sleep(0.05)
+        await count.set(turn_context, value + 1)
+        await conversation_state.save_changes(turn_context)
+        running.remove(turn_context.activity.conversation.id)
+        await turn_context.send_activity(f"{value + 1}")
+
+    middleware = ConversationLockMiddleware()
+    adapter = TestAdapter(logic).use(middleware)
+
+    def activity(conversation_id: str) -> Activity:
+        return Activity(
+            type=ActivityTypes.message, text="book", conversation=ConversationAccount(id=conversation_id)
+        )
+
+    await asyncio.gather(*(adapter.receive_activity(activity(name)) for name in ("a", "a", "a", "b")))
+    replies = {}
+    for reply in adapter.activity_buffer:
+        replies.setdefault(reply.conversation.id, []).append(reply.text)
+    assert replies == {"a": ["1", "2", "3"], "b": ["1"]}
+    assert max(max_running) == 2  # one turn of a and the turn of b
+    assert middleware.locks.stats == {"acquired": 4, "contended": 2}
+    assert len(middleware.locks) == 0
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+import time
+from botbuilder.core import BotFrameworkAdapterSettings
+from botframework.connector.auth import ChannelValidation, JwtTokenExtractor
+from adapter_with_error_handler import AdapterWithErrorHandler
+from cached_authentication import OpenIdMetadataRefresher, TokenValidationCache
+from openid_stub_issuer import METADATA_ROUTE, StubIssuer
+
+
+@pytest.mark.asyncio
+async def test_validated_tokens_are_cached_until_they_expire():
+    """Check that a token is verified once until its exp, per service url, and that the signing keys are fetched ahead of the turns
+    """
+    issuer = StubIssuer()
+    server = TestServer(issuer.create_app())
+    await server.start_server()
+    metadata_url = str(server.make_url(METADATA_ROUTE))
+    app_id = str(uuid4())
+    now = [time.time()]
+    token_cache = TokenValidationCache(timer=lambda: now[0])
+    settings = BotFrameworkAdapterSettings(app_id, "secret", open_id_metadata=metadata_url)
+    adapter = AdapterWithErrorHandler(settings, ConversationState(MemoryStorage()), token_cache)
+    refresher = OpenIdMetadataRefresher([metadata_url], retry_interval=0)
+    try:
+        refresher.start()
+        await refresher.wait_refreshed()
+        assert dict(issuer.stats) == {"metadata": 1, "keys": 1}
+
+        def activity(service_url: str) -> Activity:
+            return Activity(type=ActivityTypes.message, channel_id="test", service_url=service_url, text="hi")
+
+        header = "Bearer " + issuer.token(app_id, "https://channel")
+        identity = await adapter._authenticate_request(activity("https://channel"), header)
+        assert identity.claims["aud"] == app_id
+        assert await adapter._authenticate_request(activity("https://channel"), header) is identity
+        with pytest.raises(PermissionError):
+            await adapter._authenticate_request(activity("https://elsewhere"), header)
+        with pytest.raises(Exception):
+            await adapter._authenticate_request(activity("https://channel"), header[:-8] + "AAAAAAAA")
+        assert (token_cache.stats["hits"], token_cache.stats["misses"], token_cache.stats["size"]) == (1, 3, 1)
+
+        # The token is verified again once it expired (and not cached, since it is)
+        now[0] += 3600
+        await adapter._authenticate_request(activity("https://channel"), header)
+        assert (token_cache.stats["expirations"], token_cache.stats["size"]) == (1, 0)
+
+        # A token signed by a new key fetches the keys once
+        issuer.rotate()
+        header = "Bearer " + issuer.token(app_id, "https://channel")
+        await adapter._authenticate_request(activity("https://channel"), header)
+        assert dict(issuer.stats) == {"metadata": 2, "keys": 2}
+        assert refresher.metadata[0].stats == {"refreshes": 2, "unknown_keys": 1}
+    finally:
+        await refresher.stop()
+        await server.close()
+        ChannelValidation.open_id_metadata_endpoint = None
+        JwtTokenExtractor.metadataCache.pop(metadata_url, None)
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+import asyncio
+from http import HTTPStatus
+from warm_up import WARM_UP_SCRIPT, WarmUp, run_synthetic_turns
+
+
+@pytest.mark.asyncio
+async def test_warm_up_runs_a_synthetic_booking_before_ready():
+    """Check that the synthetic turns book a flight and leave no state behind, that a failed step does not block readiness, and that a slow first fetch of the signing keys does not stop their refresher
+    """
+    config = DefaultConfig()
+    config.LUIS_APP_ID = ""
+    storage = MemoryStorage()
+    conversation_state, user_state = ConversationState(storage), UserState(storage)
+    recognizer = FlightBookingRecognizer(config, local_recognizer=LocalFlightBookingRecognizer())
+    bot = DialogAndWelcomeBot(conversation_state, user_state, MainDialog(recognizer, BookingDialog()), None)
+
+    async def fail():
+        raise ConnectionError("LUIS unreachable")
+
+    async def stall(request):  # pylint: disable=unused-argument
+        await asyncio.sleep(0.5)
+        return web.Response(status=HTTPStatus.SERVICE_UNAVAILABLE)
+
+    metadata_app = web.Application()
+    metadata_app.router.add_get(METADATA_ROUTE, stall)
+    server = TestServer(metadata_app)
+    await server.start_server()
+    metadata_url = str(server.make_url(METADATA_ROUTE))
+    refresher = OpenIdMetadataRefresher([metadata_url])
+    try:
+        refresher.start()
+        warm_up = WarmUp(
+            {
+                "turns": lambda: run_synthetic_turns(bot.on_turn, conversation_state, user_state),
+                "luis": fail,
+                "openid": refresher.wait_refreshed,
+            },
+            timeout=0.2,
+        )
+        warm_up.start()
+        assert not warm_up.ready
+        await warm_up.wait()
+        assert warm_up.ready
+        assert set(warm_up.errors) == {"luis", "openid"}
+        assert set(warm_up.durations) == {"turns", "luis", "openid", "total"}
+        assert not storage.memory
+
+        # The step timed out, the fetch goes on and the refresher keeps running
+        await refresher.wait_refreshed()
+        assert refresher.metadata[0].stats == {"refresh_errors": 1}
+        assert not refresher._refresher.done()
+    finally:
+        await refresher.stop()
+        await server.close()
+        JwtTokenExtractor.metadataCache.pop(metadata_url, None)
+
+    replies = await run_synthetic_turns(bot.on_turn, conversation_state, user_state)
+    assert replies > len(WARM_UP_SCRIPT)
+    assert not storage.memory
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+from dialogs.booking_dialog import BOOKINGS
+from helpers.luis_helper import INTENTS
+from helpers.metrics import ACTIVITY_TYPES, EventLoopLagMonitor, MetricsRegistry, bounded_label, channel_label
+from helpers.timing import TimingRegistry
+
+
+@pytest.mark.asyncio
+async def test_metrics_render_counters_gauges_and_span_histograms():
+    """Check the Prometheus text of the metrics, the intents and bookings counted by a booking, and the event loop lag
+    """
+    timings = TimingRegistry(buckets=(0.1, 1.0))
+    registry = MetricsRegistry(timings=timings)
+    turns = registry.counter("turns_total", "Activities received.", ("channel", "type"))
+    turns.inc("emulator", "message")
+    turns.inc("emulator", "message")
+    assert registry.counter("turns_total", "Activities received.") is turns
+    registry.gauge("state_entries", "Items in the state store.", lambda: 3)
+    registry.gauge("missing", "Nothing to report.", lambda: None)
+    timings.histogram("luis").observe(0.05)
+    timings.histogram("luis").observe(2.0)
+    registry.const_labels["pid"] = "42"
+    assert registry.render() == "\n".join([
+        "# HELP flybot_turns_total Activities received.",
+        "# TYPE flybot_turns_total counter",
+        'flybot_turns_total{pid="42",channel="emulator",type="message"} 2',
+        "# HELP flybot_state_entries Items in the state store.",
+        "# TYPE flybot_state_entries gauge",
+        'flybot_state_entries{pid="42"} 3',
+        "# HELP flybot_missing Nothing to report.",
+        "# TYPE flybot_missing gauge",
+        "# HELP flybot_span_seconds Durations of the stages of the turns, and of the event loop lag.",
+        "# TYPE flybot_span_seconds histogram",
+        'flybot_span_seconds_bucket{pid="42",span="luis",le="0.1"} 1',
+        'flybot_span_seconds_bucket{pid="42",span="luis",le="1.0"} 1',
+        'flybot_span_seconds_bucket{pid="42",span="luis",le="+Inf"} 2',
+        'flybot_span_seconds_sum{pid="42",span="luis"} 2.05',
+        'flybot_span_seconds_count{pid="42",span="luis"} 2',
+        "",
+    ])
+
+    # A booking through the bot counts its intent and its outcome, by channel, unless it is a synthetic one
+    config = DefaultConfig()
+    config.LUIS_APP_ID = ""
+    storage = MemoryStorage()
+    conversation_state, user_state = ConversationState(storage), UserState(storage)
+    recognizer = FlightBookingRecognizer(config, local_recognizer=LocalFlightBookingRecognizer())
+    bot = DialogAndWelcomeBot(conversation_state, user_state, MainDialog(recognizer, BookingDialog()), None)
+    intents, bookings = INTENTS.values.get(("test", "Book"), 0), BOOKINGS.values.get(("test", "success"), 0)
+    adapter = TestAdapter(bot.on_turn)
+    for text in WARM_UP_SCRIPT[1:]:
+        await adapter.receive_activity(text)
+    assert INTENTS.values[("test", "Book")] == intents + 1
+    assert BOOKINGS.values[("test", "success")] == bookings + 1
+    counted = (dict(INTENTS.values), dict(BOOKINGS.values))
+    await run_synthetic_turns(bot.on_turn, conversation_state, user_state)
+    assert (INTENTS.values, BOOKINGS.values) == counted
+
+    # The loop lag is the time the loop was held
+    monitor = EventLoopLagMonitor(interval=0.01, timings=timings)
+    monitor.start()
+    await asyncio.sleep(0.02)
+    time.sleep(0.05)
+    await asyncio.sleep(0.02)
+    await monitor.stop()
+    assert timings.histograms["loop.lag"].sum >= 0.04
+
+
+def test_metrics_labels_of_the_clients_are_bounded():
+    """Check that an activity without a channel id, or with made-up labels, is counted under bounded labels and renders
+    """
+    registry = MetricsRegistry(timings=TimingRegistry())
+    turns = registry.counter("turns_total", "Activities processed.", ("channel", "type"))
+    for activity in [
+        Activity(type=ActivityTypes.message, channel_id="emulator"),
+        Activity(type=ActivityTypes.message),
+        Activity(channel_id="made-up", type="made-up"),
+    ]:
+        turns.inc(channel_label(activity.channel_id), bounded_label(activity.type, ACTIVITY_TYPES))
+    # Label values of different types still sort
+    turns.inc(None, "message")
+    assert registry.render().splitlines()[2:] == [
+        'flybot_turns_total{channel="None",type="message"} 1',
+        'flybot_turns_total{channel="emulator",type="message"} 1',
+        'flybot_turns_total{channel="other",type="other"} 1',
+        'flybot_turns_total{channel="unknown",type="message"} 1',
+    ]
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+import os
+import signal
+import socket
+import subprocess
+import urllib.request
+
+WORKERS_SCRIPT = """
+import os, sys
+from aiohttp import web
+import workers
+
+workers.MIN_WORKER_LIFETIME = 0.2
+
+async def pid(request):
+    return web.Response(text=str(os.getpid()))
+
+async def crash(app):
+    raise RuntimeError("no storage")
+
+app = web.Application()
+app.router.add_get("/", pid)
+if sys.argv[2] == "crash":
+    app.on_startup.append(crash)
+workers.run_workers(app, "127.0.0.1", int(sys.argv[1]), 2, shutdown_timeout=1)
+"""
+
+
+def start_workers(mode: str):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    supervisor = subprocess.Popen(
+        [sys.executable, "-c", WORKERS_SCRIPT, str(port), mode],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    return supervisor, f"http://127.0.0.1:{port}/"
+
+
+def get_worker_pid(url: str, timeout: float = 10.0) -> int:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                return int(response.read())
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def test_workers_serve_on_one_socket_and_restart_the_dead_ones():
+    """Check that forked workers serve a request, that a killed worker is restarted, and that a worker crashing at startup is given up with its traceback
+    """
+    supervisor, url = start_workers("serve")
+    try:
+        pid = get_worker_pid(url)
+        assert pid != supervisor.pid
+        os.kill(pid, signal.SIGKILL)
+        # Both workers answer on the socket: the restarted one shows up among them
+        pids = {get_worker_pid(url) for _ in range(40)}
+        assert pid not in pids
+    finally:
+        supervisor.send_signal(signal.SIGTERM)
+        _, errors = supervisor.communicate(timeout=10)
+    assert supervisor.returncode == 0
+    assert f"(pid {pid}) exited with status" in errors and "restarting" in errors
+
+    supervisor, _ = start_workers("crash")
+    _, errors = supervisor.communicate(timeout=30)
+    assert supervisor.returncode != 0
+    assert "RuntimeError: no storage" in errors
+    assert errors.count("giving it up") == 2
+    assert "every worker crashed" in errors
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+def test_importing_app_leaves_the_bot_sdk_unloaded():
+    """Check that importing app.py does not import the bot SDK nor the telemetry client, which create_app imports
+    """
+    loaded = subprocess.run(
+        [sys.executable, "-c", "import sys, app; print(' '.join(sorted(sys.modules)))"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True,
+    ).stdout.split()
+    for module in ("botbuilder.core", "botframework.connector", "buffered_telemetry_client"):
+        assert module not in loaded
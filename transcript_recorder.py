@@ -0,0 +1,142 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Recorder of the activities received and sent by the bot, as gzipped JSON lines for later replays."""
+
+import gzip
+import json
+import os
+import re
+import time
+import zlib
+from typing import Awaitable, Callable, Iterable, Iterator, List, Optional
+
+from botbuilder.core import Middleware, TurnContext
+from botbuilder.schema import Activity
+
+# A redactor gets the serialized activity of a record and returns it redacted, or None to drop the record
+Redactor = Callable[[dict], Optional[dict]]
+
+EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+# Phone and card numbers: 9 digits or more, possibly grouped by spaces or dots (not dates)
+LONG_NUMBER = re.compile(r"\+?\d(?:[ .]?\d){8,}")
+
+
+def redact_text(pattern: re.Pattern, replacement: str) -> Redactor:
+    """Replaces the matches of pattern in the text and speak of the activity."""
+
+    def redact(activity: dict) -> dict:
+        for field in ("text", "speak"):
+            if isinstance(activity.get(field), str):
+                activity[field] = pattern.sub(replacement, activity[field])
+        return activity
+
+    return redact
+
+
+def drop_fields(*paths: str) -> Redactor:
+    """Removes fields of the activity, by their dotted path in the serialized activity, ie "from.name"."""
+    split_paths = [path.split(".") for path in paths]
+
+    def redact(activity: dict) -> dict:
+        for path in split_paths:
+            parent = activity
+            for name in path[:-1]:
+                parent = parent.get(name) if isinstance(parent, dict) else None
+            if isinstance(parent, dict):
+                parent.pop(path[-1], None)
+        return activity
+
+    return redact
+
+
+DEFAULT_REDACTORS = (
+    redact_text(EMAIL, "<email>"),
+    redact_text(LONG_NUMBER, "<number>"),
+    drop_fields("from.name", "recipient.name", "channelData"),
+)
+
+
+class TranscriptRecorder:
+    """
+    Appends records {"t": epoch seconds, "dir": "in" or "out", "activity": serialized activity} to a gzipped
+    JSON lines file. The file is opened on the first record of each process, so put "{pid}" in the path
+    when several worker processes record. The compressed stream is flushed every flush_interval seconds,
+    so that a crash loses at most that much, and readers can follow the file.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        redactors: Iterable[Redactor] = DEFAULT_REDACTORS,
+        flush_interval: float = 5.0,
+        timer: Callable[[], float] = time.time,
+    ):
+        self.path = path
+        self.redactors = list(redactors)
+        self.flush_interval = flush_interval
+        self._timer = timer
+        self._pid = None
+        self._file = None
+        self._flushed_at = 0.0
+        self.records = 0
+
+    def record(self, direction: str, activity: Activity, at: float = None) -> None:
+        serialized = activity.serialize()
+        for redactor in self.redactors:
+            serialized = redactor(serialized)
+            if serialized is None:
+                return
+        at = self._timer() if at is None else at
+        line = json.dumps({"t": round(at, 6), "dir": direction, "activity": serialized}, separators=(",", ":"))
+        gzip_file = self._open()
+        gzip_file.write(line.encode("utf-8") + b"\n")
+        self.records += 1
+        if at - self._flushed_at >= self.flush_interval:
+            gzip_file.flush(zlib.Z_SYNC_FLUSH)
+            self._flushed_at = at
+
+    def close(self) -> None:
+        if self._file is not None and self._pid == os.getpid():
+            self._file.close()
+        self._file = None
+
+    def _open(self) -> gzip.GzipFile:
+        if self._pid != os.getpid() or self._file is None:
+            self._pid = os.getpid()
+            # Appending adds a gzip member, which gzip readers read as the continuation of the file
+            self._file = gzip.open(self.path.format(pid=self._pid), "ab")
+        return self._file
+
+
+def read_transcript(path: str) -> Iterator[dict]:
+    """The records of a transcript, gzipped or not, up to its last complete line if it is still written."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as transcript:
+        try:
+            for line in transcript:
+                if line.endswith(b"\n"):
+                    yield json.loads(line)
+        except EOFError:
+            pass  # the end of the stream is not written yet
+
+
+class TranscriptRecorderMiddleware(Middleware):
+    """
+    Records the activity received by each turn, and the activities the bot sends as they are sent.
+    Register it first, so that it records what the other middlewares let through, ie the merged replies.
+    """
+
+    def __init__(self, recorder: TranscriptRecorder):
+        self.recorder = recorder
+
+    async def on_turn(self, context: TurnContext, logic: Callable[[], Awaitable]):
+        self.recorder.record("in", context.activity)
+        context.on_send_activities(self._on_send_activities)
+        await logic()
+
+    async def _on_send_activities(self, context: TurnContext, activities: List[Activity], next_send: Callable):
+        responses = await next_send()
+        # The list is read once the other handlers ran, since they may hold activities back
+        for activity in activities:
+            self.recorder.record("out", activity)
+        return responses
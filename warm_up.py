@@ -0,0 +1,96 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Warm-up of the bot before it reports ready, so that the first real turn pays none of the one-time costs."""
+
+import asyncio
+import os
+import sys
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from botbuilder.core import BotState, TurnContext
+from botbuilder.core.adapters import TestAdapter
+from botbuilder.schema import Activity, ActivityTypes, ChannelAccount, ConversationAccount
+
+from helpers.metrics import uncounted
+from helpers.state_helper import StateHelper
+
+WARM_UP_CHANNEL = "warmup"
+# A booking through every prompt: it builds the dialogs, loads the date models of the prompts and
+# renders the welcome and ticket cards. None stands for the conversation update adding the user.
+WARM_UP_SCRIPT = (None, "hello", "book a flight from Paris to London", "12 may 2023", "20 may 2023", "500", "yes")
+
+
+async def run_synthetic_turns(
+    logic: Callable[[TurnContext], Awaitable], *bot_states: BotState, script=WARM_UP_SCRIPT
+) -> int:
+    """
+    Runs the script through the bot logic on a local adapter, in a conversation of the warmup channel,
+    then deletes the states the turns wrote. The turns are not counted in the metrics. Returns the
+    number of replies.
+    """
+    user = ChannelAccount(id="warmup-user", name="warmup")
+    template = Activity(
+        channel_id=WARM_UP_CHANNEL,
+        service_url="https://warmup",
+        from_property=user,
+        recipient=ChannelAccount(id="bot", name="Bot"),
+        conversation=ConversationAccount(id=f"warmup-{os.getpid()}"),
+    )
+    adapter = TestAdapter(logic, template)
+    with uncounted():
+        for text in script:
+            if text is None:
+                await adapter.receive_activity(Activity(type=ActivityTypes.conversation_update, members_added=[user]))
+            else:
+                await adapter.receive_activity(text)
+    await StateHelper.delete_all(TurnContext(adapter, template), *bot_states)
+    return len(adapter.activity_buffer)
+
+
+class WarmUp:
+    """
+    Runs the warm-up steps at once in the background, each within timeout seconds. The bot is ready
+    once they all ended, whether they succeeded or not: a failed step only leaves its cost to the
+    first turns, and is reported in errors.
+    """
+
+    def __init__(self, steps: Dict[str, Callable[[], Awaitable]], timeout: float = 30.0):
+        self.steps = steps
+        self.timeout = timeout
+        self.durations: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self.ready = False
+        self._task: Optional[asyncio.Future] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def wait(self) -> None:
+        if self._task is not None:
+            await asyncio.shield(self._task)
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        start = time.perf_counter()
+        await asyncio.gather(*(self._run_step(name, step) for name, step in self.steps.items()))
+        self.durations["total"] = time.perf_counter() - start
+        self.ready = True
+
+    async def _run_step(self, name: str, step: Callable[[], Awaitable]):
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(step(), self.timeout)
+        except Exception as error:  # pylint: disable=broad-except
+            self.errors[name] = repr(error)
+            print(f"[WarmUp]: {name} failed: {error!r}", file=sys.stderr)
+        finally:
+            self.durations[name] = time.perf_counter() - start
@@ -0,0 +1,130 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Supervised multi-process mode for the aiohttp app."""
+
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+from aiohttp import web
+
+# A worker that dies sooner than this after being started is restarted with a delay, doubled on each
+# such crash in a row up to MAX_RESTART_DELAY, so that a crashing worker does not spin the supervisor.
+# After MAX_QUICK_CRASHES of them in a row, the worker is not restarted any more.
+MIN_WORKER_LIFETIME = 1.0
+MAX_RESTART_DELAY = 30.0
+MAX_QUICK_CRASHES = 5
+
+
+def create_listening_socket(host: str, port: int, backlog: int = 128) -> socket.socket:
+    """Binds the socket that all the workers accept connections on."""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_workers(app: web.Application, host: str, port: int, workers: int, shutdown_timeout: float = 60.0):
+    """
+    Forks workers processes serving app on a shared listening socket, and restarts the ones that die.
+    A worker crashing MAX_QUICK_CRASHES times in a row right after being started is given up, and
+    RuntimeError is raised once every worker was.
+    The app, with its dialogs, recognizers and card templates, must be built before calling this
+    function: the workers inherit it copy-on-write instead of building their own.
+    SIGINT and SIGTERM stop the workers, then the supervisor.
+    """
+    if workers <= 1 or not hasattr(os, "fork"):
+        web.run_app(app, host=host, port=port, shutdown_timeout=shutdown_timeout)
+        return
+
+    sock = create_listening_socket(host, port)
+
+    # Move the preloaded objects out of the reach of the garbage collector, so that collections
+    # in the workers do not write to (and copy) the pages they share with the supervisor.
+    gc.collect()
+    if hasattr(gc, "freeze"):
+        gc.freeze()
+
+    children = {}
+    quick_crashes = [0] * workers
+    stopping = False
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            exit_code = 0
+            try:
+                web.run_app(
+                    app,
+                    sock=sock,
+                    shutdown_timeout=shutdown_timeout,
+                    print=lambda *args: None,
+                )
+            except BaseException:  # pylint: disable=broad-except
+                # os._exit does not report the error, nor flush the streams
+                traceback.print_exc(file=sys.stderr)
+                exit_code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(exit_code)  # pylint: disable=protected-access
+        children[pid] = (index, time.monotonic())
+        print(f"Worker {index} started (pid {pid})", file=sys.stderr)
+
+    def stop(signum, frame):  # pylint: disable=unused-argument
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    print(f"Serving on http://{host}:{port} with {workers} workers (pid {os.getpid()})", file=sys.stderr)
+    for index in range(workers):
+        spawn(index)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index, started = children.pop(pid, (None, None))
+        if index is None or stopping:
+            continue
+        if time.monotonic() - started < MIN_WORKER_LIFETIME:
+            quick_crashes[index] += 1
+        else:
+            quick_crashes[index] = 0
+        if quick_crashes[index] >= MAX_QUICK_CRASHES:
+            print(
+                f"Worker {index} (pid {pid}) exited with status {status}, "
+                f"{quick_crashes[index]} times in a row after its start: giving it up",
+                file=sys.stderr,
+            )
+            continue
+        delay = min(MIN_WORKER_LIFETIME * 2 ** (quick_crashes[index] - 1), MAX_RESTART_DELAY) if quick_crashes[index] else 0
+        print(
+            f"Worker {index} (pid {pid}) exited with status {status}, restarting in {delay:g}s",
+            file=sys.stderr,
+        )
+        time.sleep(delay)
+        if not stopping:
+            spawn(index)
+
+    sock.close()
+    if not stopping:
+        raise RuntimeError("[run_workers]: every worker crashed right after its start, see their tracebacks above")